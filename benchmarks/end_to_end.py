@@ -0,0 +1,396 @@
+import asyncio
+from multiprocessing import get_context
+from os import cpu_count, environ
+from queue import Empty
+from socket import socket
+from sys import platform
+from time import perf_counter, sleep
+
+import click
+import requests
+from rich.console import Console
+from rich.table import Table
+
+from benchmarks.mock_server import run_server
+from benchmarks.synthetic import generate_bulk_mitigations
+from utils.api import API
+from utils.async_api import AsyncAPI
+from utils.bulk_mitigate import async_bulk_mitigate, bulk_mitigate
+from utils.list_of_applications import (
+    ApplicationCache,
+    acquire_applications,
+    async_acquire_applications,
+)
+from utils.planner import plan_scans
+from utils.processor import (
+    MatchPool,
+    async_process,
+    process,
+    sort_and_filter_mitigations,
+)
+from utils.retry import RetryPolicy
+
+console = Console(log_path=False)
+
+STRATEGIES = ["threads", "async", "processes"]
+SERVER_START_TIMEOUT_SECONDS = 60
+MAX_CWES_PER_REQUEST = 10
+FINDINGS_PAGE_SIZE = 500
+PARALLEL_PAGES = 4
+ANNOTATION_BATCH_SIZE = 100
+RETRY_BUDGET = 100_000
+
+
+# Skips the connectivity check, which goes to the real region of the credentials
+class OfflineAPI(API):
+    def assert_connection(self) -> None:
+        pass
+
+
+class PhaseResult:
+    def __init__(self, name: str, seconds: float, counts: dict[str, int]):
+        self.name = name
+        self.seconds = seconds
+        self.counts = counts
+
+    def get_request_count(self) -> int:
+        return sum(
+            count
+            for name, count in self.counts.items()
+            if name not in ("annotated_flaws", "findings_returned")
+        )
+
+
+def get_free_port() -> int:
+    with socket() as listener:
+        listener.bind(("127.0.0.1", 0))
+        return listener.getsockname()[1]
+
+
+def get_server_stats(base_url: str) -> dict[str, int]:
+    return requests.get(base_url + "stats", timeout=10).json()
+
+
+def wait_for_server(base_url: str) -> None:
+    deadline = perf_counter() + SERVER_START_TIMEOUT_SECONDS
+
+    while True:
+        try:
+            get_server_stats(base_url)
+            return
+        except requests.ConnectionError:
+            if perf_counter() > deadline:
+                raise
+
+            sleep(0.1)
+
+
+def get_peak_rss_mb() -> float:
+    # Of the client only, not its match processes. Not available on Windows
+    import resource
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Reported in bytes on macOS and kilobytes elsewhere
+    return peak / 1_000_000 if platform == "darwin" else peak / 1000
+
+
+class PhaseTimer:
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+        self.results: list[PhaseResult] = []
+        self._name = None
+        self._start = None
+        self._stats_before = None
+
+    def start(self, name: str) -> None:
+        self._name = name
+        self._stats_before = get_server_stats(self.base_url)
+        self._start = perf_counter()
+
+    def stop(self) -> None:
+        seconds = perf_counter() - self._start
+        stats_after = get_server_stats(self.base_url)
+
+        self.results.append(
+            PhaseResult(
+                self._name,
+                seconds,
+                {
+                    name: count - self._stats_before.get(name, 0)
+                    for name, count in stats_after.items()
+                    if count != self._stats_before.get(name, 0)
+                },
+            )
+        )
+
+
+def run_threads(
+    base_url: str,
+    bulk_mitigations,
+    concurrency: int,
+    match_process_count: int,
+    timer: PhaseTimer,
+) -> None:
+    quiet_console = Console(quiet=True)
+    retry_policy = RetryPolicy(quiet_console, RETRY_BUDGET)
+    api = OfflineAPI(quiet_console, concurrency, retry_policy, base_url=base_url)
+    match_pool = (
+        None
+        if match_process_count < 1
+        else MatchPool(bulk_mitigations, match_process_count)
+    )
+
+    try:
+        timer.start("Listing applications")
+        all_applications = retry_policy.run(api.get_all_applications)
+        timer.stop()
+
+        timer.start("Identifying sandboxes")
+        applications_to_process = acquire_applications(
+            quiet_console,
+            api,
+            bulk_mitigations,
+            [application["profile"]["name"] for application in all_applications],
+            ApplicationCache(quiet_console, None),
+            concurrency,
+            all_applications=all_applications,
+        )
+        timer.stop()
+
+        scan_plans = plan_scans(
+            quiet_console,
+            bulk_mitigations,
+            applications_to_process,
+            MAX_CWES_PER_REQUEST,
+        )
+        mitigations = []
+
+        timer.start("Processing scans")
+        process(
+            quiet_console,
+            api,
+            scan_plans,
+            mitigations,
+            concurrency,
+            findings_page_size=FINDINGS_PAGE_SIZE,
+            parallel_pages=PARALLEL_PAGES,
+            match_pool=match_pool,
+        )
+        timer.stop()
+
+        timer.start("Applying mitigations")
+        bulk_mitigate(
+            quiet_console,
+            api,
+            sort_and_filter_mitigations(quiet_console, mitigations),
+            concurrency,
+            ANNOTATION_BATCH_SIZE,
+        )
+        timer.stop()
+    finally:
+        if match_pool is not None:
+            match_pool.close()
+
+
+async def run_async(
+    base_url: str, bulk_mitigations, concurrency: int, timer: PhaseTimer
+) -> None:
+    quiet_console = Console(quiet=True)
+    retry_policy = RetryPolicy(quiet_console, RETRY_BUDGET)
+
+    async with AsyncAPI(
+        quiet_console, concurrency, retry_policy, base_url=base_url
+    ) as api:
+        timer.start("Listing applications")
+        all_applications = await api.get_all_applications()
+        timer.stop()
+
+        timer.start("Identifying sandboxes")
+        applications_to_process = await async_acquire_applications(
+            quiet_console,
+            api,
+            bulk_mitigations,
+            [application["profile"]["name"] for application in all_applications],
+            ApplicationCache(quiet_console, None),
+            all_applications=all_applications,
+        )
+        timer.stop()
+
+        scan_plans = plan_scans(
+            quiet_console,
+            bulk_mitigations,
+            applications_to_process,
+            MAX_CWES_PER_REQUEST,
+        )
+        mitigations = []
+
+        timer.start("Processing scans")
+        await async_process(
+            quiet_console,
+            api,
+            scan_plans,
+            mitigations,
+            findings_page_size=FINDINGS_PAGE_SIZE,
+            parallel_pages=PARALLEL_PAGES,
+        )
+        timer.stop()
+
+        timer.start("Applying mitigations")
+        await async_bulk_mitigate(
+            quiet_console,
+            api,
+            sort_and_filter_mitigations(quiet_console, mitigations),
+            ANNOTATION_BATCH_SIZE,
+        )
+        timer.stop()
+
+
+# Each strategy runs in a process of its own so the peak memory of one does not hide another's
+def run_strategy(
+    strategy: str, base_url: str, rule_count: int, concurrency: int, results
+) -> None:
+    # The mock server does not check the signatures, any well formed credentials will do
+    environ["VERACODE_API_KEY_ID"] = "0" * 32
+    environ["VERACODE_API_KEY_SECRET"] = "0" * 128
+
+    bulk_mitigations = generate_bulk_mitigations(Console(quiet=True), rule_count)
+    timer = PhaseTimer(base_url)
+
+    if strategy == "async":
+        asyncio.run(run_async(base_url, bulk_mitigations, concurrency, timer))
+    else:
+        run_threads(
+            base_url,
+            bulk_mitigations,
+            concurrency,
+            cpu_count() or 1 if strategy == "processes" else 0,
+            timer,
+        )
+
+    results.put((timer.results, get_peak_rss_mb()))
+
+
+def wait_for_results(client, results) -> tuple[list[PhaseResult], float]:
+    while True:
+        try:
+            return results.get(timeout=1)
+        except Empty:
+            # A run which failed never sends its results
+            if not client.is_alive():
+                return None
+
+
+def print_results(strategy: str, phases: list[PhaseResult], peak_rss_mb: float) -> None:
+    total_seconds = sum(phase.seconds for phase in phases)
+    table = Table(
+        title=f"{strategy}: {total_seconds:.1f}s, peak RSS {peak_rss_mb:.0f} MB"
+    )
+    table.add_column("Phase")
+    table.add_column("Wall (s)", justify="right")
+    table.add_column("Requests", justify="right")
+    table.add_column("Requests/s", justify="right")
+    table.add_column("Server counts")
+
+    for phase in phases:
+        request_count = phase.get_request_count()
+        table.add_row(
+            phase.name,
+            f"{phase.seconds:.2f}",
+            str(request_count),
+            f"{request_count / phase.seconds:.0f}" if phase.seconds > 0 else "-",
+            ", ".join(
+                f"{name} {count}" for name, count in sorted(phase.counts.items())
+            ),
+        )
+
+    console.print(table)
+
+
+@click.command()
+@click.option("--applications", default=1000, type=click.IntRange(min=1))
+@click.option("--sandboxes", default=5000, type=click.IntRange(min=0))
+@click.option("--findings", default=100000, type=click.IntRange(min=0))
+@click.option("--rules", default=100, type=click.IntRange(min=1))
+@click.option("--match-ratio", default=0.01, type=click.FloatRange(0, 1))
+@click.option("--latency-ms", default=20.0, type=click.FloatRange(min=0))
+@click.option("--throttle-rate", default=0.0, type=click.FloatRange(0, 1))
+@click.option("--retry-after-seconds", default=1, type=click.IntRange(min=0))
+@click.option("--error-rate", default=0.0, type=click.FloatRange(0, 1))
+@click.option("--concurrency", default=20, type=click.IntRange(min=1))
+@click.option(
+    "--strategy",
+    "strategies",
+    multiple=True,
+    default=STRATEGIES,
+    type=click.Choice(STRATEGIES),
+)
+def main(
+    applications: int,
+    sandboxes: int,
+    findings: int,
+    rules: int,
+    match_ratio: float,
+    latency_ms: float,
+    throttle_rate: float,
+    retry_after_seconds: int,
+    error_rate: float,
+    concurrency: int,
+    strategies: tuple[str, ...],
+):
+    # Spawned so the clients do not start with a copy of the server's portfolio
+    context = get_context("spawn")
+    port = get_free_port()
+    base_url = f"http://127.0.0.1:{port}/"
+    server = context.Process(
+        target=run_server,
+        args=(
+            port,
+            {
+                "application_count": applications,
+                "sandbox_count": sandboxes,
+                "finding_count": findings,
+                "rule_count": rules,
+                "match_ratio": match_ratio,
+            },
+            {
+                "latency_ms": latency_ms,
+                "throttle_rate": throttle_rate,
+                "retry_after_seconds": retry_after_seconds,
+                "error_rate": error_rate,
+            },
+        ),
+        daemon=True,
+    )
+    server.start()
+
+    try:
+        wait_for_server(base_url)
+        console.log(
+            f"Mock API serving {applications} applications, {sandboxes} sandboxes and {findings} findings with {latency_ms:.0f}ms latency"
+        )
+
+        for strategy in strategies:
+            results = context.Queue()
+            client = context.Process(
+                target=run_strategy,
+                args=(strategy, base_url, rules, concurrency, results),
+            )
+            client.start()
+            strategy_results = wait_for_results(client, results)
+            client.join()
+
+            if strategy_results is None:
+                console.log(
+                    f"Error: The {strategy} run exited with code {client.exitcode}"
+                )
+                continue
+
+            print_results(strategy, *strategy_results)
+    finally:
+        server.terminate()
+        server.join()
+
+
+if __name__ == "__main__":
+    main()
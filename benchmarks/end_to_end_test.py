@@ -0,0 +1,275 @@
+import asyncio
+from multiprocessing import get_context
+from os import environ
+from unittest import TestCase
+from unittest.mock import patch
+
+from rich.console import Console
+
+from benchmarks.end_to_end import (
+    OfflineAPI,
+    get_free_port,
+    get_server_stats,
+    wait_for_server,
+)
+from benchmarks.mock_server import Portfolio, get_application_guid, run_server
+from benchmarks.synthetic import generate_bulk_mitigations
+from utils.async_api import AsyncAPI
+from utils.bulk_mitigate import (
+    async_bulk_mitigate,
+    build_mitigation_batches,
+    bulk_mitigate,
+)
+from utils.list_of_applications import (
+    ApplicationCache,
+    acquire_applications,
+    async_acquire_applications,
+)
+from utils.planner import plan_scans
+from utils.processor import (
+    MitigationToAdd,
+    async_process,
+    get_latest_annotation,
+    is_candidate_for_bulk_mitigation,
+    process,
+    sort_and_filter_mitigations,
+)
+from utils.retry import RetryPolicy
+
+PORTFOLIO_OPTIONS = {
+    "application_count": 6,
+    "sandbox_count": 12,
+    "finding_count": 1800,
+    "rule_count": 40,
+    "match_ratio": 0.2,
+}
+
+# Rare enough that no endpoint fails five times in a row and opens its circuit
+FAULT_OPTIONS = {"throttle_rate": 0.05, "retry_after_seconds": 0, "error_rate": 0.05}
+
+CONCURRENCY = 4
+MAX_CWES_PER_REQUEST = 10
+
+# Small so every scan has several pages
+FINDINGS_PAGE_SIZE = 20
+PARALLEL_PAGES = 2
+ANNOTATION_BATCH_SIZE = 10
+
+
+def start_server(fault_options: dict) -> tuple:
+    port = get_free_port()
+    base_url = f"http://127.0.0.1:{port}/"
+
+    # Spawned so the server does not start with a copy of the test's state
+    server = get_context("spawn").Process(
+        target=run_server,
+        args=(port, PORTFOLIO_OPTIONS, fault_options),
+        daemon=True,
+    )
+    server.start()
+    wait_for_server(base_url)
+
+    return server, base_url
+
+
+def get_mitigation_key(mitigation: MitigationToAdd) -> tuple:
+    return (
+        mitigation.app_info.application_guid,
+        mitigation.app_info.sandbox_guid or "",
+        mitigation.flaw_number,
+        mitigation.bulk_mitigation.friendly_name,
+    )
+
+
+# Every matching flaw in the mock portfolio, found by checking every finding against every rule.
+# Policy scans have no sandbox GUID, so it is left empty to be sortable.
+def get_expected_matches(bulk_mitigations) -> list[tuple]:
+    portfolio = Portfolio(**PORTFOLIO_OPTIONS)
+    expected = []
+
+    for index in range(portfolio.application_count):
+        application_guid = get_application_guid(index)
+        sandbox_guids = [None] + [
+            sandbox["guid"] for sandbox in portfolio.sandboxes.get(application_guid, [])
+        ]
+
+        for sandbox_guid in sandbox_guids:
+            scan_number = portfolio.get_scan_number(application_guid, sandbox_guid)
+
+            for issue_id in range(1, portfolio.get_finding_count(scan_number) + 1):
+                finding = portfolio.generate_finding(scan_number, issue_id)
+                latest_annotation = get_latest_annotation(finding)
+
+                for item in bulk_mitigations.items:
+                    if is_candidate_for_bulk_mitigation(
+                        finding, item, latest_annotation
+                    ):
+                        expected.append(
+                            (
+                                application_guid,
+                                sandbox_guid or "",
+                                issue_id,
+                                item.friendly_name,
+                            )
+                        )
+
+    return sorted(expected)
+
+
+def run_threads(
+    base_url: str, bulk_mitigations
+) -> tuple[list[MitigationToAdd], RetryPolicy]:
+    console = Console(quiet=True)
+    retry_policy = RetryPolicy(console, 1000)
+    api = OfflineAPI(console, CONCURRENCY, retry_policy, base_url=base_url)
+    all_applications = retry_policy.run(api.get_all_applications)
+
+    applications_to_process = acquire_applications(
+        console,
+        api,
+        bulk_mitigations,
+        [application["profile"]["name"] for application in all_applications],
+        ApplicationCache(console, None),
+        CONCURRENCY,
+        all_applications=all_applications,
+    )
+    scan_plans = plan_scans(
+        console, bulk_mitigations, applications_to_process, MAX_CWES_PER_REQUEST
+    )
+    mitigations = []
+    process(
+        console,
+        api,
+        scan_plans,
+        mitigations,
+        CONCURRENCY,
+        findings_page_size=FINDINGS_PAGE_SIZE,
+        parallel_pages=PARALLEL_PAGES,
+    )
+    bulk_mitigate(
+        console,
+        api,
+        sort_and_filter_mitigations(console, mitigations),
+        CONCURRENCY,
+        ANNOTATION_BATCH_SIZE,
+    )
+
+    return mitigations, retry_policy
+
+
+async def run_async(
+    base_url: str, bulk_mitigations
+) -> tuple[list[MitigationToAdd], RetryPolicy]:
+    console = Console(quiet=True)
+    retry_policy = RetryPolicy(console, 1000)
+
+    async with AsyncAPI(console, CONCURRENCY, retry_policy, base_url=base_url) as api:
+        all_applications = await api.get_all_applications()
+        applications_to_process = await async_acquire_applications(
+            console,
+            api,
+            bulk_mitigations,
+            [application["profile"]["name"] for application in all_applications],
+            ApplicationCache(console, None),
+            all_applications=all_applications,
+        )
+        scan_plans = plan_scans(
+            console, bulk_mitigations, applications_to_process, MAX_CWES_PER_REQUEST
+        )
+        mitigations = []
+        await async_process(
+            console,
+            api,
+            scan_plans,
+            mitigations,
+            findings_page_size=FINDINGS_PAGE_SIZE,
+            parallel_pages=PARALLEL_PAGES,
+        )
+        await async_bulk_mitigate(
+            console,
+            api,
+            sort_and_filter_mitigations(console, mitigations),
+            ANNOTATION_BATCH_SIZE,
+        )
+
+    return mitigations, retry_policy
+
+
+# Retries are not waited for, the mock server answers at once
+@patch("utils.retry.get_back_off_seconds", return_value=0)
+class EndToEndTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # The mock server does not check the signatures, any well formed credentials will do
+        cls.credentials = patch.dict(
+            environ,
+            {"VERACODE_API_KEY_ID": "0" * 32, "VERACODE_API_KEY_SECRET": "0" * 128},
+        )
+        cls.credentials.start()
+
+        cls.bulk_mitigations = generate_bulk_mitigations(
+            Console(quiet=True), PORTFOLIO_OPTIONS["rule_count"]
+        )
+        cls.expected_matches = get_expected_matches(cls.bulk_mitigations)
+        cls.servers = {}
+
+        for name, fault_options in (("reliable", {}), ("faulty", FAULT_OPTIONS)):
+            cls.servers[name] = start_server(fault_options)
+
+    @classmethod
+    def tearDownClass(cls):
+        for server, _ in cls.servers.values():
+            server.terminate()
+            server.join()
+
+        cls.credentials.stop()
+
+    def assert_run_is_complete(self, server_name: str, run) -> dict[str, int]:
+        base_url = self.servers[server_name][1]
+        stats_before = get_server_stats(base_url)
+
+        mitigations, retry_policy = run(base_url, self.bulk_mitigations)
+
+        self.assertEqual(retry_policy.failures, [])
+        self.assertEqual(
+            sorted(get_mitigation_key(mitigation) for mitigation in mitigations),
+            self.expected_matches,
+        )
+
+        stats = {
+            name: count - stats_before.get(name, 0)
+            for name, count in get_server_stats(base_url).items()
+        }
+        phases = build_mitigation_batches(
+            sort_and_filter_mitigations(Console(quiet=True), mitigations),
+            ANNOTATION_BATCH_SIZE,
+        )
+        self.assertEqual(
+            stats.get("annotated_flaws", 0),
+            sum(len(batch.flaw_ids) for batches in phases for batch in batches),
+        )
+
+        return stats
+
+    def test_expected_matches_are_found(self, *_):
+        self.assertGreater(len(self.expected_matches), 0)
+
+    def test_threads(self, *_):
+        self.assert_run_is_complete("reliable", run_threads)
+
+    def test_threads_with_faults(self, *_):
+        stats = self.assert_run_is_complete("faulty", run_threads)
+
+        self.assertGreater(stats.get("errors", 0), 0)
+        self.assertGreater(stats.get("throttled", 0), 0)
+
+    def test_async_with_faults(self, *_):
+        stats = self.assert_run_is_complete(
+            "faulty",
+            lambda base_url, bulk_mitigations: asyncio.run(
+                run_async(base_url, bulk_mitigations)
+            ),
+        )
+
+        self.assertGreater(stats.get("errors", 0), 0)
+        self.assertGreater(stats.get("throttled", 0), 0)
@@ -0,0 +1,107 @@
+from concurrent.futures import ThreadPoolExecutor
+from json import dumps, loads
+from os import cpu_count
+from time import perf_counter
+
+from rich.console import Console
+from rich.table import Table
+
+from benchmarks.synthetic import generate_bulk_mitigations, generate_findings
+from utils.planner import RuleSet
+from utils.processor import MatchPool, match_findings
+
+console = Console(log_path=False)
+
+RULE_COUNT = 1000
+PAGE_SIZE = 500
+PAGE_COUNT = 200
+WORKER_COUNTS = [1, 2, 4, 8, 16]
+
+# Distinct pages are generated once and sent repeatedly, generating them is slower than matching
+DISTINCT_PAGE_COUNT = 20
+
+
+def time_threads(rule_set: RuleSet, pages: list[bytes], thread_count: int) -> float:
+    def decode_and_match(content: bytes) -> int:
+        findings = loads(content)["_embedded"]["findings"]
+        return len(match_findings(rule_set.index, None, findings))
+
+    start = perf_counter()
+
+    with ThreadPoolExecutor(max_workers=thread_count) as pool:
+        sum(pool.map(decode_and_match, pages))
+
+    return perf_counter() - start
+
+
+def time_processes(
+    bulk_mitigations, rule_set: RuleSet, pages: list[bytes], process_count: int
+) -> float:
+    match_pool = MatchPool(bulk_mitigations, process_count)
+
+    # Start the processes before timing
+    for future in [match_pool.submit(pages[0], rule_set) for _ in range(process_count)]:
+        future.result()
+
+    start = perf_counter()
+
+    for future in [match_pool.submit(content, rule_set) for content in pages]:
+        future.result()
+
+    elapsed = perf_counter() - start
+    match_pool.close()
+
+    return elapsed
+
+
+def main():
+    bulk_mitigations = generate_bulk_mitigations(console, RULE_COUNT)
+    rule_set = RuleSet(
+        tuple(range(RULE_COUNT)), bulk_mitigations.items, max_cwes_per_request=10
+    )
+    distinct_pages = [
+        dumps(
+            {
+                "_embedded": {
+                    "findings": generate_findings(
+                        PAGE_SIZE, RULE_COUNT, seed=seed, match_ratio=0.05
+                    )
+                },
+                "page": {"total_pages": PAGE_COUNT},
+            }
+        ).encode("utf-8")
+        for seed in range(DISTINCT_PAGE_COUNT)
+    ]
+    pages = [distinct_pages[page % DISTINCT_PAGE_COUNT] for page in range(PAGE_COUNT)]
+    available_cpu_count = cpu_count() or 1
+    cpu_count_pluralised = "" if available_cpu_count == 1 else "s"
+    table = Table(
+        title=f"Decoding and matching {PAGE_COUNT} pages of {PAGE_SIZE} findings on {available_cpu_count} CPU{cpu_count_pluralised}"
+    )
+    table.add_column("Workers", justify="right")
+    table.add_column("Threads (pages/s)", justify="right")
+    table.add_column("Processes (pages/s)", justify="right")
+    table.add_column("Processes speed up", justify="right")
+
+    baseline = time_threads(rule_set, pages, 1)
+
+    for worker_count in WORKER_COUNTS:
+        # More processes than CPUs only adds overhead
+        if worker_count > available_cpu_count and worker_count > 1:
+            break
+
+        threads = time_threads(rule_set, pages, worker_count)
+        processes = time_processes(bulk_mitigations, rule_set, pages, worker_count)
+
+        table.add_row(
+            str(worker_count),
+            f"{PAGE_COUNT / threads:.0f}",
+            f"{PAGE_COUNT / processes:.0f}",
+            f"{baseline / processes:.1f}x",
+        )
+
+    console.print(table)
+
+
+if __name__ == "__main__":
+    main()
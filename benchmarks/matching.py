@@ -0,0 +1,66 @@
+from time import perf_counter
+
+from rich.console import Console
+from rich.table import Table
+
+from benchmarks.synthetic import generate_bulk_mitigations, generate_findings
+from utils.processor import is_candidate_for_bulk_mitigation
+
+console = Console(log_path=False)
+
+RULE_COUNTS = [10, 100, 1000, 5000]
+FINDING_COUNT = 20000
+
+# The nested loop is too slow to run against every finding at large rule counts
+NESTED_LOOP_FINDING_COUNT = 500
+
+
+def time_indexed(bulk_mitigations, findings) -> float:
+    start = perf_counter()
+
+    for finding in findings:
+        bulk_mitigations.index.get_candidates(finding)
+
+    return (perf_counter() - start) / len(findings)
+
+
+def time_nested_loop(bulk_mitigations, findings) -> float:
+    start = perf_counter()
+
+    for finding in findings:
+        for bulk_mitigation in bulk_mitigations.items:
+            is_candidate_for_bulk_mitigation(finding, bulk_mitigation, None)
+
+    return (perf_counter() - start) / len(findings)
+
+
+def main():
+    table = Table(
+        title=f"Signature matching cost per finding ({FINDING_COUNT} findings)"
+    )
+    table.add_column("Rules", justify="right")
+    table.add_column("Indexed (µs)", justify="right")
+    table.add_column("Nested loop (µs)", justify="right")
+    table.add_column("Speed up", justify="right")
+
+    for rule_count in RULE_COUNTS:
+        bulk_mitigations = generate_bulk_mitigations(console, rule_count)
+        findings = generate_findings(FINDING_COUNT, rule_count)
+
+        indexed = time_indexed(bulk_mitigations, findings)
+        nested_loop = time_nested_loop(
+            bulk_mitigations, findings[:NESTED_LOOP_FINDING_COUNT]
+        )
+
+        table.add_row(
+            str(rule_count),
+            f"{indexed * 1_000_000:.2f}",
+            f"{nested_loop * 1_000_000:.2f}",
+            f"{nested_loop / indexed:.0f}x",
+        )
+
+    console.print(table)
+
+
+if __name__ == "__main__":
+    main()
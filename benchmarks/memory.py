@@ -0,0 +1,182 @@
+from datetime import datetime
+from json import dumps, loads
+from sys import getsizeof
+
+from rich.console import Console
+from rich.table import Table
+
+from benchmarks.synthetic import generate_bulk_mitigations, generate_findings
+from utils.list_of_applications import AppSandboxInfo
+from utils.processor import (
+    get_latest_annotation,
+    is_eligible_for_bulk_mitigation,
+    match_findings,
+)
+from utils.time import parse_from_veracode_date_time
+
+console = Console(log_path=False)
+
+CANDIDATE_COUNT = 1_000_000
+RULE_COUNT = 1000
+PAGE_SIZE = 500
+PAGES_PER_SCAN = 4
+
+# Distinct pages are decoded from JSON for every scan, as they would be from a response
+DISTINCT_PAGE_COUNT = 20
+
+
+# The records as they were before they were slotted and kept every annotation of a finding
+class DictAppSandboxInfo:
+    def __init__(
+        self,
+        application_name: str,
+        application_guid: str,
+        sandbox_name: str = None,
+        sandbox_guid: str = None,
+        last_scan_date: str = None,
+    ):
+        self.application_name = application_name
+        self.application_guid = application_guid
+        self.sandbox_name = sandbox_name
+        self.sandbox_guid = sandbox_guid
+        self.last_scan_date = last_scan_date
+
+
+class DictMitigationToAdd:
+    def __init__(self, app_info, bulk_mitigation, flaw_number, last_seen, annotations):
+        self.app_info = app_info
+        self.bulk_mitigation = bulk_mitigation
+        self.flaw_number = flaw_number
+        self.last_seen = last_seen
+        self.annotations = annotations
+
+
+def match_findings_with_all_annotations(index, app_info, findings) -> list:
+    matched = []
+
+    for finding in findings:
+        candidates = index.get_candidates(finding)
+
+        if len(candidates) < 1:
+            continue
+
+        sorted_annotations = sorted(
+            finding.get("annotations", []),
+            key=lambda x: parse_from_veracode_date_time(x["created"]),
+            reverse=True,
+        )
+
+        for bulk_mitigation in candidates:
+            if is_eligible_for_bulk_mitigation(
+                finding, bulk_mitigation, get_latest_annotation(finding)
+            ):
+                matched.append(
+                    DictMitigationToAdd(
+                        app_info,
+                        bulk_mitigation,
+                        finding["issue_id"],
+                        parse_from_veracode_date_time(
+                            finding["finding_status"]["last_seen_date"]
+                        ),
+                        sorted_annotations,
+                    )
+                )
+
+    return matched
+
+
+def get_retained_size(candidates: list, shared: list) -> int:
+    # The mitigation rules are shared by every candidate so are not counted
+    seen = {id(item) for item in shared}
+    pending = list(candidates)
+    total = 0
+
+    while len(pending) > 0:
+        item = pending.pop()
+
+        # Strings, numbers and dates belong to one candidate, everything else may be shared
+        if isinstance(item, (str, int, float, datetime)):
+            total += getsizeof(item)
+            continue
+
+        if id(item) in seen:
+            continue
+
+        seen.add(id(item))
+        total += getsizeof(item)
+
+        # JSON decoding reuses the keys of a page so they are not counted either
+        if isinstance(item, dict):
+            pending.extend(item.values())
+        elif isinstance(item, (list, tuple)):
+            pending.extend(item)
+        elif hasattr(item, "__dict__"):
+            pending.append(item.__dict__)
+        elif hasattr(item, "__slots__"):
+            pending.extend(getattr(item, name) for name in item.__slots__)
+
+    return total
+
+
+def measure(
+    bulk_mitigations, pages: list[str], create_app_info, match
+) -> tuple[int, float]:
+    candidates = []
+    scan_number = 0
+
+    while len(candidates) < CANDIDATE_COUNT:
+        app_info = create_app_info(f"Application {scan_number}", str(scan_number))
+
+        for page_number in range(PAGES_PER_SCAN):
+            page = pages[(scan_number + page_number) % len(pages)]
+            candidates.extend(match(bulk_mitigations.index, app_info, loads(page)))
+
+        scan_number += 1
+
+    retained_size = get_retained_size(candidates, bulk_mitigations.items)
+
+    return len(candidates), retained_size / len(candidates)
+
+
+def main():
+    bulk_mitigations = generate_bulk_mitigations(console, RULE_COUNT)
+    pages = [
+        dumps(generate_findings(PAGE_SIZE, RULE_COUNT, seed=seed, match_ratio=1.0))
+        for seed in range(DISTINCT_PAGE_COUNT)
+    ]
+
+    table = Table(title="Memory held per matched candidate")
+    table.add_column("Records")
+    table.add_column("Candidates", justify="right")
+    table.add_column("Bytes per candidate", justify="right")
+    table.add_column("Total (MB)", justify="right")
+
+    results = [
+        (
+            "Dictionaries with all annotations",
+            *measure(
+                bulk_mitigations,
+                pages,
+                DictAppSandboxInfo,
+                match_findings_with_all_annotations,
+            ),
+        ),
+        (
+            "Slots with the latest annotation",
+            *measure(bulk_mitigations, pages, AppSandboxInfo, match_findings),
+        ),
+    ]
+
+    for name, candidate_count, bytes_per_candidate in results:
+        table.add_row(
+            name,
+            str(candidate_count),
+            f"{bytes_per_candidate:.0f}",
+            f"{bytes_per_candidate * candidate_count / 1_000_000:.0f}",
+        )
+
+    console.print(table)
+
+
+if __name__ == "__main__":
+    main()
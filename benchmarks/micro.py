@@ -0,0 +1,376 @@
+from datetime import datetime, timedelta
+from io import StringIO
+from json import dump, dumps, load
+from math import exp, log
+from pathlib import Path
+from random import Random
+from sys import exit
+from tempfile import TemporaryDirectory
+from timeit import timeit
+
+import click
+from rich.console import Console
+from rich.table import Table
+
+from benchmarks.synthetic import (
+    generate_bulk_mitigations,
+    generate_findings,
+    generate_rule_data,
+)
+from utils.bulk_mitigations_file import BulkMitigations
+from utils.list_of_applications import AppSandboxInfo, ApplicationCache
+from utils.processor import (
+    MitigationToAdd,
+    get_latest_annotation,
+    is_candidate_for_bulk_mitigation,
+    sort_and_filter_mitigations,
+)
+
+console = Console(log_path=False)
+quiet_console = Console(quiet=True)
+
+BASELINES_PATH = Path(__file__).with_name("micro_baselines.json")
+
+# Used when the baselines file does not set them
+DEFAULT_TOLERANCE = 0.5
+DEFAULT_MAX_EXPONENT_CHANGE = 0.4
+
+REPEATS = 7
+CALIBRATION_SIZE = 50_000
+CANDIDATE_RULE_COUNT = 10
+ANNOTATED_FINDING_COUNT = 50
+SORTED_APPLICATION_COUNT = 100
+CACHE_LOOKUP_COUNT = 2000
+SANDBOX_NAMES_CALL_COUNT = 20
+
+
+# A hot path timed at increasing sizes, setup builds the inputs for a size and returns the function to time
+class Case:
+    def __init__(self, name: str, parameter: str, sizes: list[int], setup):
+        self.name = name
+        self.parameter = parameter
+        self.sizes = sizes
+        self.setup = setup
+
+
+class CaseResult:
+    def __init__(self, case: Case, costs: list[float], exponent: float):
+        self.case = case
+        self.costs = costs
+        self.exponent = exponent
+
+
+def setup_candidate_matching(finding_count: int):
+    bulk_mitigations = generate_bulk_mitigations(quiet_console, CANDIDATE_RULE_COUNT)
+    findings = generate_findings(
+        finding_count, CANDIDATE_RULE_COUNT, seed=finding_count, match_ratio=0.5
+    )
+
+    def run():
+        for finding in findings:
+            for bulk_mitigation in bulk_mitigations.items:
+                is_candidate_for_bulk_mitigation(finding, bulk_mitigation, None)
+
+    return run
+
+
+def setup_latest_annotation(annotation_count: int):
+    random = Random(annotation_count)
+    findings = [
+        {
+            "annotations": [
+                {
+                    "action": "COMMENT",
+                    "comment": "A comment",
+                    "created": f"2024-{random.randrange(1, 13):02}-{random.randrange(1, 29):02}T{random.randrange(24):02}:00:00.000Z",
+                }
+                for _ in range(annotation_count)
+            ]
+        }
+        for _ in range(ANNOTATED_FINDING_COUNT)
+    ]
+
+    def run():
+        for finding in findings:
+            get_latest_annotation(finding)
+
+    return run
+
+
+def setup_sort_and_filter(mitigation_count: int):
+    random = Random(mitigation_count)
+
+    # A single rule logs a single line of dropped duplicates, which would otherwise cost more than the sort at small sizes
+    bulk_mitigation = generate_bulk_mitigations(quiet_console, 1).items[0]
+    app_infos = [
+        AppSandboxInfo(f"Application {index}", f"guid-{index}")
+        for index in range(SORTED_APPLICATION_COUNT)
+    ]
+    last_seen = datetime(2025, 1, 1)
+
+    # Each flaw is matched twice on average, e.g. by another scan of the application
+    mitigations = [
+        MitigationToAdd(
+            random.choice(app_infos),
+            bulk_mitigation,
+            random.randrange(mitigation_count // (2 * SORTED_APPLICATION_COUNT)),
+            last_seen + timedelta(days=random.randrange(365)),
+            None,
+        )
+        for _ in range(mitigation_count)
+    ]
+
+    def run():
+        sort_and_filter_mitigations(quiet_console, mitigations)
+
+    return run
+
+
+def setup_cache_lookups(entry_count: int):
+    random = Random(entry_count)
+    directory = TemporaryDirectory()
+    cache = ApplicationCache(quiet_console, str(Path(directory.name) / "cache.db"))
+    cache.add_many(
+        [
+            AppSandboxInfo(
+                f"Application {index // 2}",
+                f"guid-{index // 2}",
+                f"Sandbox {index}" if index % 2 else None,
+                f"sandbox-guid-{index}" if index % 2 else None,
+            )
+            for index in range(entry_count)
+        ]
+    )
+    lookups = [random.randrange(entry_count // 2) for _ in range(CACHE_LOOKUP_COUNT)]
+
+    def run():
+        # Keeps the directory alive as long as the function is timed
+        directory.name
+
+        for index in lookups:
+            cache.get_by_application_name(f"Application {index}")
+            cache.get_by_sandbox_name(
+                f"Application {index}", f"Sandbox {index * 2 + 1}"
+            )
+
+    return run
+
+
+def setup_sandbox_names(rule_count: int):
+    rules = []
+
+    # Every rule names a sandbox of its own and one shared with the others
+    for index in range(rule_count):
+        rule = generate_rule_data(index)
+        rule["sandboxes"] = [f"Sandbox {index}", "Shared sandbox"]
+        rules.append(rule)
+
+    rules_file = StringIO(dumps(rules))
+    rules_file.name = "synthetic"
+    bulk_mitigations = BulkMitigations(quiet_console, rules_file)
+
+    def run():
+        for _ in range(SANDBOX_NAMES_CALL_COUNT):
+            bulk_mitigations.get_all_sandbox_names()
+
+    return run
+
+
+CASES = [
+    Case(
+        "is_candidate_for_bulk_mitigation",
+        "findings",
+        [1000, 2000, 4000, 8000],
+        setup_candidate_matching,
+    ),
+    Case(
+        "get_latest_annotation",
+        "annotations",
+        [5, 20, 80, 320],
+        setup_latest_annotation,
+    ),
+    Case(
+        "sort_and_filter_mitigations",
+        "mitigations",
+        [5000, 10000, 20000, 40000],
+        setup_sort_and_filter,
+    ),
+    Case(
+        "ApplicationCache lookups",
+        "cache entries",
+        [1000, 4000, 16000, 64000],
+        setup_cache_lookups,
+    ),
+    Case(
+        "BulkMitigations.get_all_sandbox_names",
+        "rules",
+        [1000, 2000, 4000, 8000],
+        setup_sandbox_names,
+    ),
+]
+
+
+def run_calibration():
+    counts = {}
+
+    for index in range(CALIBRATION_SIZE):
+        key = f"key {index % 1000}"
+        counts[key] = counts.get(key, 0) + 1
+
+
+# The cost of a function relative to a fixed loop, so baselines hold across machines. Runs of the two
+# are interleaved so both see the same state of the machine, and the fastest run of each is the one
+# least disturbed by the rest of it.
+def get_relative_cost(function) -> float:
+    function_times = []
+    calibration_times = []
+
+    for _ in range(REPEATS):
+        calibration_times.append(timeit(run_calibration, number=1))
+        function_times.append(timeit(function, number=1))
+
+    return min(function_times) / min(calibration_times)
+
+
+# The slope of log(time) against log(size), about 1 for linear and 2 for quadratic
+def get_exponent(sizes: list[int], costs: list[float]) -> float:
+    xs = [log(size) for size in sizes]
+    ys = [log(cost) for cost in costs]
+    mean_x = sum(xs) / len(xs)
+    mean_y = sum(ys) / len(ys)
+
+    return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / sum(
+        (x - mean_x) ** 2 for x in xs
+    )
+
+
+def measure(case: Case) -> CaseResult:
+    costs = [get_relative_cost(case.setup(size)) for size in case.sizes]
+
+    return CaseResult(case, costs, get_exponent(case.sizes, costs))
+
+
+def load_baselines() -> dict:
+    if not BASELINES_PATH.exists():
+        return {
+            "tolerance": DEFAULT_TOLERANCE,
+            "max_exponent_change": DEFAULT_MAX_EXPONENT_CHANGE,
+            "cases": {},
+        }
+
+    with BASELINES_PATH.open("r", encoding="utf-8") as baselines_file:
+        return load(baselines_file)
+
+
+def save_baselines(baselines: dict, results: list[CaseResult]) -> None:
+    # Cases which were not measured keep their baselines
+    baselines["cases"].update(
+        {
+            result.case.name: {
+                "parameter": result.case.parameter,
+                "sizes": result.case.sizes,
+                "costs": [round(cost, 6) for cost in result.costs],
+                "exponent": round(result.exponent, 2),
+            }
+            for result in results
+        }
+    )
+
+    with BASELINES_PATH.open("w", encoding="utf-8") as baselines_file:
+        dump(baselines, baselines_file, indent=2)
+        baselines_file.write("\n")
+
+    console.log(f'Wrote the baselines to "{BASELINES_PATH}"')
+
+
+def has_baseline(result: CaseResult, baseline: dict) -> bool:
+    return baseline is not None and baseline["sizes"] == result.case.sizes
+
+
+# The geometric mean of the ratios at every size, noise at any one size is averaged out
+def get_slowdown(result: CaseResult, baseline: dict) -> float:
+    return exp(
+        sum(
+            log(cost / baseline_cost)
+            for cost, baseline_cost in zip(result.costs, baseline["costs"])
+        )
+        / len(result.costs)
+    )
+
+
+def check_result(
+    result: CaseResult, baseline: dict, tolerance: float, max_exponent_change: float
+) -> str:
+    if not has_baseline(result, baseline):
+        return "has no baseline for these sizes, run with --update-baselines"
+
+    slowdown = get_slowdown(result, baseline)
+
+    if slowdown > 1 + tolerance:
+        return f"is {slowdown:.2f}x slower than the baseline, more than the tolerance of {1 + tolerance:.2f}x"
+
+    if abs(result.exponent - baseline["exponent"]) > max_exponent_change:
+        return f"now grows as size^{result.exponent:.2f} instead of size^{baseline['exponent']:.2f}"
+
+    return None
+
+
+@click.command()
+@click.option("--update-baselines", default=False, type=click.BOOL, is_flag=True)
+@click.option("--case", "case_names", multiple=True, type=click.STRING)
+def main(update_baselines: bool, case_names: tuple[str, ...]):
+    baselines = load_baselines()
+    tolerance = baselines.get("tolerance", DEFAULT_TOLERANCE)
+    max_exponent_change = baselines.get(
+        "max_exponent_change", DEFAULT_MAX_EXPONENT_CHANGE
+    )
+    cases = [case for case in CASES if len(case_names) < 1 or case.name in case_names]
+    results = [measure(case) for case in cases]
+
+    table = Table(title="Micro-benchmarks, costs relative to a fixed loop")
+    table.add_column("Hot path")
+    table.add_column("Parameter")
+    table.add_column("Largest size", justify="right")
+    table.add_column("Cost", justify="right")
+    table.add_column("Vs baseline", justify="right")
+    table.add_column("Exponent", justify="right")
+    table.add_column("Baseline exponent", justify="right")
+
+    failures = []
+
+    for result in results:
+        baseline = baselines["cases"].get(result.case.name)
+        table.add_row(
+            result.case.name,
+            result.case.parameter,
+            str(result.case.sizes[-1]),
+            f"{result.costs[-1]:.3f}",
+            (
+                f"{get_slowdown(result, baseline):.2f}x"
+                if has_baseline(result, baseline)
+                else "-"
+            ),
+            f"{result.exponent:.2f}",
+            (f"{baseline['exponent']:.2f}" if has_baseline(result, baseline) else "-"),
+        )
+
+        failure = check_result(result, baseline, tolerance, max_exponent_change)
+
+        if failure is not None:
+            failures.append((result.case.name, failure))
+
+    console.print(table)
+
+    if update_baselines:
+        save_baselines(baselines, results)
+        return
+
+    for name, failure in failures:
+        console.log(f"Error: {name} {failure}")
+
+    if len(failures) > 0:
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
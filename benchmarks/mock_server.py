@@ -0,0 +1,326 @@
+from asyncio import sleep
+from functools import lru_cache
+from json import dumps
+from random import Random
+from urllib.parse import unquote
+
+import click
+from aiohttp import web
+
+from benchmarks.synthetic import generate_finding
+
+APPLICATIONS_PATH = "/appsec/v1/applications"
+DEFAULT_PAGE_SIZE = 50
+SCAN_DATE = "2025-06-01T10:00:00.000Z"
+
+
+def get_application_guid(index: int) -> str:
+    return f"00000000-0000-4000-8000-{index:012}"
+
+
+def get_sandbox_guid(index: int) -> str:
+    return f"00000000-0000-4000-9000-{index:012}"
+
+
+# A deterministic portfolio where every finding is generated when it is requested, so 1M findings cost no memory
+class Portfolio:
+    def __init__(
+        self,
+        application_count: int,
+        sandbox_count: int,
+        finding_count: int,
+        rule_count: int,
+        match_ratio: float,
+    ):
+        self.application_count = application_count
+        self.sandbox_count = sandbox_count
+        self.rule_count = rule_count
+        self.match_ratio = match_ratio
+
+        # Findings are spread evenly across the policy scans and sandboxes
+        scan_count = application_count + sandbox_count
+        self.findings_per_scan, self.extra_findings = divmod(finding_count, scan_count)
+
+        self.applications = [
+            {
+                "guid": get_application_guid(index),
+                "profile": {"name": f"Application {index}"},
+                "last_completed_scan_date": SCAN_DATE,
+            }
+            for index in range(application_count)
+        ]
+        self.applications_by_name = {
+            application["profile"]["name"].lower(): application
+            for application in self.applications
+        }
+        self.application_indexes = {
+            application["guid"]: index
+            for index, application in enumerate(self.applications)
+        }
+
+        # Sandboxes are dealt out to the applications in turn
+        self.sandboxes: dict[str, list[dict]] = {}
+
+        for index in range(sandbox_count):
+            application_guid = get_application_guid(index % application_count)
+            self.sandboxes.setdefault(application_guid, []).append(
+                {
+                    "guid": get_sandbox_guid(index),
+                    "name": f"Sandbox {index // application_count}",
+                    "modified": SCAN_DATE,
+                }
+            )
+
+        self.sandbox_indexes = {
+            sandbox["guid"]: int(sandbox["guid"][-12:])
+            for sandboxes in self.sandboxes.values()
+            for sandbox in sandboxes
+        }
+        self.generate_filtered_issue_ids = lru_cache(maxsize=4096)(
+            self._generate_filtered_issue_ids
+        )
+
+    def get_scan_number(self, application_guid: str, sandbox_guid: str) -> int:
+        if sandbox_guid is None:
+            return self.application_indexes[application_guid]
+
+        return self.application_count + self.sandbox_indexes[sandbox_guid]
+
+    def get_finding_count(self, scan_number: int) -> int:
+        return self.findings_per_scan + (1 if scan_number < self.extra_findings else 0)
+
+    def generate_finding(self, scan_number: int, issue_id: int) -> dict:
+        return generate_finding(
+            Random(scan_number * 1_000_003 + issue_id),
+            issue_id,
+            self.rule_count,
+            self.match_ratio,
+        )
+
+    def _generate_filtered_issue_ids(
+        self, scan_number: int, cwes: frozenset
+    ) -> list[int]:
+        issue_ids = []
+
+        for issue_id in range(1, self.get_finding_count(scan_number) + 1):
+            finding = self.generate_finding(scan_number, issue_id)
+
+            if cwes and finding["finding_details"]["cwe"]["id"] not in cwes:
+                continue
+
+            issue_ids.append(issue_id)
+
+        return issue_ids
+
+
+class ServerStats:
+    def __init__(self):
+        self.counts: dict[str, int] = {}
+
+    def add(self, name: str, count: int = 1) -> None:
+        self.counts[name] = self.counts.get(name, 0) + count
+
+
+class Faults:
+    def __init__(
+        self,
+        latency_ms: float = 0,
+        throttle_rate: float = 0,
+        retry_after_seconds: int = 1,
+        error_rate: float = 0,
+        seed: int = 1,
+    ):
+        self.latency_ms = latency_ms
+        self.throttle_rate = throttle_rate
+        self.retry_after_seconds = retry_after_seconds
+        self.error_rate = error_rate
+        self.random = Random(seed)
+
+
+def get_page_response(
+    items: list, element: str, page: int, size: int, total_count: int = None
+) -> dict:
+    total_count = len(items) if total_count is None else total_count
+
+    return {
+        "_embedded": {element: items},
+        "page": {
+            "size": size,
+            "number": page,
+            "total_elements": total_count,
+            "total_pages": (total_count + size - 1) // size,
+        },
+    }
+
+
+def create_app(portfolio: Portfolio, faults: Faults) -> web.Application:
+    stats = ServerStats()
+
+    @web.middleware
+    async def inject_faults(request: web.Request, handler):
+        if request.path == "/stats":
+            return await handler(request)
+
+        if faults.latency_ms > 0:
+            # Up to half as much again so requests do not complete in lockstep
+            await sleep(faults.latency_ms * (1 + faults.random.random() / 2) / 1000)
+
+        if faults.random.random() < faults.throttle_rate:
+            stats.add("throttled")
+            return web.Response(
+                status=429,
+                headers={"Retry-After": str(faults.retry_after_seconds)},
+            )
+
+        if faults.random.random() < faults.error_rate:
+            stats.add("errors")
+            return web.Response(status=500)
+
+        return await handler(request)
+
+    def get_paging(request: web.Request) -> tuple[int, int, int, int]:
+        page = int(request.query.get("page", 0))
+        size = int(request.query.get("size", DEFAULT_PAGE_SIZE))
+
+        return page, size, page * size, (page + 1) * size
+
+    async def get_applications(request: web.Request):
+        stats.add("applications")
+        page, size, start, end = get_paging(request)
+
+        # The client quotes the name before sending it
+        if "name" in request.query:
+            application = portfolio.applications_by_name.get(
+                unquote(request.query["name"]).lower()
+            )
+            applications = [] if application is None else [application]
+        else:
+            applications = portfolio.applications
+
+        return web.json_response(
+            get_page_response(
+                applications[start:end],
+                "applications",
+                page,
+                size,
+                len(applications),
+            ),
+            dumps=dumps,
+        )
+
+    async def get_sandboxes(request: web.Request):
+        stats.add("sandboxes")
+        page, size, start, end = get_paging(request)
+        sandboxes = portfolio.sandboxes.get(request.match_info["guid"], [])
+
+        return web.json_response(
+            get_page_response(
+                sandboxes[start:end],
+                "sandboxes",
+                page,
+                size,
+                len(sandboxes),
+            ),
+            dumps=dumps,
+        )
+
+    async def get_findings(request: web.Request):
+        stats.add("findings")
+        page, size, start, end = get_paging(request)
+
+        try:
+            scan_number = portfolio.get_scan_number(
+                request.match_info["guid"], request.query.get("context")
+            )
+        except KeyError:
+            return web.Response(status=404)
+
+        cwes = frozenset(
+            int(cwe) for cwe in request.query.get("cwe", "").split(",") if cwe
+        )
+        issue_ids = portfolio.generate_filtered_issue_ids(scan_number, cwes)
+        findings = [
+            portfolio.generate_finding(scan_number, issue_id)
+            for issue_id in issue_ids[start:end]
+        ]
+        stats.add("findings_returned", len(findings))
+
+        return web.json_response(
+            get_page_response(findings, "findings", page, size, len(issue_ids)),
+            dumps=dumps,
+        )
+
+    async def add_annotations(request: web.Request):
+        stats.add("annotations")
+        body = await request.json()
+        stats.add("annotated_flaws", len(body["issue_list"].split(",")))
+
+        return web.Response(status=200)
+
+    async def get_stats(request: web.Request):
+        return web.json_response(stats.counts)
+
+    app = web.Application(middlewares=[inject_faults])
+    app.router.add_get(APPLICATIONS_PATH, get_applications)
+    app.router.add_get(APPLICATIONS_PATH + "/{guid}/sandboxes", get_sandboxes)
+    app.router.add_get("/appsec/v2/applications/{guid}/findings", get_findings)
+    app.router.add_post("/appsec/v2/applications/{guid}/annotations", add_annotations)
+    app.router.add_get("/stats", get_stats)
+
+    return app
+
+
+def run_server(port: int, portfolio_options: dict, fault_options: dict) -> None:
+    web.run_app(
+        create_app(Portfolio(**portfolio_options), Faults(**fault_options)),
+        host="127.0.0.1",
+        port=port,
+        print=None,
+        access_log=None,
+    )
+
+
+@click.command()
+@click.option("--port", default=8780, type=click.INT)
+@click.option("--applications", default=10000, type=click.IntRange(min=1))
+@click.option("--sandboxes", default=50000, type=click.IntRange(min=0))
+@click.option("--findings", default=1000000, type=click.IntRange(min=0))
+@click.option("--rules", default=100, type=click.IntRange(min=1))
+@click.option("--match-ratio", default=0.01, type=click.FloatRange(0, 1))
+@click.option("--latency-ms", default=0.0, type=click.FloatRange(min=0))
+@click.option("--throttle-rate", default=0.0, type=click.FloatRange(0, 1))
+@click.option("--retry-after-seconds", default=1, type=click.IntRange(min=0))
+@click.option("--error-rate", default=0.0, type=click.FloatRange(0, 1))
+def main(
+    port: int,
+    applications: int,
+    sandboxes: int,
+    findings: int,
+    rules: int,
+    match_ratio: float,
+    latency_ms: float,
+    throttle_rate: float,
+    retry_after_seconds: int,
+    error_rate: float,
+):
+    click.echo(f"Serving a mock Veracode API on http://127.0.0.1:{port}/")
+    run_server(
+        port,
+        {
+            "application_count": applications,
+            "sandbox_count": sandboxes,
+            "finding_count": findings,
+            "rule_count": rules,
+            "match_ratio": match_ratio,
+        },
+        {
+            "latency_ms": latency_ms,
+            "throttle_rate": throttle_rate,
+            "retry_after_seconds": retry_after_seconds,
+            "error_rate": error_rate,
+        },
+    )
+
+
+if __name__ == "__main__":
+    main()
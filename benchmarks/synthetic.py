@@ -0,0 +1,88 @@
+from io import StringIO
+from json import dumps
+from random import Random
+
+from rich.console import Console
+
+from utils.bulk_mitigations_file import BulkMitigations
+
+ACTIONS = ["APPDESIGN", "FP", "ACCEPTRISK", "ACCEPTED", "REJECTED"]
+
+
+def generate_rule_data(index: int) -> dict:
+    return {
+        "friendly_name": f"Rule {index}",
+        "process_policy": True,
+        "process_sandboxes": True,
+        "sandboxes": [],
+        "cwe": 100 + index % 50,
+        "module": f"*module_{index % 20}.dll" if index % 10 == 0 else "app.dll",
+        "file_path": f"src/package_{index % 100}/file_{index}.cs",
+        "attack_vector": f"library.Namespace.Class.Method{index % 30}",
+        "line_number": index % 500,
+        "mitigate_by_design": f"Technique : M1\nSpecifics : rule {index}",
+        "approve": "Approved",
+    }
+
+
+def generate_bulk_mitigations(console: Console, rule_count: int) -> BulkMitigations:
+    rules = StringIO(dumps([generate_rule_data(index) for index in range(rule_count)]))
+    rules.name = "synthetic"
+    return BulkMitigations(console, rules)
+
+
+def generate_finding(
+    random: Random, issue_id: int, rule_count: int, match_ratio: float = 0.01
+) -> dict:
+    # A proportion of the findings carry the signature of one of the rules
+    if rule_count > 0 and random.random() < match_ratio:
+        rule = generate_rule_data(random.randrange(rule_count))
+        module = (
+            "prefix_" + rule["module"][1:]
+            if rule["module"].startswith("*")
+            else rule["module"]
+        )
+        details = {
+            "cwe": {"id": rule["cwe"]},
+            "module": module,
+            "file_path": rule["file_path"].replace("/", "\\"),
+            "attack_vector": rule["attack_vector"],
+            "file_line_number": str(rule["line_number"]),
+        }
+    else:
+        details = {
+            "cwe": {"id": random.randrange(1, 1000)},
+            "module": "app.dll",
+            "file_path": f"src/other/file_{random.randrange(100000)}.cs",
+            "attack_vector": f"library.Namespace.Class.Method{random.randrange(30)}",
+            "file_line_number": str(random.randrange(1, 5000)),
+        }
+
+    return {
+        "issue_id": issue_id,
+        "finding_status": {
+            "status": "OPEN",
+            "resolution": "UNRESOLVED",
+            "resolution_status": "NONE",
+            "last_seen_date": f"2025-{random.randrange(1, 13):02}-{random.randrange(1, 29):02}T10:00:00.000Z",
+        },
+        "finding_details": details,
+        "annotations": [
+            {
+                "action": random.choice(ACTIONS),
+                "comment": "An earlier comment",
+                "created": f"2024-{random.randrange(1, 13):02}-{random.randrange(1, 29):02}T10:00:00.000Z",
+            }
+            for _ in range(random.randrange(3))
+        ],
+    }
+
+
+def generate_findings(
+    finding_count: int, rule_count: int, seed: int = 1, match_ratio: float = 0.01
+) -> list[dict]:
+    random = Random(seed)
+    return [
+        generate_finding(random, issue_id, rule_count, match_ratio)
+        for issue_id in range(1, finding_count + 1)
+    ]
@@ -1,3 +1,4 @@
+from dataclasses import dataclass
 from typing import IO
 
 import click
@@ -6,14 +7,73 @@ from rich.table import Table
 from rich.prompt import Confirm
 
 from utils.api import API
-from utils.bulk_mitigate import bulk_mitigate
-from utils.list_of_applications import load_applications_from_file, acquire_applications
+from utils.async_api import run_with_async_api
+from utils.connection_pool import ConnectionStats
+from utils.metrics import Metrics
+from utils.bulk_mitigate import (
+    MitigationBatch,
+    MitigationStream,
+    async_bulk_mitigate,
+    bulk_mitigate,
+)
+from utils.incremental import IncrementalState
+from utils.journal import Journal
+from utils.list_of_applications import (
+    ApplicationCache,
+    load_applications_from_file,
+    acquire_applications,
+    async_acquire_applications,
+)
 from utils.bulk_mitigations_file import BulkMitigations
-from utils.processor import process, MitigationToAdd
+from utils.plan_file import assert_plan_is_fresh, load_plan, save_plan
+from utils.planner import plan_scans
+from utils.processor import (
+    MatchPool,
+    async_process,
+    process,
+    sort_and_filter_mitigations,
+    MitigationToAdd,
+)
+from utils.retry import RetryPolicy
 
 console = Console(log_path=False)
 
 
+# The command line options, passed around together so each is read by name
+@dataclass
+class Options:
+    mitigations_file: IO[str]
+    all_application_profiles: bool
+    application_names_file: str
+    application_listing_threshold: int
+    number_of_threads: int
+    engine: str
+    max_concurrent_requests: int
+    connection_pool_size: int
+    application_cache_file_path: str
+    application_cache_ttl_hours: float
+    auto_apply_mitigations: bool
+    stream_mitigations: bool
+    max_annotation_batch_size: int
+    findings_page_size: int
+    parallel_pages_per_scan: int
+    match_processes: int
+    max_cwes_per_request: int
+    retry_budget: int
+    failure_report_file_path: str
+    metrics_file_path: str
+    prometheus_file_path: str
+    shard_index: int
+    shard_count: int
+    plan_file_path: str
+    merge_plan_files: tuple[str, ...]
+    apply_plan_file_path: str
+    max_plan_age_hours: float
+    journal_file_path: str
+    resume: bool
+    incremental_state_file_path: str
+
+
 def print_summary(mitigations_to_add: list[MitigationToAdd]):
     console.log(
         (
@@ -41,30 +101,91 @@ def print_summary(mitigations_to_add: list[MitigationToAdd]):
     console.print(table)
 
 
-def sort_and_filter_mitigations(
+def merge_plans(
+    mitigations_file: IO[str],
+    merge_plan_files: tuple[str, ...],
+    plan_file_path: str,
+):
+    bulk_mitigations = BulkMitigations(console, mitigations_file)
+    mitigations_to_add: list[MitigationToAdd] = []
+    created_at = None
+
+    for merge_plan_file in merge_plan_files:
+        plan = load_plan(console, merge_plan_file, bulk_mitigations)
+        mitigations_to_add.extend(plan.mitigations)
+
+        # The merged plan is only as fresh as its oldest shard
+        if created_at is None or plan.created_at < created_at:
+            created_at = plan.created_at
+
+    # Plans written with different shard counts, or by the same shard twice, can hold the same flaw
+    mitigations_to_add = sort_and_filter_mitigations(console, mitigations_to_add)
+
+    if len(mitigations_to_add) > 0:
+        print_summary(mitigations_to_add)
+
+    save_plan(console, plan_file_path, mitigations_to_add, created_at)
+
+
+def apply_mitigations(
+    options: Options,
+    api: API,
+    run_async,
     mitigations_to_add: list[MitigationToAdd],
-) -> list[MitigationToAdd]:
-    filtered_mitigations_to_add: list[MitigationToAdd] = []
-    sorted_mitigations = sorted(
-        mitigations_to_add, key=lambda x: x.last_seen, reverse=True
-    )
+    journal: Journal = None,
+) -> bool:
+    if not options.auto_apply_mitigations:
+        if not Confirm.ask("Apply mitigations?"):
+            return False
 
-    for mitigation in sorted_mitigations:
-        mitigation_has_been_processed = False
+    if journal is not None:
+        journal.open(mitigations_to_add)
 
-        # We only need to mitigate the latest unique flaw id
-        for processed in filtered_mitigations_to_add:
-            if (
-                mitigation.app_info.application_guid
-                == processed.app_info.application_guid
-                and mitigation.flaw_number == processed.flaw_number
-            ):
-                mitigation_has_been_processed = True
+    try:
+        if options.engine == "async":
+            run_async(
+                lambda async_api: async_bulk_mitigate(
+                    console,
+                    async_api,
+                    mitigations_to_add,
+                    options.max_annotation_batch_size,
+                    journal,
+                ),
+            )
+        else:
+            bulk_mitigate(
+                console,
+                api,
+                mitigations_to_add,
+                options.number_of_threads,
+                options.max_annotation_batch_size,
+                journal,
+            )
+    finally:
+        # Whatever was applied before an interruption is on disk
+        if journal is not None:
+            journal.close()
+
+    if journal is not None:
+        journal.compact()
 
-        if not mitigation_has_been_processed:
-            filtered_mitigations_to_add.append(mitigation)
+    return True
 
-    return filtered_mitigations_to_add
+
+def save_incremental_state(
+    incremental_state: IncrementalState, retry_policy: RetryPolicy
+):
+    if incremental_state is None:
+        return
+
+    # Only remember the scans once their mitigations have been applied
+    for failure in retry_policy.failures:
+        if isinstance(failure.task, MitigationBatch):
+            incremental_state.discard(
+                failure.task.application_guid, failure.task.sandbox_guid
+            )
+
+    incremental_state.save()
 
 
 @click.command()
@@ -86,17 +207,47 @@ def sort_and_filter_mitigations(
     type=click.STRING,
     help="A text file containing application names, one per line. This is ignored if --all-application-profiles is set.",
 )
+@click.option(
+    "--application-listing-threshold",
+    default=100,
+    type=click.IntRange(min=1),
+    help="Above this many application names to look up, list all application profiles once rather than searching for each name.",
+)
 @click.option(
     "--number-of-threads",
     default=10,
     type=click.INT,
     help="Number of threads to use.",
 )
+@click.option(
+    "--engine",
+    default="threads",
+    type=click.Choice(["threads", "async"]),
+    help="Use a pool of threads or asyncio for making API calls.",
+)
+@click.option(
+    "--max-concurrent-requests",
+    default=100,
+    type=click.IntRange(min=1),
+    help="The maximum number of simultaneous API requests when using the async engine.",
+)
+@click.option(
+    "--connection-pool-size",
+    default=None,
+    type=click.IntRange(min=1),
+    help="The maximum number of kept-alive connections to the API. Defaults to the number of threads or concurrent requests.",
+)
 @click.option(
     "--application-cache-file-path",
     default=None,
     type=click.STRING,
-    help="A text file containing application name to guid mappings, one per line.",
+    help="A SQLite database file used to cache application and sandbox name to guid mappings. An existing CSV cache file will be migrated.",
+)
+@click.option(
+    "--application-cache-ttl-hours",
+    default=24.0,
+    type=click.FloatRange(min=0),
+    help="The number of hours before a cached mapping expires. Set to 0 to never expire.",
 )
 @click.option(
     "--auto-apply-mitigations",
@@ -104,51 +255,435 @@ def sort_and_filter_mitigations(
     type=click.BOOL,
     help="Set this to true to skip the prompt and apply the mitigations. Use caution with this flag.",
 )
-def main(
-    mitigations_file: IO[str],
-    all_application_profiles: bool,
-    application_names_file: str,
-    number_of_threads: int,
-    application_cache_file_path: str,
-    auto_apply_mitigations: bool,
+@click.option(
+    "--stream-mitigations",
+    default=False,
+    type=click.BOOL,
+    help="Set this to true to apply the mitigations of each application as soon as its scans are processed, while other scans continue. Requires --auto-apply-mitigations.",
+)
+@click.option(
+    "--max-annotation-batch-size",
+    default=100,
+    type=click.IntRange(min=1),
+    help="The maximum number of flaws to annotate in a single API request.",
+)
+@click.option(
+    "--findings-page-size",
+    default=500,
+    type=click.IntRange(min=1, max=500),
+    help="The number of findings to request per page. Each page is processed as it arrives.",
+)
+@click.option(
+    "--retry-budget",
+    default=500,
+    type=click.IntRange(min=0),
+    help="The maximum number of failed requests to retry across the whole run.",
+)
+@click.option(
+    "--failure-report-file-path",
+    default=None,
+    type=click.STRING,
+    help="A JSON file to write tasks which still failed after retrying.",
+)
+@click.option(
+    "--metrics-file-path",
+    default=None,
+    type=click.STRING,
+    help="A JSON file to write the latency, retries and bytes received of each API endpoint and phase to.",
+)
+@click.option(
+    "--prometheus-file-path",
+    default=None,
+    type=click.STRING,
+    help="A Prometheus textfile collector file to write the same metrics to.",
+)
+@click.option(
+    "--parallel-pages-per-scan",
+    default=4,
+    type=click.IntRange(min=1),
+    help="The number of pages of findings to request at the same time for a single scan.",
+)
+@click.option(
+    "--match-processes",
+    default=0,
+    type=click.IntRange(min=0),
+    help="The number of processes used to decode and match findings, separate from the threads or requests fetching them. 0 matches findings where they are fetched.",
+)
+@click.option(
+    "--max-cwes-per-request",
+    default=10,
+    type=click.IntRange(min=1),
+    help="Findings are filtered by the CWEs in the mitigations file. Above this many CWEs each scan is split into several queries.",
+)
+@click.option(
+    "--shard-index",
+    default=0,
+    type=click.IntRange(min=0),
+    help="Which shard of the application profiles to process when the work is split across several runs, starting from 0.",
+)
+@click.option(
+    "--shard-count",
+    default=1,
+    type=click.IntRange(min=1),
+    help="The number of shards the application profiles are split into. Each shard must write a plan file.",
+)
+@click.option(
+    "--plan-file-path",
+    default=None,
+    type=click.STRING,
+    help="Write the mitigations to apply to this file rather than applying them.",
+)
+@click.option(
+    "--merge-plan-files",
+    default=None,
+    multiple=True,
+    type=click.STRING,
+    help="Plan files written by shards to combine into --plan-file-path. No API calls are made. Can be specified more than once.",
+)
+@click.option(
+    "--apply-plan-file-path",
+    default=None,
+    type=click.STRING,
+    help="Apply the mitigations in a plan file without fetching any findings.",
+)
+@click.option(
+    "--max-plan-age-hours",
+    default=24.0,
+    type=click.FloatRange(min=0),
+    help="Refuse to apply a plan file older than this. Set to 0 to apply plans of any age.",
+)
+@click.option(
+    "--journal-file-path",
+    default=None,
+    type=click.STRING,
+    help="A file recording each annotation request as it succeeds, so an interrupted run can be resumed.",
+)
+@click.option(
+    "--resume",
+    default=False,
+    type=click.BOOL,
+    help="Set this to true to finish applying the mitigations in --journal-file-path without fetching any findings.",
+)
+@click.option(
+    "--incremental-state-file-path",
+    default=None,
+    type=click.STRING,
+    help="A JSON file used to remember which scans have been processed. Scans with no new results since the last run are skipped.",
+)
+def main(**options):
+    options = Options(**options)
+    retry_policy = RetryPolicy(console, options.retry_budget)
+    connection_stats = ConnectionStats()
+    metrics = (
+        None
+        if options.metrics_file_path is None and options.prometheus_file_path is None
+        else Metrics()
+    )
+
+    try:
+        run(options, retry_policy, connection_stats, metrics)
+    finally:
+        connection_stats.log(console)
+
+        if metrics is not None:
+            metrics.report(
+                console, options.metrics_file_path, options.prometheus_file_path
+            )
+
+        # Tasks which failed are reported rather than aborting the rest of the run
+        retry_policy.report(options.failure_report_file_path)
+
+
+def run(
+    options: Options,
+    retry_policy: RetryPolicy,
+    connection_stats: ConnectionStats,
+    metrics: Metrics,
 ):
-    thread_count_pluralised = "" if number_of_threads == 1 else "s"
-    console.log(f"Using {number_of_threads} thread{thread_count_pluralised}")
+    if options.shard_index >= options.shard_count:
+        console.log("Error: --shard-index must be less than --shard-count.")
+        exit(1)
+
+    if (
+        options.shard_count > 1 or len(options.merge_plan_files) > 0
+    ) and options.plan_file_path is None:
+        console.log(
+            "Error: --plan-file-path must be specified when using shards or merging plan files."
+        )
+        exit(1)
+
+    if options.apply_plan_file_path is not None and (
+        options.shard_count > 1
+        or len(options.merge_plan_files) > 0
+        or options.plan_file_path is not None
+    ):
+        console.log(
+            "Error: --apply-plan-file-path cannot be used with shards, --plan-file-path or --merge-plan-files."
+        )
+        exit(1)
+
+    if options.resume and options.journal_file_path is None:
+        console.log("Error: --journal-file-path must be specified to resume.")
+        exit(1)
+
+    if options.journal_file_path is not None and options.plan_file_path is not None:
+        console.log(
+            "Error: --journal-file-path cannot be used with --plan-file-path as no mitigations are applied."
+        )
+        exit(1)
+
+    if options.resume and options.apply_plan_file_path is not None:
+        console.log("Error: --resume cannot be used with --apply-plan-file-path.")
+        exit(1)
 
+    if options.stream_mitigations and not options.auto_apply_mitigations:
+        console.log(
+            "Error: --auto-apply-mitigations must be set to true to stream mitigations."
+        )
+        exit(1)
+
+    if options.stream_mitigations and options.engine == "async":
+        console.log("Error: Streaming mitigations requires the threads engine.")
+        exit(1)
+
+    if options.stream_mitigations and (
+        options.plan_file_path is not None
+        or options.apply_plan_file_path is not None
+        or options.journal_file_path is not None
+    ):
+        console.log(
+            "Error: --stream-mitigations cannot be used with plan files or --journal-file-path."
+        )
+        exit(1)
+
+    if len(options.merge_plan_files) > 0:
+        merge_plans(
+            options.mitigations_file, options.merge_plan_files, options.plan_file_path
+        )
+        return
+
+    if options.engine == "async":
+        request_count_pluralised = "" if options.max_concurrent_requests == 1 else "s"
+        console.log(
+            f"Using the async engine with up to {options.max_concurrent_requests} concurrent request{request_count_pluralised}"
+        )
+    else:
+        thread_count_pluralised = "" if options.number_of_threads == 1 else "s"
+        console.log(
+            f"Using {options.number_of_threads} thread{thread_count_pluralised}"
+        )
+
+    bulk_mitigations = BulkMitigations(console, options.mitigations_file)
+
+    journal = (
+        None
+        if options.journal_file_path is None
+        else Journal(console, options.journal_file_path)
+    )
+    planned_mitigations = None
+
+    # Check the plan before connecting so a stale plan fails fast
+    if options.resume:
+        journal.replay(bulk_mitigations)
+        planned_mitigations = journal.mitigations
+    elif journal is not None and journal.exists():
+        console.log(
+            f'Error: "{options.journal_file_path}" is from a run which did not finish. Set --resume to true to finish it, or delete it.'
+        )
+        exit(1)
+    elif options.apply_plan_file_path is not None:
+        plan = load_plan(console, options.apply_plan_file_path, bulk_mitigations)
+        assert_plan_is_fresh(
+            console, plan, options.apply_plan_file_path, options.max_plan_age_hours
+        )
+        planned_mitigations = plan.mitigations
+
+    api = API(
+        console,
+        options.number_of_threads,
+        retry_policy,
+        options.connection_pool_size,
+        connection_stats,
+        metrics=metrics,
+    )
+
+    def run_async(function):
+        return run_with_async_api(
+            console,
+            options.max_concurrent_requests,
+            function,
+            retry_policy,
+            options.connection_pool_size,
+            connection_stats,
+            metrics,
+        )
+
+    # The findings were fetched when the plan was made
+    if planned_mitigations is not None:
+        if len(planned_mitigations) < 1:
+            console.log("There are no mitigations to apply.")
+            return
+
+        print_summary(planned_mitigations)
+        apply_mitigations(options, api, run_async, planned_mitigations, journal)
+        return
+
+    application_cache = ApplicationCache(
+        console,
+        options.application_cache_file_path,
+        options.application_cache_ttl_hours,
+    )
+
+    # Closed whatever happens so the database is left complete, with no temporary files beside it
+    try:
+        find_and_apply_mitigations(
+            options,
+            api,
+            run_async,
+            bulk_mitigations,
+            application_cache,
+            journal,
+            retry_policy,
+        )
+    finally:
+        application_cache.close()
+
+
+def find_and_apply_mitigations(
+    options: Options,
+    api: API,
+    run_async,
+    bulk_mitigations: BulkMitigations,
+    application_cache: ApplicationCache,
+    journal: Journal,
+    retry_policy: RetryPolicy,
+):
     mitigations_to_add: list[MitigationToAdd] = []
-    bulk_mitigations = BulkMitigations(console, mitigations_file)
-    api = API(console)
+    incremental_state = (
+        None
+        if options.incremental_state_file_path is None
+        else IncrementalState(console, options.incremental_state_file_path)
+    )
 
     application_names = []
+    all_applications = None
 
-    if all_application_profiles:
+    if options.all_application_profiles:
         console.log("Identifying all applications...")
 
         # Try to resolve all application names
-        all_applications = api.get_all_applications()
+        all_applications = (
+            run_async(
+                lambda async_api: async_api.get_all_applications(),
+            )
+            if options.engine == "async"
+            else retry_policy.run(api.get_all_applications)
+        )
         for application in all_applications:
             application_names.append(application["profile"]["name"])
     else:
-        application_names = load_applications_from_file(application_names_file)
+        application_names = load_applications_from_file(options.application_names_file)
+
+    if options.engine == "async":
+        applications_to_process = run_async(
+            lambda async_api: async_acquire_applications(
+                console,
+                async_api,
+                bulk_mitigations,
+                application_names,
+                application_cache,
+                require_scan_dates=incremental_state is not None,
+                all_applications=all_applications,
+                listing_threshold=options.application_listing_threshold,
+                shard_index=options.shard_index,
+                shard_count=options.shard_count,
+            ),
+        )
+    else:
+        applications_to_process = acquire_applications(
+            console,
+            api,
+            bulk_mitigations,
+            application_names,
+            application_cache,
+            options.number_of_threads,
+            require_scan_dates=incremental_state is not None,
+            all_applications=all_applications,
+            listing_threshold=options.application_listing_threshold,
+            shard_index=options.shard_index,
+            shard_count=options.shard_count,
+        )
 
-    applications_to_process = acquire_applications(
+    scan_plans = plan_scans(
         console,
-        api,
         bulk_mitigations,
-        application_names,
-        application_cache_file_path,
-        number_of_threads,
+        applications_to_process,
+        options.max_cwes_per_request,
+        None if incremental_state is None else incremental_state.filter_unchanged,
     )
 
-    if len(applications_to_process) > 0:
-        process(
-            console,
-            api,
-            bulk_mitigations,
-            applications_to_process,
-            mitigations_to_add,
-            number_of_threads,
+    stream = (
+        MitigationStream(
+            console, api, options.number_of_threads, options.max_annotation_batch_size
         )
+        if options.stream_mitigations
+        else None
+    )
+
+    if len(scan_plans) > 0:
+        match_pool = (
+            None
+            if options.match_processes < 1
+            else MatchPool(bulk_mitigations, options.match_processes)
+        )
+
+        try:
+            if options.engine == "async":
+                run_async(
+                    lambda async_api: async_process(
+                        console,
+                        async_api,
+                        scan_plans,
+                        mitigations_to_add,
+                        incremental_state=incremental_state,
+                        findings_page_size=options.findings_page_size,
+                        parallel_pages=options.parallel_pages_per_scan,
+                        application_cache=application_cache,
+                        match_pool=match_pool,
+                    ),
+                )
+            else:
+                process(
+                    console,
+                    api,
+                    scan_plans,
+                    mitigations_to_add,
+                    options.number_of_threads,
+                    incremental_state=incremental_state,
+                    findings_page_size=options.findings_page_size,
+                    parallel_pages=options.parallel_pages_per_scan,
+                    application_cache=application_cache,
+                    on_application_complete=(None if stream is None else stream.submit),
+                    match_pool=match_pool,
+                )
+        finally:
+            if match_pool is not None:
+                match_pool.close()
+
+    if stream is not None:
+        stream.finish()
+        save_incremental_state(incremental_state, retry_policy)
+        return
+
+    # The plan is applied later, possibly after merging with the plans of other shards
+    if options.plan_file_path is not None:
+        mitigations_to_add = sort_and_filter_mitigations(console, mitigations_to_add)
+
+        if len(mitigations_to_add) > 0:
+            print_summary(mitigations_to_add)
+
+        save_plan(console, options.plan_file_path, mitigations_to_add)
+        return
 
     if len(mitigations_to_add) < 1:
         console.log("There are no mitigations to apply.")
@@ -157,17 +692,20 @@ def main(
             console.log(
                 "Note that it is not possible to approve rejected mitigations without some other prior mitigation action."
             )
+
+        if incremental_state is not None:
+            incremental_state.save()
+
         return
 
-    mitigations_to_add = sort_and_filter_mitigations(mitigations_to_add)
+    mitigations_to_add = sort_and_filter_mitigations(console, mitigations_to_add)
 
     print_summary(mitigations_to_add)
 
-    if not auto_apply_mitigations:
-        if not Confirm.ask("Apply mitigations?"):
-            return
+    if not apply_mitigations(options, api, run_async, mitigations_to_add, journal):
+        return
 
-    bulk_mitigate(console, api, mitigations_to_add, number_of_threads)
+    save_incremental_state(incremental_state, retry_policy)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,78 @@
+from datetime import datetime, timezone
+from io import StringIO
+from json import dumps
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import patch
+
+from rich.console import Console
+
+from benchmarks.synthetic import generate_rule_data
+from bulk_mitigator import merge_plans
+from utils.bulk_mitigations_file import BulkMitigations
+from utils.list_of_applications import AppSandboxInfo
+from utils.plan_file import load_plan, save_plan
+from utils.processor import MitigationToAdd
+
+
+def create_mitigations_file() -> StringIO:
+    mitigations_file = StringIO(
+        dumps([generate_rule_data(index) for index in range(2)])
+    )
+    mitigations_file.name = "synthetic"
+    return mitigations_file
+
+
+@patch("bulk_mitigator.console", Console(quiet=True))
+class MergePlansTest(TestCase):
+    def setUp(self):
+        self.console = Console(quiet=True)
+        self.bulk_mitigations = BulkMitigations(self.console, create_mitigations_file())
+        self.directory = TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def save_shard(
+        self, name: str, created_at: datetime, mitigations: list[MitigationToAdd]
+    ) -> str:
+        file_path = str(Path(self.directory.name) / name)
+        save_plan(self.console, file_path, mitigations, created_at)
+        return file_path
+
+    def create_mitigation(self, flaw_number: int, day: int) -> MitigationToAdd:
+        return MitigationToAdd(
+            AppSandboxInfo("Application", "a"),
+            self.bulk_mitigations.items[0],
+            flaw_number,
+            datetime(2025, 6, day, tzinfo=timezone.utc),
+        )
+
+    def test_shards_are_merged_without_duplicates(self):
+        oldest = datetime(2025, 6, 10, tzinfo=timezone.utc)
+        first = self.save_shard(
+            "first.json",
+            datetime(2025, 6, 11, tzinfo=timezone.utc),
+            [self.create_mitigation(1, 1), self.create_mitigation(2, 1)],
+        )
+        # The same flaw was planned again by a later run
+        second = self.save_shard(
+            "second.json",
+            oldest,
+            [self.create_mitigation(2, 2), self.create_mitigation(3, 1)],
+        )
+        merged_path = str(Path(self.directory.name) / "merged.json")
+
+        merge_plans(create_mitigations_file(), (first, second), merged_path)
+        plan = load_plan(self.console, merged_path, self.bulk_mitigations)
+
+        # The merged plan is only as fresh as its oldest shard
+        self.assertEqual(plan.created_at, oldest)
+        self.assertEqual(
+            [
+                (mitigation.flaw_number, mitigation.last_seen.day)
+                for mitigation in plan.mitigations
+            ],
+            [(2, 2), (1, 1), (3, 1)],
+        )
@@ -1,10 +1,21 @@
+from collections import deque
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from itertools import islice
 from requests import RequestException
-from veracode_api_py.api import APICredentials, Applications, Sandboxes, Findings, Users
+from urllib.parse import quote
+from veracode_api_py.api import APICredentials, Users
+from veracode_api_py.apihelper import APIHelper
 from rich.console import Console
-from time import sleep
+from time import monotonic
 import logging
-from threading import Lock
+from threading import Condition, Lock
 from secrets import randbelow
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from utils.connection_pool import ConnectionStats, create_session
+from utils.metrics import Metrics, current_attempt, get_endpoint_name
 
 # Disable some warnings and traceback logging from the underlying API to prevent clutter in the log
 logging.getLogger("urllib3").setLevel(logging.CRITICAL)
@@ -12,11 +23,256 @@ logging.getLogger("requests").setLevel(logging.CRITICAL)
 logging.getLogger("veracode_api_py.apihelper").setLevel(logging.CRITICAL)
 
 
+# Responses which mean the API wants us to slow down
+THROTTLING_STATUS_CODES = [429, 503]
+
+# Responses worth requesting again, any other client error fails the same way however often it is sent
+RETRY_STATUS_CODES = [429, 500, 502, 503, 504]
+
+# Used when a throttling response does not say how long to wait
+DEFAULT_THROTTLING_PAUSE_SECONDS = 10
+
+MAX_BACK_OFF_SECONDS = 120
+
+# Throttling pauses are not failures but the API should not be retried forever
+MAX_THROTTLED_ATTEMPTS = 10
+
+# The largest page the applications API allows, so the whole portfolio is listed in few requests
+APPLICATIONS_PAGE_SIZE = 500
+
+CIRCUIT_BREAKER_FAILURE_THRESHOLD = 5
+CIRCUIT_BREAKER_RESET_SECONDS = 60
+CIRCUIT_BREAKER_TRIAL_WAIT_SECONDS = 1
+
+# An endpoint still failing after this many cool downs is given up on for the rest of the run
+CIRCUIT_BREAKER_MAX_TRIALS = 5
+
+
+def parse_retry_after(retry_after: str) -> float:
+    if retry_after is None:
+        return None
+
+    retry_after = retry_after.strip()
+
+    if retry_after.isdigit():
+        return float(retry_after)
+
+    try:
+        return max(
+            0.0,
+            (
+                parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)
+            ).total_seconds(),
+        )
+    except (TypeError, ValueError):
+        return None
+
+
+def get_status_code(err: Exception) -> int:
+    response = getattr(err, "response", None)
+
+    return None if response is None else response.status_code
+
+
+def get_throttling(err: Exception) -> tuple[bool, float]:
+    response = getattr(err, "response", None)
+
+    if response is None or response.status_code not in THROTTLING_STATUS_CODES:
+        return False, None
+
+    return True, parse_retry_after(response.headers.get("Retry-After"))
+
+
+def get_back_off_seconds(attempt: int) -> float:
+    # Exponential with jitter so that failing workers do not retry in lockstep
+    return min(MAX_BACK_OFF_SECONDS, 2**attempt) * (0.5 + randbelow(1000) / 2000)
+
+
+# An additive increase, multiplicative decrease limit on in-flight requests shared by all workers
+class ConcurrencyGovernor:
+    def __init__(self, max_limit: int, min_limit: int = 1):
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self._limit = float(self.max_limit)
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._condition = Condition()
+
+    def get_limit(self) -> int:
+        return int(self._limit)
+
+    def _can_start(self, now: float) -> bool:
+        return now >= self._paused_until and self._in_flight < int(self._limit)
+
+    def try_acquire(self) -> bool:
+        with self._condition:
+            if not self._can_start(monotonic()):
+                return False
+
+            self._in_flight += 1
+            return True
+
+    def get_pause_seconds(self) -> float:
+        with self._condition:
+            return max(0.0, self._paused_until - monotonic())
+
+    def acquire(self) -> None:
+        with self._condition:
+            while not self._can_start(monotonic()):
+                self._condition.wait(max(0.05, self._paused_until - monotonic()))
+
+            self._in_flight += 1
+
+    def release(
+        self, succeeded: bool = True, throttled: bool = False, retry_after: float = None
+    ) -> None:
+        with self._condition:
+            self._in_flight -= 1
+            now = monotonic()
+
+            if throttled:
+                # Only shrink once per throttling episode, other in-flight requests will also be throttled
+                if now >= self._paused_until:
+                    self._limit = max(self.min_limit, self._limit / 2)
+
+                pause = (
+                    DEFAULT_THROTTLING_PAUSE_SECONDS
+                    if retry_after is None
+                    else retry_after
+                )
+                self._paused_until = max(self._paused_until, now + pause)
+            elif succeeded:
+                # Grows by roughly one per full window of successful requests
+                self._limit = min(self.max_limit, self._limit + 1 / self._limit)
+
+            self._condition.notify_all()
+
+
+class APIRequestError(Exception):
+    # Set by RetryPolicy.run once the request has been retried on its own
+    attempts = 1
+
+    def __init__(
+        self, request_signature: str, cause: Exception, status_code: int = None
+    ):
+        super().__init__(f"{request_signature} failed: {cause!r}")
+        self.endpoint = request_signature.split(":")[0]
+        # None when there was no response, e.g. the connection was reset
+        self.status_code = status_code
+
+    def is_retryable(self) -> bool:
+        return self.status_code is None or self.status_code in RETRY_STATUS_CODES
+
+
+class CircuitOpenError(APIRequestError):
+    def __init__(self, endpoint: str, retry_in: float = None):
+        Exception.__init__(
+            self,
+            (
+                f"{endpoint} is still failing after {CIRCUIT_BREAKER_MAX_TRIALS} trial requests"
+                if retry_in is None
+                else f"{endpoint} is failing, requests paused for {retry_in:.0f}s"
+            ),
+        )
+        self.endpoint = endpoint
+        self.status_code = None
+        # None once the endpoint has been given up on
+        self.retry_in = retry_in
+
+
+# Stops requests to an endpoint which keeps failing. After a cool down a single trial request is let through,
+# which closes the circuit if it succeeds or opens it again if it fails.
+class CircuitBreaker:
+    def __init__(
+        self,
+        endpoint: str,
+        failure_threshold: int = CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+        reset_seconds: float = CIRCUIT_BREAKER_RESET_SECONDS,
+        max_trials: int = CIRCUIT_BREAKER_MAX_TRIALS,
+    ):
+        self.endpoint = endpoint
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.max_trials = max_trials
+        self._consecutive_failures = 0
+        self._failed_trials = 0
+        self._open_until = 0.0
+        self._is_trial_in_flight = False
+        self._lock = Lock()
+
+    # Returns whether the request is the trial request
+    def before_request(self) -> bool:
+        with self._lock:
+            if self._consecutive_failures < self.failure_threshold:
+                return False
+
+            if self._failed_trials >= self.max_trials:
+                raise CircuitOpenError(self.endpoint)
+
+            retry_in = self._open_until - monotonic()
+
+            if retry_in <= 0:
+                if not self._is_trial_in_flight:
+                    self._is_trial_in_flight = True
+                    return True
+
+                # Check again once the trial request has had time to finish
+                retry_in = CIRCUIT_BREAKER_TRIAL_WAIT_SECONDS
+
+        raise CircuitOpenError(self.endpoint, retry_in)
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._consecutive_failures = 0
+            self._failed_trials = 0
+            self._is_trial_in_flight = False
+
+    def record_failure(self, is_trial: bool) -> None:
+        with self._lock:
+            self._consecutive_failures += 1
+
+            if is_trial:
+                self._failed_trials += 1
+                self._is_trial_in_flight = False
+
+            if self._consecutive_failures >= self.failure_threshold:
+                self._open_until = monotonic() + self.reset_seconds
+
+    def record_throttled(self, is_trial: bool) -> None:
+        # Says nothing about whether the endpoint works, so another request can be the trial
+        if is_trial:
+            with self._lock:
+                self._is_trial_in_flight = False
+
+
 class API:
-    def __init__(self, console: Console):
+    def __init__(
+        self,
+        console: Console,
+        max_concurrency: int = 10,
+        retry_policy=None,
+        pool_size: int = None,
+        connection_stats: ConnectionStats = None,
+        base_url: str = None,
+        metrics: Metrics = None,
+    ):
         self.console = console
-        self.request_counters: dict[str, int] = {}
+        self.metrics = metrics
         self.lock = Lock()
+        self.governor = ConcurrencyGovernor(max_concurrency)
+        self.circuit_breakers: dict[str, CircuitBreaker] = {}
+        self.retry_policy = retry_policy
+        self.session = create_session(
+            max_concurrency if pool_size is None else pool_size
+        )
+        # Defaults to the region of the API credentials
+        self.base_url = APIHelper().base_rest_url if base_url is None else base_url
+
+        # Pages of a single scan are fetched on their own threads so workers never wait on each other
+        self.page_pool = ThreadPoolExecutor(max_workers=max_concurrency)
+
+        if connection_stats is not None:
+            connection_stats.track_session(self.session)
 
         console.log("Testing API connectivity...")
         self.assert_connection()
@@ -27,12 +283,8 @@ class API:
         )
         exit(1)
 
-    def back_off(self, e: Exception):
-        seconds_to_wait = randbelow(111) + 10
-        self.console.log(
-            f'Backing off for {seconds_to_wait}s due to an API error. Request will be retried. If this occurs often consider reducing the number of threads with the "--number_of_threads" argument'
-        )
-        sleep(seconds_to_wait)
+    def get_concurrency_status(self) -> str:
+        return f"{self.governor.get_limit()} concurrent"
 
     def assert_connection(self) -> None:
         try:
@@ -58,85 +310,254 @@ class API:
             )
             exit(1)
 
-    def update_counter(self, request_signature):
+    def get_phase_metrics(self, name: str):
+        return None if self.metrics is None else self.metrics.get_phase(name)
+
+    def get_circuit_breaker(self, endpoint: str) -> CircuitBreaker:
         with self.lock:
-            if request_signature in self.request_counters:
-                self.request_counters[request_signature] = (
-                    self.request_counters[request_signature] + 1
+            if endpoint not in self.circuit_breakers:
+                self.circuit_breakers[endpoint] = CircuitBreaker(endpoint)
+
+            return self.circuit_breakers[endpoint]
+
+    # Errors are raised rather than slept on so the caller can defer the retry, see utils/retry.py
+    def call(self, request_signature: str, function, *args, **kwargs):
+        circuit_breaker = self.get_circuit_breaker(request_signature.split(":")[0])
+        first_attempt = current_attempt.get()
+        throttled_attempts = 0
+
+        while True:
+            is_trial = circuit_breaker.before_request()
+            wait_started_at = monotonic()
+            self.governor.acquire()
+
+            if self.metrics is not None:
+                self.metrics.get_current_phase().record_request_wait(
+                    monotonic() - wait_started_at
                 )
-            else:
-                self.request_counters[request_signature] = 1
 
-            # Max attempts = 5
-            if self.request_counters[request_signature] > 5:
-                self.console.log("Error: Giving up, too many request errors.")
-                exit(1)
+            # Requests made again after being throttled are retries
+            attempt_token = current_attempt.set(first_attempt + throttled_attempts)
 
-    def get_all_applications(self):
-        self.update_counter("get_all_applications")
+            try:
+                result = function(*args, **kwargs)
+            except Exception as err:
+                throttled, retry_after = get_throttling(err)
+                self.governor.release(False, throttled, retry_after)
+                throttled_attempts += 1
 
-        try:
-            return Applications().get_all()
-        except Exception as err:
-            self.back_off(err)
-            return self.get_all_applications()
+                # The governor pauses all requests when throttled
+                if throttled and throttled_attempts < MAX_THROTTLED_ATTEMPTS:
+                    circuit_breaker.record_throttled(is_trial)
+                    continue
 
-    def get_applications_by_name(self, application_name: str):
-        self.update_counter(f"get_applications_by_name:{application_name}")
+                circuit_breaker.record_failure(is_trial)
+                raise APIRequestError(
+                    request_signature, err, get_status_code(err)
+                ) from err
+            finally:
+                current_attempt.reset(attempt_token)
+
+            self.governor.release()
+            circuit_breaker.record_success()
+            return result
+
+    # Retried with a back off on its own, so one failed page does not mean requesting the whole scan again
+    def call_with_retries(self, request_signature: str, function, *args, **kwargs):
+        if self.retry_policy is None:
+            return self.call(request_signature, function, *args, **kwargs)
+
+        # An open circuit is raised so the task's executor can park the whole task
+        return self.retry_policy.run(
+            lambda: self.call(request_signature, function, *args, **kwargs),
+            wait_for_circuit=False,
+        )
+
+    def request(
+        self,
+        method: str,
+        path: str,
+        params: dict = None,
+        body: dict = None,
+        decode: bool = True,
+    ):
+        endpoint = get_endpoint_name(method, path)
+        started_at = (
+            None if self.metrics is None else self.metrics.start_request(endpoint)
+        )
+        response = None
 
         try:
-            return Applications().get_by_name(application_name)
-        except Exception as err:
-            self.back_off(err)
-            return self.get_applications_by_name(application_name)
+            response = self.session.request(
+                method, self.base_url + path, params=params, json=body
+            )
+            response.raise_for_status()
+        finally:
+            if started_at is not None:
+                self.metrics.finish_request(
+                    endpoint,
+                    started_at,
+                    0 if response is None else len(response.content),
+                    response is not None and response.ok,
+                    response is not None
+                    and response.status_code in THROTTLING_STATUS_CODES,
+                )
+
+        # Undecoded content can be handed to another process to decode
+        if not decode:
+            return response.content
+
+        return response.json() if len(response.content) > 0 else {}
+
+    def get_all_pages(
+        self, request_signature: str, path: str, element: str, params: dict = None
+    ) -> list[dict]:
+        params = {} if params is None else params.copy()
+        all_data = []
+        page = 0
+
+        while True:
+            params["page"] = page
+            call = self.call if page == 0 else self.call_with_retries
+            page_data = call(
+                f"{request_signature},{page}", self.request, "GET", path, params
+            )
+            all_data += page_data.get("_embedded", {}).get(element, [])
+            page += 1
+
+            if page >= page_data.get("page", {}).get("total_pages", 0):
+                return all_data
+
+    def get_all_applications(self):
+        return self.get_all_pages(
+            "get_all_applications:",
+            "appsec/v1/applications",
+            "applications",
+            {"size": APPLICATIONS_PAGE_SIZE},
+        )
+
+    def get_applications_by_name(self, application_name: str):
+        # Encoded the same way as veracode_api_py
+        return self.get_all_pages(
+            f"get_applications_by_name:{application_name}",
+            "appsec/v1/applications",
+            "applications",
+            {"name": quote(application_name)},
+        )
 
     def get_sandboxes(self, application_guid: str):
-        self.update_counter(f"get_sandboxes:{application_guid}")
+        return self.get_all_pages(
+            f"get_sandboxes:{application_guid}",
+            f"appsec/v1/applications/{application_guid}/sandboxes",
+            "sandboxes",
+        )
 
-        try:
-            return Sandboxes().get_all(application_guid)
-        except Exception as err:
-            self.back_off(err)
-            return self.get_sandboxes(application_guid)
+    def get_findings_page(
+        self,
+        application_guid: str,
+        sandbox_guid: str = None,
+        page: int = 0,
+        page_size: int = 500,
+        findings_filter: dict = None,
+        decode: bool = True,
+    ) -> dict:
+        params = {
+            "scan_type": "STATIC",
+            "include_annot": "TRUE",
+            "page": page,
+            "size": page_size,
+        }
 
-    def get_findings(self, application_guid: str, sandbox_guid: str = None):
-        self.update_counter(f"get_findings:{application_guid},{sandbox_guid}")
+        if sandbox_guid is not None:
+            params["context"] = sandbox_guid
 
-        try:
-            findings = Findings().get_findings(
-                app=application_guid,
-                scantype="STATIC",
-                annot="TRUE",
-                sandbox=sandbox_guid,
+        if findings_filter is not None:
+            params.update(findings_filter)
+
+        # Retrying the first page is the same as retrying the whole query, which the task's executor does
+        # without holding up a worker
+        call = self.call if page == 0 else self.call_with_retries
+
+        return call(
+            f"get_findings_page:{application_guid},{sandbox_guid},{findings_filter},{page}",
+            self.request,
+            "GET",
+            f"appsec/v2/applications/{application_guid}/findings",
+            params,
+            decode=decode,
+        )
+
+    def get_findings_pages(
+        self,
+        application_guid: str,
+        sandbox_guid: str = None,
+        page_size: int = 500,
+        findings_filter: dict = None,
+        parallel_pages: int = 1,
+    ) -> Iterator[list[dict]]:
+        def get_page(page: int) -> dict:
+            return self.get_findings_page(
+                application_guid, sandbox_guid, page, page_size, findings_filter
             )
-            if findings is not None:
-                return findings
-        except Exception as err:
-            self.back_off(err)
-            return self.get_findings(application_guid, sandbox_guid)
 
-    def add_mitigation(
+        # The first page says how many more there are
+        page_data = get_page(0)
+        total_pages = page_data.get("page", {}).get("total_pages", 0)
+
+        yield page_data.get("_embedded", {}).get("findings", [])
+
+        # Yield each page as it arrives rather than holding the whole scan in memory
+        for page_data in self.get_pages_in_order(
+            get_page, range(1, total_pages), parallel_pages
+        ):
+            yield page_data.get("_embedded", {}).get("findings", [])
+
+    def get_pages_in_order(
+        self, get_page, pages: range, parallel_pages: int
+    ) -> Iterator[dict]:
+        if parallel_pages < 2:
+            for page in pages:
+                yield get_page(page)
+
+            return
+
+        # Up to parallel_pages requests are in flight, the governor still limits the total across all scans
+        # Each page is fetched in a copy of the caller's context, so its requests are counted in the caller's phase
+        remaining_pages = iter(pages)
+        pending = deque(
+            self.page_pool.submit(copy_context().run, get_page, page)
+            for page in islice(remaining_pages, parallel_pages)
+        )
+
+        try:
+            while len(pending) > 0:
+                page_data = pending.popleft().result()
+
+                for page in islice(remaining_pages, 1):
+                    pending.append(
+                        self.page_pool.submit(copy_context().run, get_page, page)
+                    )
+
+                yield page_data
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def add_mitigations(
         self,
         application_guid: str,
-        flaw_id: int,
+        flaw_ids: list[int],
         action: str,
         comment: str,
         sandbox_guid: str = None,
     ):
-        self.update_counter(
-            f"add_mitigation{application_guid},{flaw_id},{action},{comment},{sandbox_guid}"
-        )
+        flaw_list = ",".join(str(flaw_id) for flaw_id in flaw_ids)
 
-        try:
-            Findings().add_annotation(
-                application_guid,
-                [flaw_id],
-                comment,
-                action,
-                sandbox_guid,
-            )
-        except Exception as err:
-            self.back_off(err)
-            self.add_mitigation(
-                application_guid, flaw_id, action, comment, sandbox_guid
-            )
+        self.call(
+            f"add_mitigations:{application_guid},{flaw_list},{action},{comment},{sandbox_guid}",
+            self.request,
+            "POST",
+            f"appsec/v2/applications/{application_guid}/annotations",
+            None if sandbox_guid is None else {"context": sandbox_guid},
+            {"comment": comment, "action": action, "issue_list": flaw_list},
+        )
@@ -0,0 +1,237 @@
+from json import dumps
+from time import sleep
+from unittest import TestCase
+from unittest.mock import patch
+
+from requests import Response
+from rich.console import Console
+
+from benchmarks.end_to_end import OfflineAPI
+from utils.api import (
+    APIRequestError,
+    CircuitBreaker,
+    CircuitOpenError,
+    ConcurrencyGovernor,
+    parse_retry_after,
+)
+from utils.retry import MAX_TASK_ATTEMPTS, RetryPolicy
+
+RESET_SECONDS = 0.05
+
+
+class ConcurrencyGovernorTest(TestCase):
+    def test_limits_requests_in_flight(self):
+        governor = ConcurrencyGovernor(2)
+
+        self.assertTrue(governor.try_acquire())
+        self.assertTrue(governor.try_acquire())
+        self.assertFalse(governor.try_acquire())
+
+        governor.release()
+
+        self.assertTrue(governor.try_acquire())
+
+    def test_throttling_halves_the_limit_once_and_pauses(self):
+        governor = ConcurrencyGovernor(8)
+
+        for _ in range(3):
+            governor.acquire()
+
+        governor.release(False, True, 10)
+
+        self.assertEqual(governor.get_limit(), 4)
+        self.assertFalse(governor.try_acquire())
+        self.assertGreater(governor.get_pause_seconds(), 9)
+
+        # The other requests in flight were throttled by the same episode
+        governor.release(False, True, 10)
+        governor.release(False, True, 10)
+
+        self.assertEqual(governor.get_limit(), 4)
+
+    def test_successes_grow_the_limit_back(self):
+        governor = ConcurrencyGovernor(8)
+        governor.acquire()
+        governor.release(False, True, 0)
+
+        self.assertEqual(governor.get_limit(), 4)
+
+        # A little over one window of successful requests
+        for _ in range(5):
+            governor.acquire()
+            governor.release()
+
+        self.assertEqual(governor.get_limit(), 5)
+
+    def test_limit_stays_within_bounds(self):
+        governor = ConcurrencyGovernor(4, min_limit=2)
+
+        for _ in range(5):
+            governor.acquire()
+            governor.release(False, True, 0)
+
+        self.assertEqual(governor.get_limit(), 2)
+
+        for _ in range(100):
+            governor.acquire()
+            governor.release()
+
+        self.assertEqual(governor.get_limit(), 4)
+
+    def test_parse_retry_after(self):
+        self.assertEqual(parse_retry_after("5"), 5)
+        self.assertEqual(parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT"), 0)
+        self.assertIsNone(parse_retry_after("soon"))
+        self.assertIsNone(parse_retry_after(None))
+
+
+class CircuitBreakerTest(TestCase):
+    def setUp(self):
+        self.circuit_breaker = CircuitBreaker(
+            "endpoint", failure_threshold=2, reset_seconds=RESET_SECONDS, max_trials=2
+        )
+
+    def open_circuit(self):
+        for _ in range(2):
+            self.circuit_breaker.record_failure(self.circuit_breaker.before_request())
+
+    def test_opens_after_consecutive_failures(self):
+        self.circuit_breaker.record_failure(False)
+        self.circuit_breaker.record_success()
+        self.circuit_breaker.record_failure(False)
+
+        self.assertFalse(self.circuit_breaker.before_request())
+
+        self.circuit_breaker.record_failure(False)
+
+        with self.assertRaises(CircuitOpenError) as context:
+            self.circuit_breaker.before_request()
+
+        self.assertGreater(context.exception.retry_in, 0)
+
+    def test_single_trial_closes_the_circuit(self):
+        self.open_circuit()
+        sleep(RESET_SECONDS)
+
+        self.assertTrue(self.circuit_breaker.before_request())
+
+        # Only one trial request is let through at a time
+        with self.assertRaises(CircuitOpenError) as context:
+            self.circuit_breaker.before_request()
+
+        self.assertIsNotNone(context.exception.retry_in)
+
+        self.circuit_breaker.record_success()
+
+        self.assertFalse(self.circuit_breaker.before_request())
+
+    def test_throttled_trial_lets_another_through(self):
+        self.open_circuit()
+        sleep(RESET_SECONDS)
+        self.circuit_breaker.record_throttled(self.circuit_breaker.before_request())
+
+        self.assertTrue(self.circuit_breaker.before_request())
+
+    def test_gives_up_after_failed_trials(self):
+        self.open_circuit()
+
+        for _ in range(2):
+            sleep(RESET_SECONDS)
+            self.circuit_breaker.record_failure(self.circuit_breaker.before_request())
+
+        sleep(RESET_SECONDS)
+
+        with self.assertRaises(CircuitOpenError) as context:
+            self.circuit_breaker.before_request()
+
+        self.assertIsNone(context.exception.retry_in)
+
+
+class FlakyRequest:
+    def __init__(self, failure_count: int):
+        self.failure_count = failure_count
+        self.call_count = 0
+
+    def __call__(self):
+        self.call_count += 1
+
+        if self.call_count <= self.failure_count:
+            raise ConnectionError("Connection reset")
+
+        return {"page": self.call_count}
+
+
+@patch("utils.retry.sleep")
+class CallWithRetriesTest(TestCase):
+    def setUp(self):
+        self.console = Console(quiet=True)
+        self.retry_policy = RetryPolicy(self.console, 100)
+        self.api = OfflineAPI(
+            self.console, 2, self.retry_policy, base_url="http://127.0.0.1:1/"
+        )
+
+    def test_failed_request_is_retried_on_its_own(self, _):
+        request = FlakyRequest(2)
+
+        self.assertEqual(self.api.call_with_retries("page:1", request), {"page": 3})
+        self.assertEqual(self.retry_policy.retry_budget, 98)
+
+    def test_exhausted_request_is_not_retried_by_its_task(self, _):
+        request = FlakyRequest(MAX_TASK_ATTEMPTS)
+
+        with self.assertRaises(APIRequestError) as context:
+            self.api.call_with_retries("page:1", request)
+
+        self.assertEqual(request.call_count, MAX_TASK_ATTEMPTS)
+        self.assertIsNone(self.retry_policy.get_retry_delay(context.exception, 1))
+
+    def test_open_circuit_is_left_to_the_task(self, _):
+        self.api.circuit_breakers["page"] = CircuitBreaker("page", failure_threshold=1)
+        request = FlakyRequest(1)
+
+        with self.assertRaises(APIRequestError):
+            self.api.call("page:0", request)
+
+        with self.assertRaises(CircuitOpenError) as context:
+            self.api.call_with_retries("page:1", request)
+
+        self.assertIsNotNone(context.exception.retry_in)
+        self.assertEqual(request.call_count, 1)
+        self.assertEqual(self.retry_policy.retry_budget, 100)
+
+
+def create_response(content: bytes) -> Response:
+    response = Response()
+    response.status_code = 200
+    response._content = content
+    return response
+
+
+class FindingsPagesTest(TestCase):
+    def setUp(self):
+        self.api = OfflineAPI(Console(quiet=True), 2, base_url="http://127.0.0.1:1/")
+
+    def test_empty_response_has_no_findings(self):
+        with patch.object(
+            self.api.session, "request", return_value=create_response(b"")
+        ):
+            self.assertEqual(list(self.api.get_findings_pages("a")), [[]])
+
+    def test_every_page_is_yielded(self):
+        pages = [
+            {
+                "_embedded": {"findings": [{"issue_id": page}]},
+                "page": {"total_pages": 3},
+            }
+            for page in range(3)
+        ]
+
+        with patch.object(
+            self.api.session,
+            "request",
+            side_effect=[create_response(dumps(page).encode()) for page in pages],
+        ):
+            self.assertEqual(
+                list(self.api.get_findings_pages("a", parallel_pages=1)),
+                [[{"issue_id": page}] for page in range(3)],
+            )
@@ -0,0 +1,460 @@
+from asyncio import CancelledError, Future, create_task, get_running_loop, run, sleep
+from collections import deque
+from collections.abc import AsyncIterator, Iterator
+from itertools import islice
+from json import dumps, loads
+from time import monotonic
+from urllib.parse import quote, urlencode, urlsplit
+
+from aiohttp import ClientError, ClientResponseError, ClientSession, TCPConnector
+from rich.console import Console
+from utils.connection_pool import ConnectionStats, create_trace_config
+from utils.metrics import Metrics, get_endpoint_name
+from utils.retry import RetryPolicy, is_waiting_for_circuit
+from utils.api import (
+    APPLICATIONS_PAGE_SIZE,
+    MAX_THROTTLED_ATTEMPTS,
+    THROTTLING_STATUS_CODES,
+    APIRequestError,
+    CircuitBreaker,
+    CircuitOpenError,
+    ConcurrencyGovernor,
+    parse_retry_after,
+)
+from veracode_api_py.constants import Constants
+from veracode_api_signing.credentials import get_credentials
+from veracode_api_signing.regions import get_region_for_api_credential
+from veracode_api_signing.veracode_hmac_auth import generate_veracode_hmac_header
+from yarl import URL
+
+
+# Requests wait on the event loop for the governor rather than polling it, and are let through in the order they arrived
+class AsyncConcurrencyGovernor:
+    def __init__(self, max_limit: int):
+        self.governor = ConcurrencyGovernor(max_limit)
+        self._waiters: deque[Future] = deque()
+        self._pause_timer = None
+
+    def get_limit(self) -> int:
+        return self.governor.get_limit()
+
+    async def acquire(self) -> None:
+        # Queue behind any earlier request so none is starved
+        if len(self._waiters) < 1 and self.governor.try_acquire():
+            return
+
+        waiter = get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self._wake_waiters()
+
+        try:
+            await waiter
+        except CancelledError:
+            # The request was cancelled just after being let through
+            if waiter.done() and not waiter.cancelled():
+                self.release(False)
+
+            raise
+
+    def release(
+        self, succeeded: bool = True, throttled: bool = False, retry_after: float = None
+    ) -> None:
+        self.governor.release(succeeded, throttled, retry_after)
+        self._wake_waiters()
+
+    def _wake_waiters(self) -> None:
+        while len(self._waiters) > 0:
+            # Cancelled while waiting
+            if self._waiters[0].done():
+                self._waiters.popleft()
+                continue
+
+            if not self.governor.try_acquire():
+                break
+
+            self._waiters.popleft().set_result(None)
+
+        # Nothing is released during a throttling pause, so the waiters are woken when it ends
+        if len(self._waiters) > 0 and self._pause_timer is None:
+            pause_seconds = self.governor.get_pause_seconds()
+
+            if pause_seconds > 0:
+                self._pause_timer = get_running_loop().call_later(
+                    pause_seconds, self._end_pause
+                )
+
+    def _end_pause(self) -> None:
+        self._pause_timer = None
+
+        # Starts another timer if the pause was extended
+        self._wake_waiters()
+
+
+class AsyncAPI:
+    def __init__(
+        self,
+        console: Console,
+        max_concurrent_requests: int,
+        retry_policy: RetryPolicy = None,
+        pool_size: int = None,
+        connection_stats: ConnectionStats = None,
+        base_url: str = None,
+        metrics: Metrics = None,
+    ):
+        self.console = console
+        self.metrics = metrics
+        self.max_concurrent_requests = max_concurrent_requests
+        self.retry_policy = retry_policy
+        self.pool_size = max_concurrent_requests if pool_size is None else pool_size
+        self.connection_stats = connection_stats
+        self._api_key_id, self._api_key_secret = get_credentials()
+
+        # Defaults to the region of the API credentials
+        self._base_url = (
+            Constants().REGIONS[get_region_for_api_credential(self._api_key_id)][
+                "base_rest_url"
+            ]
+            if base_url is None
+            else base_url
+        )
+        self._host = urlsplit(self._base_url).hostname
+        self.governor = AsyncConcurrencyGovernor(max_concurrent_requests)
+        self.circuit_breakers: dict[str, CircuitBreaker] = {}
+        self._session: ClientSession = None
+
+    async def __aenter__(self):
+        # This must be created inside the running event loop
+        self._session = ClientSession(
+            connector=TCPConnector(limit=self.pool_size, limit_per_host=self.pool_size),
+            trace_configs=(
+                []
+                if self.connection_stats is None
+                else [create_trace_config(self.connection_stats)]
+            ),
+        )
+        return self
+
+    async def __aexit__(self, *args):
+        await self._session.close()
+
+    async def back_off(self, seconds_to_wait: float):
+        self.console.log(
+            f"Backing off for {seconds_to_wait:.1f}s due to an API error. Request will be retried."
+        )
+
+        if self.metrics is not None:
+            self.metrics.get_current_phase().record_backoff(seconds_to_wait)
+
+        await sleep(seconds_to_wait)
+
+    async def wait_for_circuit(self, err: CircuitOpenError):
+        self.console.log(f"Waiting to retry: {err}")
+
+        if self.metrics is not None:
+            self.metrics.get_current_phase().record_backoff(err.retry_in)
+
+        await sleep(err.retry_in)
+
+    def get_concurrency_status(self) -> str:
+        return f"{self.governor.get_limit()} concurrent"
+
+    def get_phase_metrics(self, name: str):
+        return None if self.metrics is None else self.metrics.get_phase(name)
+
+    def get_circuit_breaker(self, endpoint: str) -> CircuitBreaker:
+        # Only used from the event loop's thread
+        if endpoint not in self.circuit_breakers:
+            self.circuit_breakers[endpoint] = CircuitBreaker(endpoint)
+
+        return self.circuit_breakers[endpoint]
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        params: dict = None,
+        body: dict = None,
+        decode: bool = True,
+    ):
+        path_and_query = "/" + path
+
+        if params is not None and len(params) > 0:
+            path_and_query += "?" + urlencode(params)
+
+        # The query string is signed so it must be sent exactly as encoded here
+        url = URL(self._base_url.rstrip("/") + path_and_query, encoded=True)
+        data = None if body is None else dumps(body)
+        endpoint = get_endpoint_name(method, path)
+        circuit_breaker = self.get_circuit_breaker(endpoint)
+        attempt = 1
+        throttled_attempts = 0
+
+        while True:
+            try:
+                is_trial = circuit_breaker.before_request()
+            except CircuitOpenError as err:
+                if not is_waiting_for_circuit(err):
+                    raise
+
+                # Waiting for the circuit to close is not a failed attempt and uses none of the budget
+                await self.wait_for_circuit(err)
+                continue
+
+            wait_started_at = monotonic()
+
+            await self.governor.acquire()
+
+            if self.metrics is not None:
+                self.metrics.get_current_phase().record_request_wait(
+                    monotonic() - wait_started_at
+                )
+
+            content = None
+            error = None
+            status_code = None
+            throttled = False
+            retry_after = None
+            started_at = (
+                None
+                if self.metrics is None
+                else self.metrics.start_request(endpoint, attempt + throttled_attempts)
+            )
+
+            try:
+                headers = {
+                    "Authorization": generate_veracode_hmac_header(
+                        self._host,
+                        path_and_query,
+                        method,
+                        self._api_key_id,
+                        self._api_key_secret,
+                    ),
+                    "User-Agent": "veracode_bulk_mitigator",
+                }
+
+                if data is not None:
+                    headers["Content-Type"] = "application/json"
+
+                async with self._session.request(
+                    method, url, headers=headers, data=data
+                ) as response:
+                    response.raise_for_status()
+                    content = await response.read()
+            except ClientResponseError as err:
+                error = err
+                status_code = err.status
+
+                if status_code in THROTTLING_STATUS_CODES:
+                    throttled = True
+                    retry_after = parse_retry_after(
+                        None if err.headers is None else err.headers.get("Retry-After")
+                    )
+            except (ClientError, TimeoutError) as err:
+                error = err
+            finally:
+                self.governor.release(content is not None, throttled, retry_after)
+
+                if started_at is not None:
+                    self.metrics.finish_request(
+                        endpoint,
+                        started_at,
+                        0 if content is None else len(content),
+                        content is not None,
+                        throttled,
+                    )
+
+            if error is None:
+                circuit_breaker.record_success()
+
+                # Undecoded content can be handed to another process to decode
+                if not decode:
+                    return content
+
+                return loads(content) if len(content) > 0 else {}
+
+            # The governor pauses all requests when throttled
+            if throttled and throttled_attempts < MAX_THROTTLED_ATTEMPTS - 1:
+                circuit_breaker.record_throttled(is_trial)
+                throttled_attempts += 1
+                continue
+
+            circuit_breaker.record_failure(is_trial)
+            request_error = APIRequestError(
+                f"{endpoint}:{path_and_query}", error, status_code
+            )
+
+            # Client errors are not retried, see RetryPolicy.get_retry_delay
+            seconds_to_wait = (
+                None
+                if self.retry_policy is None
+                else self.retry_policy.get_retry_delay(request_error, attempt)
+            )
+
+            if seconds_to_wait is None:
+                request_error.attempts = attempt
+                raise request_error from error
+
+            await self.back_off(seconds_to_wait)
+            attempt += 1
+
+    async def get_pages(
+        self, path: str, element: str, params: dict = None, parallel_pages: int = 1
+    ) -> AsyncIterator[list[dict]]:
+        params = {} if params is None else params
+
+        def get_page(page: int):
+            return self.request("GET", path, {**params, "page": page})
+
+        # The first page says how many more there are
+        page_data = await get_page(0)
+        remaining_pages = iter(
+            range(1, page_data.get("page", {}).get("total_pages", 0))
+        )
+
+        yield page_data.get("_embedded", {}).get(element, [])
+
+        async for page_data in self.get_pages_in_order(
+            get_page, remaining_pages, parallel_pages
+        ):
+            yield page_data.get("_embedded", {}).get(element, [])
+
+    async def get_pages_in_order(
+        self, get_page, pages: Iterator[int], parallel_pages: int
+    ) -> AsyncIterator:
+        # Up to parallel_pages requests are in flight, the governor still limits the total across all scans
+        pending = deque(
+            create_task(get_page(page))
+            for page in islice(pages, max(1, parallel_pages))
+        )
+
+        try:
+            while len(pending) > 0:
+                page_data = await pending.popleft()
+
+                for page in islice(pages, 1):
+                    pending.append(create_task(get_page(page)))
+
+                yield page_data
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def get_all_pages(
+        self, path: str, element: str, params: dict = None
+    ) -> list[dict]:
+        all_data = []
+
+        async for page in self.get_pages(path, element, params):
+            all_data += page
+
+        return all_data
+
+    async def get_all_applications(self) -> list[dict]:
+        return await self.get_all_pages(
+            "appsec/v1/applications", "applications", {"size": APPLICATIONS_PAGE_SIZE}
+        )
+
+    async def get_applications_by_name(self, application_name: str) -> list[dict]:
+        # Encoded the same way as veracode_api_py
+        return await self.get_all_pages(
+            "appsec/v1/applications",
+            "applications",
+            {"name": quote(application_name)},
+        )
+
+    async def get_sandboxes(self, application_guid: str) -> list[dict]:
+        return await self.get_all_pages(
+            f"appsec/v1/applications/{application_guid}/sandboxes", "sandboxes"
+        )
+
+    def get_findings_params(
+        self, sandbox_guid: str, page_size: int, findings_filter: dict
+    ) -> dict:
+        params = {
+            "scan_type": "STATIC",
+            "include_annot": "TRUE",
+            "size": page_size,
+        }
+
+        if sandbox_guid is not None:
+            params["context"] = sandbox_guid
+
+        if findings_filter is not None:
+            params.update(findings_filter)
+
+        return params
+
+    def get_findings_pages(
+        self,
+        application_guid: str,
+        sandbox_guid: str = None,
+        page_size: int = 500,
+        findings_filter: dict = None,
+        parallel_pages: int = 1,
+    ) -> AsyncIterator[list[dict]]:
+        return self.get_pages(
+            f"appsec/v2/applications/{application_guid}/findings",
+            "findings",
+            self.get_findings_params(sandbox_guid, page_size, findings_filter),
+            parallel_pages,
+        )
+
+    async def get_findings_page_content(
+        self,
+        application_guid: str,
+        sandbox_guid: str = None,
+        page: int = 0,
+        page_size: int = 500,
+        findings_filter: dict = None,
+    ) -> bytes:
+        return await self.request(
+            "GET",
+            f"appsec/v2/applications/{application_guid}/findings",
+            {
+                **self.get_findings_params(sandbox_guid, page_size, findings_filter),
+                "page": page,
+            },
+            decode=False,
+        )
+
+    async def add_mitigations(
+        self,
+        application_guid: str,
+        flaw_ids: list[int],
+        action: str,
+        comment: str,
+        sandbox_guid: str = None,
+    ):
+        await self.request(
+            "POST",
+            f"appsec/v2/applications/{application_guid}/annotations",
+            None if sandbox_guid is None else {"context": sandbox_guid},
+            {
+                "comment": comment,
+                "action": action,
+                "issue_list": ",".join(str(flaw_id) for flaw_id in flaw_ids),
+            },
+        )
+
+
+def run_with_async_api(
+    console: Console,
+    max_concurrent_requests: int,
+    function,
+    retry_policy: RetryPolicy = None,
+    pool_size: int = None,
+    connection_stats: ConnectionStats = None,
+    metrics: Metrics = None,
+):
+    async def run_function():
+        async with AsyncAPI(
+            console,
+            max_concurrent_requests,
+            retry_policy,
+            pool_size,
+            connection_stats,
+            metrics=metrics,
+        ) as api:
+            return await function(api)
+
+    return run(run_function())
@@ -0,0 +1,111 @@
+from asyncio import create_task, sleep, wait_for
+from os import environ
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import patch
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from rich.console import Console
+
+from utils.api import APIRequestError
+from utils.async_api import AsyncAPI, AsyncConcurrencyGovernor
+from utils.retry import RetryPolicy
+
+
+class AsyncConcurrencyGovernorTest(IsolatedAsyncioTestCase):
+    async def test_waiters_are_let_through_in_order(self):
+        governor = AsyncConcurrencyGovernor(2)
+        started = []
+        in_flight = 0
+        peak_in_flight = 0
+
+        async def request(index: int):
+            nonlocal in_flight, peak_in_flight
+
+            await governor.acquire()
+            started.append(index)
+            in_flight += 1
+            peak_in_flight = max(peak_in_flight, in_flight)
+            await sleep(0.001)
+            in_flight -= 1
+            governor.release()
+
+        tasks = [create_task(request(index)) for index in range(20)]
+
+        for task in tasks:
+            await task
+
+        self.assertEqual(started, list(range(20)))
+        self.assertEqual(peak_in_flight, 2)
+
+    async def test_waiters_are_woken_when_a_pause_ends(self):
+        governor = AsyncConcurrencyGovernor(2)
+        await governor.acquire()
+        governor.release(False, True, 0.05)
+
+        # Nothing is released during the pause to wake the waiter
+        await wait_for(governor.acquire(), 1)
+
+        self.assertEqual(governor.get_limit(), 1)
+
+    async def test_cancelled_waiter_is_skipped(self):
+        governor = AsyncConcurrencyGovernor(1)
+        await governor.acquire()
+
+        waiter = create_task(governor.acquire())
+        await sleep(0)
+        waiter.cancel()
+        governor.release()
+
+        await wait_for(governor.acquire(), 1)
+
+    async def test_waiter_cancelled_after_being_let_through_gives_back_its_slot(self):
+        governor = AsyncConcurrencyGovernor(1)
+        await governor.acquire()
+
+        waiter = create_task(governor.acquire())
+        await sleep(0)
+        governor.release()
+        waiter.cancel()
+        await sleep(0)
+
+        self.assertTrue(waiter.cancelled())
+        await wait_for(governor.acquire(), 1)
+
+
+# Any well formed credentials will do, the server does not check the signatures
+@patch.dict(
+    environ, {"VERACODE_API_KEY_ID": "0" * 32, "VERACODE_API_KEY_SECRET": "0" * 128}
+)
+@patch("utils.retry.get_back_off_seconds", return_value=0)
+class AsyncAPIRequestTest(IsolatedAsyncioTestCase):
+    async def request(self, *statuses: int):
+        self.requests = 0
+
+        async def handle(_):
+            status = statuses[min(self.requests, len(statuses) - 1)]
+            self.requests += 1
+            return web.json_response({"status": status}, status=status)
+
+        application = web.Application()
+        application.router.add_get("/items", handle)
+
+        async with TestServer(application) as server:
+            async with AsyncAPI(
+                Console(quiet=True),
+                1,
+                RetryPolicy(Console(quiet=True), 100),
+                base_url=str(server.make_url("/")),
+            ) as api:
+                return await api.request("GET", "items")
+
+    async def test_server_error_is_retried(self, _):
+        self.assertEqual(await self.request(500, 200), {"status": 200})
+        self.assertEqual(self.requests, 2)
+
+    async def test_client_error_is_not_retried(self, _):
+        with self.assertRaises(APIRequestError) as context:
+            await self.request(404, 200)
+
+        self.assertEqual(context.exception.status_code, 404)
+        self.assertEqual(self.requests, 1)
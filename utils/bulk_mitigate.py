@@ -1,44 +1,500 @@
+from collections import deque
+from collections.abc import Iterator
+from heapq import heappop, heappush
+from itertools import count
+from threading import BoundedSemaphore, Condition, Thread
+from time import monotonic
+
 from utils.api import API
-from utils.processor import MitigationToAdd
-from utils.parallel import parallel_execute_tasks_with_progress
+from utils.async_api import AsyncAPI
+from utils.bulk_mitigations_file import ACTION_ORDER
+from utils.journal import Journal
+from utils.metrics import current_attempt, current_phase
+from utils.processor import (
+    MitigationToAdd,
+    is_action_already_applied,
+    sort_and_filter_mitigations,
+)
+from utils.parallel import (
+    async_iterate_tasks_with_progress,
+    iterate_tasks_with_progress,
+    log_task_failure,
+)
+from utils.retry import is_waiting_for_circuit
 from rich.console import Console
 
+# Scanning pauses while this many applications per apply thread are waiting to be applied
+STREAM_PENDING_APPLICATIONS_PER_THREAD = 4
+
+
+class MitigationBatch:
+    def __init__(
+        self,
+        application_name: str,
+        application_guid: str,
+        sandbox_guid: str,
+        action: str,
+        comment: str,
+    ):
+        self.application_name = application_name
+        self.application_guid = application_guid
+        self.sandbox_guid = sandbox_guid
+        self.action = action
+        self.comment = comment
+        self.flaw_ids: list[int] = []
+
+    def to_json(self) -> dict:
+        return {
+            "application_name": self.application_name,
+            "application_guid": self.application_guid,
+            "sandbox_guid": self.sandbox_guid,
+            "action": self.action,
+            "comment": self.comment,
+            "flaw_ids": self.flaw_ids,
+        }
+
+
+def build_mitigation_batches(
+    mitigations_to_add: list[MitigationToAdd],
+    max_batch_size: int,
+    journal: Journal = None,
+) -> list[list[MitigationBatch]]:
+    # One list of batches per action, in the order the actions must be applied
+    batches_by_action: dict[str, dict[tuple, list[MitigationBatch]]] = {
+        action: {} for action in ACTION_ORDER
+    }
+
+    for mitigation in mitigations_to_add:
+        app_info = mitigation.app_info
+
+        for action, comment in mitigation.bulk_mitigation.get_actions().items():
+            # Ignore if the annotation is already present
+            if is_action_already_applied(mitigation, action, comment):
+                continue
+
+            # Applied by an earlier run which was interrupted
+            if journal is not None and journal.is_completed(mitigation, action):
+                continue
+
+            key = (app_info.application_guid, app_info.sandbox_guid, comment)
+            batches = batches_by_action[action].setdefault(key, [])
+
+            if len(batches) < 1 or len(batches[-1].flaw_ids) >= max_batch_size:
+                batches.append(
+                    MitigationBatch(
+                        app_info.application_name,
+                        app_info.application_guid,
+                        app_info.sandbox_guid,
+                        action,
+                        comment,
+                    )
+                )
+
+            batches[-1].flaw_ids.append(mitigation.flaw_number)
+
+    phases = []
+
+    for action in ACTION_ORDER:
+        batches = [
+            batch
+            for grouped_batches in batches_by_action[action].values()
+            for batch in grouped_batches
+        ]
+
+        if len(batches) > 0:
+            phases.append(batches)
+
+    return phases
+
+
+def get_flaw_keys(batch: MitigationBatch) -> set[tuple]:
+    return {
+        (batch.application_guid, batch.sandbox_guid, flaw_id)
+        for flaw_id in batch.flaw_ids
+    }
+
+
+# A flaw whose earlier action failed is not given the later actions, as they would be applied out of order
+def remove_failed_flaws(
+    console: Console, batches: list[MitigationBatch], failed_flaws: set[tuple]
+) -> list[MitigationBatch]:
+    if len(failed_flaws) < 1:
+        return batches
+
+    remaining_batches = []
+    skipped_count = 0
+
+    for batch in batches:
+        flaw_ids = [
+            flaw_id
+            for flaw_id in batch.flaw_ids
+            if (batch.application_guid, batch.sandbox_guid, flaw_id) not in failed_flaws
+        ]
+        skipped_count += len(batch.flaw_ids) - len(flaw_ids)
+        batch.flaw_ids = flaw_ids
+
+        if len(flaw_ids) > 0:
+            remaining_batches.append(batch)
+
+    if skipped_count > 0:
+        skipped_count_pluralised = "" if skipped_count == 1 else "s"
+        console.log(
+            f"Not applying {batches[0].action} to {skipped_count} flaw{skipped_count_pluralised} as an earlier action failed"
+        )
+
+    return remaining_batches
+
+
+def log_mitigation_plan(
+    console: Console,
+    mitigations_to_add: list[MitigationToAdd],
+    phases: list[list[MitigationBatch]],
+):
+    mitigation_count_pluralised = "" if len(mitigations_to_add) == 1 else "s"
+    request_count = sum(len(batches) for batches in phases)
+    request_count_pluralised = "" if request_count == 1 else "s"
+    console.log(
+        f"Mitigating {len(mitigations_to_add)} flaw{mitigation_count_pluralised} using {request_count} request{request_count_pluralised}..."
+    )
+
+
+def log_mitigation_batch(console: Console, batch: MitigationBatch):
+    flaw_count_pluralised = "" if len(batch.flaw_ids) == 1 else "s"
+    console.log(
+        f"Applying {batch.action} to {len(batch.flaw_ids)} flaw{flaw_count_pluralised} in application profile '{batch.application_name}'..."
+    )
+
+
+# Returns what the API returns, so the async engine is given a coroutine to await
+def send_mitigation_batch(api: API | AsyncAPI, batch: MitigationBatch):
+    return api.add_mitigations(
+        batch.application_guid,
+        batch.flaw_ids,
+        batch.action,
+        batch.comment,
+        batch.sandbox_guid,
+    )
+
+
+def record_mitigation_batch(journal: Journal, batch: MitigationBatch):
+    if journal is not None:
+        journal.record(
+            batch.application_guid,
+            batch.sandbox_guid,
+            batch.action,
+            batch.flaw_ids,
+        )
+
+
+# The batches to apply one action at a time, the engines only differ in how each batch is sent
+class MitigationPhases:
+    def __init__(
+        self,
+        console: Console,
+        mitigations_to_add: list[MitigationToAdd],
+        max_batch_size: int = 100,
+        journal: Journal = None,
+    ):
+        self.console = console
+        self.phases = build_mitigation_batches(
+            mitigations_to_add, max(1, max_batch_size), journal
+        )
+        self.failed_flaws = set()
+        log_mitigation_plan(console, mitigations_to_add, self.phases)
+
+    def __iter__(self) -> Iterator[list[MitigationBatch]]:
+        # Every batch for an action must land before any batch of the next action
+        for batches in self.phases:
+            batches = remove_failed_flaws(self.console, batches, self.failed_flaws)
+
+            if len(batches) > 0:
+                yield batches
+
+    def get_description(self, batches: list[MitigationBatch]) -> str:
+        batch_count_pluralised = "" if len(batches) == 1 else "es"
+        return f"Applying {len(batches)} {batches[0].action} batch{batch_count_pluralised}..."
+
+    def add_failure(self, batch: MitigationBatch) -> None:
+        self.failed_flaws |= get_flaw_keys(batch)
+
 
 def bulk_mitigate(
     console: Console,
     api: API,
     mitigations_to_add: list[MitigationToAdd],
     number_of_threads: int,
+    max_batch_size: int = 100,
+    journal: Journal = None,
 ):
-    def perform_mitigation(mitigation: MitigationToAdd):
-        console.log(
-            f"Mitigating flaw #{mitigation.flaw_number} in application profile '{mitigation.app_info.application_name}'..."
+    def perform_mitigation(batch: MitigationBatch):
+        log_mitigation_batch(console, batch)
+        send_mitigation_batch(api, batch)
+        record_mitigation_batch(journal, batch)
+
+    phases = MitigationPhases(console, mitigations_to_add, max_batch_size, journal)
+
+    for batches in phases:
+        for task_result in iterate_tasks_with_progress(
+            console,
+            phases.get_description(batches),
+            perform_mitigation,
+            batches,
+            number_of_threads,
+            api.get_concurrency_status,
+            api.retry_policy,
+            api.get_phase_metrics("applying_mitigations"),
+        ):
+            if task_result.error is not None:
+                phases.add_failure(task_result.task)
+
+
+async def async_bulk_mitigate(
+    console: Console,
+    api: AsyncAPI,
+    mitigations_to_add: list[MitigationToAdd],
+    max_batch_size: int = 100,
+    journal: Journal = None,
+):
+    async def perform_mitigation(batch: MitigationBatch):
+        log_mitigation_batch(console, batch)
+        await send_mitigation_batch(api, batch)
+        record_mitigation_batch(journal, batch)
+
+    phases = MitigationPhases(console, mitigations_to_add, max_batch_size, journal)
+
+    for batches in phases:
+        async for task_result in async_iterate_tasks_with_progress(
+            console,
+            phases.get_description(batches),
+            perform_mitigation,
+            batches,
+            api.max_concurrent_requests,
+            api.get_concurrency_status,
+            api.retry_policy,
+            api.get_phase_metrics("applying_mitigations"),
+        ):
+            if task_result.error is not None:
+                phases.add_failure(task_result.task)
+
+
+class StreamedApplication:
+    def __init__(self, phases: list[list[MitigationBatch]]):
+        self.phases = phases
+        self.phase_index = 0
+        self.remaining_batch_count = len(phases[0])
+        self.failed_flaws: set[tuple] = set()
+
+
+# Applies the mitigations of each application as soon as all of its scans are processed, while other scans continue
+class MitigationStream:
+    def __init__(
+        self,
+        console: Console,
+        api: API,
+        number_of_threads: int,
+        max_batch_size: int = 100,
+    ):
+        self.console = console
+        self.api = api
+        self.max_batch_size = max(1, max_batch_size)
+        self.mitigation_count = 0
+        self.request_count = 0
+        # Batches ready to apply as (attempt, application, batch)
+        self._ready: deque[tuple] = deque()
+        # Batches waiting to be retried as (ready at, sequence, attempt, application, batch, is parked)
+        self._delayed: list[tuple] = []
+        self._sequence = count()
+        # Batches waiting for an open circuit to close
+        self._parked_count = 0
+        # Batches queued, waiting or being applied
+        self._outstanding_count = 0
+        self._is_finishing = False
+        self._pending_applications = BoundedSemaphore(
+            number_of_threads * STREAM_PENDING_APPLICATIONS_PER_THREAD
         )
-        for action, comment in mitigation.bulk_mitigation.get_actions().items():
-            if len(mitigation.annotations) > 0:
-                last_annotation = mitigation.annotations[0]
-
-                # Ignore if the annotation is already present
-                if (
-                    action == last_annotation["action"]
-                    and comment.strip() == last_annotation["comment"].strip()
-                ):
+        self._condition = Condition()
+        self._threads = [
+            Thread(target=self._apply_batches, daemon=True)
+            for _ in range(number_of_threads)
+        ]
+
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, matched: list[MitigationToAdd]) -> None:
+        # Every scan of the application is complete, so no later scan can supersede these flaws
+        mitigations = sort_and_filter_mitigations(self.console, matched)
+        phases = build_mitigation_batches(mitigations, self.max_batch_size)
+
+        if len(phases) < 1:
+            return
+
+        self._pending_applications.acquire()
+        application = StreamedApplication(phases)
+
+        with self._condition:
+            self.mitigation_count += len(mitigations)
+            self.request_count += sum(len(batches) for batches in phases)
+            self._queue(application, phases[0])
+
+    def finish(self) -> None:
+        with self._condition:
+            # The batches of each later action are queued as the earlier ones finish
+            self._condition.wait_for(lambda: self._outstanding_count < 1)
+            self._is_finishing = True
+            self._condition.notify_all()
+
+        for thread in self._threads:
+            thread.join()
+
+        if self.mitigation_count < 1:
+            self.console.log("There are no mitigations to apply.")
+            return
+
+        mitigation_count_pluralised = "" if self.mitigation_count == 1 else "s"
+        request_count_pluralised = "" if self.request_count == 1 else "s"
+        self.console.log(
+            f"Mitigated {self.mitigation_count} flaw{mitigation_count_pluralised} using {self.request_count} request{request_count_pluralised}"
+        )
+
+    # Must be called holding the condition
+    def _queue(
+        self, application: StreamedApplication, batches: list[MitigationBatch]
+    ) -> None:
+        self._ready.extend((1, application, batch) for batch in batches)
+        self._outstanding_count += len(batches)
+        self._condition.notify_all()
+
+    def _get_next_batch(self) -> tuple:
+        with self._condition:
+            while True:
+                if len(self._delayed) > 0 and self._delayed[0][0] <= monotonic():
+                    _, _, attempt, application, batch, is_parked = heappop(
+                        self._delayed
+                    )
+
+                    if is_parked:
+                        self._parked_count -= 1
+
+                    return attempt, application, batch
+
+                # No new batches are started while others wait for a circuit, as they would only be parked as well
+                if self._parked_count < 1 and len(self._ready) > 0:
+                    return self._ready.popleft()
+
+                if self._is_finishing:
+                    return None
+
+                self._condition.wait(
+                    None
+                    if len(self._delayed) < 1
+                    else max(0, self._delayed[0][0] - monotonic())
+                )
+
+    def _apply_batches(self) -> None:
+        # Counted apart from the scans being processed at the same time
+        current_phase.set("applying_mitigations")
+
+        while True:
+            item = self._get_next_batch()
+
+            if item is None:
+                return
+
+            attempt, application, batch = item
+            current_attempt.set(attempt)
+            failed = False
+
+            try:
+                self._apply_batch(batch)
+            except Exception as err:
+                if self._delay_batch(err, attempt, application, batch):
                     continue
 
-            api.add_mitigation(
-                mitigation.app_info.application_guid,
-                mitigation.flaw_number,
-                action,
-                comment,
-                mitigation.app_info.sandbox_guid,
+                failed = True
+                log_task_failure(self.console, err)
+                self.api.retry_policy.record_failure("Applying mitigations", batch, err)
+
+            self._finish_batch(application, batch, failed)
+
+    def _apply_batch(self, batch: MitigationBatch) -> None:
+        log_mitigation_batch(self.console, batch)
+        send_mitigation_batch(self.api, batch)
+
+    # The worker moves on to other batches while this one waits to be retried
+    def _delay_batch(
+        self,
+        err: Exception,
+        attempt: int,
+        application: StreamedApplication,
+        batch: MitigationBatch,
+    ) -> bool:
+        is_parked = is_waiting_for_circuit(err)
+
+        # Parked without using an attempt or any of the retry budget
+        if is_parked:
+            seconds_to_wait = err.retry_in
+        else:
+            seconds_to_wait = (
+                None
+                if self.api.retry_policy is None
+                else self.api.retry_policy.get_retry_delay(err, attempt)
             )
 
-    mitigation_count_pluralised = "" if len(mitigations_to_add) == 1 else "s"
+            if seconds_to_wait is None:
+                return False
 
-    parallel_execute_tasks_with_progress(
-        console,
-        f"Mitigating {len(mitigations_to_add)} flaw{mitigation_count_pluralised}...",
-        perform_mitigation,
-        mitigations_to_add,
-        number_of_threads,
-    )
+            attempt += 1
+
+        with self._condition:
+            if is_parked:
+                self._parked_count += 1
+
+            heappush(
+                self._delayed,
+                (
+                    monotonic() + seconds_to_wait,
+                    next(self._sequence),
+                    attempt,
+                    application,
+                    batch,
+                    is_parked,
+                ),
+            )
+            self._condition.notify_all()
+
+        return True
+
+    def _finish_batch(
+        self, application: StreamedApplication, batch: MitigationBatch, failed: bool
+    ) -> None:
+        with self._condition:
+            # Finished and the next batches queued together, so finish() cannot return between two actions
+            self._outstanding_count -= 1
+            self._condition.notify_all()
+            application.remaining_batch_count -= 1
+
+            if failed:
+                application.failed_flaws |= get_flaw_keys(batch)
+
+            if application.remaining_batch_count > 0:
+                return
+
+            # Every batch for an action must land before any batch of the next action
+            while True:
+                application.phase_index += 1
+
+                if application.phase_index >= len(application.phases):
+                    self._pending_applications.release()
+                    return
+
+                batches = remove_failed_flaws(
+                    self.console,
+                    application.phases[application.phase_index],
+                    application.failed_flaws,
+                )
+
+                if len(batches) > 0:
+                    application.remaining_batch_count = len(batches)
+                    self._queue(application, batches)
+                    return
@@ -0,0 +1,199 @@
+from datetime import datetime, timezone
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from threading import Lock
+from unittest import TestCase
+from unittest.mock import patch
+
+from rich.console import Console
+
+from benchmarks.synthetic import generate_bulk_mitigations
+from utils.api import APIRequestError
+from utils.bulk_mitigate import (
+    MitigationStream,
+    build_mitigation_batches,
+    bulk_mitigate,
+)
+from utils.journal import Journal
+from utils.list_of_applications import AppSandboxInfo
+from utils.processor import Annotation, MitigationToAdd
+from utils.retry import RetryPolicy
+
+
+# Records the annotation requests, failing those of the given action which include the given flaw
+class RecordingAPI:
+    def __init__(
+        self,
+        console: Console,
+        failing_action: str,
+        failing_flaw: tuple,
+        retry_budget: int = 0,
+        failure_count: int = None,
+    ):
+        self.retry_policy = RetryPolicy(console, retry_budget)
+        self.failing_action = failing_action
+        self.failing_flaw = failing_flaw
+        # Fails every time when not given
+        self.failure_count = failure_count
+        self.requests: list[tuple[str, str, tuple[int, ...]]] = []
+        self._lock = Lock()
+
+    def get_concurrency_status(self) -> str:
+        return ""
+
+    def get_phase_metrics(self, name: str):
+        return None
+
+    def add_mitigations(
+        self,
+        application_guid: str,
+        flaw_ids: list[int],
+        action: str,
+        comment: str,
+        sandbox_guid: str = None,
+    ):
+        with self._lock:
+            if (
+                action == self.failing_action
+                and self.failing_flaw
+                in ((application_guid, flaw_id) for flaw_id in flaw_ids)
+                and self.failure_count != 0
+            ):
+                if self.failure_count is not None:
+                    self.failure_count -= 1
+
+                raise APIRequestError("add_mitigations:", ConnectionError("Reset"))
+
+            self.requests.append((application_guid, action, tuple(flaw_ids)))
+
+
+class BulkMitigateTest(TestCase):
+    def setUp(self):
+        self.console = Console(quiet=True)
+        self.rule = generate_bulk_mitigations(self.console, 1).items[0]
+
+    def create_mitigations(
+        self, application_guid: str, flaw_numbers, latest_annotation: Annotation = None
+    ) -> list[MitigationToAdd]:
+        return [
+            MitigationToAdd(
+                AppSandboxInfo(f"Application {application_guid}", application_guid),
+                self.rule,
+                flaw_number,
+                datetime(2025, 6, 1, tzinfo=timezone.utc),
+                latest_annotation,
+            )
+            for flaw_number in flaw_numbers
+        ]
+
+    def test_batches_are_built_per_action_in_order(self):
+        mitigations = self.create_mitigations("a", range(5)) + self.create_mitigations(
+            "b", range(2)
+        )
+        phases = build_mitigation_batches(mitigations, 2)
+
+        self.assertEqual(
+            [
+                [(batch.action, batch.flaw_ids) for batch in batches]
+                for batches in phases
+            ],
+            [
+                [
+                    ("APPDESIGN", [0, 1]),
+                    ("APPDESIGN", [2, 3]),
+                    ("APPDESIGN", [4]),
+                    ("APPDESIGN", [0, 1]),
+                ],
+                [
+                    ("ACCEPTED", [0, 1]),
+                    ("ACCEPTED", [2, 3]),
+                    ("ACCEPTED", [4]),
+                    ("ACCEPTED", [0, 1]),
+                ],
+            ],
+        )
+
+    def test_applied_actions_are_skipped(self):
+        applied = self.create_mitigations(
+            "a", [1], Annotation("APPDESIGN", self.rule.mitigate_by_design)
+        )
+        journalled = self.create_mitigations("a", [2])
+
+        with TemporaryDirectory() as directory:
+            journal = Journal(self.console, str(Path(directory) / "journal.jsonl"))
+            journal.open(applied + journalled)
+            journal.record("a", None, "APPDESIGN", [2])
+            phases = build_mitigation_batches(applied + journalled, 10, journal)
+            journal.close()
+
+        self.assertEqual(
+            [
+                [(batch.action, batch.flaw_ids) for batch in batches]
+                for batches in phases
+            ],
+            [[("ACCEPTED", [1, 2])]],
+        )
+
+    def test_later_actions_are_skipped_for_failed_flaws(self):
+        api = RecordingAPI(self.console, "APPDESIGN", ("a", 1))
+        mitigations = self.create_mitigations("a", range(4)) + self.create_mitigations(
+            "b", range(2)
+        )
+
+        bulk_mitigate(self.console, api, mitigations, 2, 2)
+
+        self.assertEqual(
+            sorted(api.requests),
+            [
+                ("a", "ACCEPTED", (2, 3)),
+                ("a", "APPDESIGN", (2, 3)),
+                ("b", "ACCEPTED", (0, 1)),
+                ("b", "APPDESIGN", (0, 1)),
+            ],
+        )
+        self.assertEqual(len(api.retry_policy.failures), 1)
+
+    def test_streamed_later_actions_are_skipped_for_failed_flaws(self):
+        api = RecordingAPI(self.console, "APPDESIGN", ("a", 1))
+        stream = MitigationStream(self.console, api, 2, 2)
+        stream.submit(self.create_mitigations("a", range(4)))
+        stream.submit(self.create_mitigations("b", range(2)))
+        stream.finish()
+
+        self.assertEqual(
+            sorted(api.requests),
+            [
+                ("a", "ACCEPTED", (2, 3)),
+                ("a", "APPDESIGN", (2, 3)),
+                ("b", "ACCEPTED", (0, 1)),
+                ("b", "APPDESIGN", (0, 1)),
+            ],
+        )
+        self.assertEqual(len(api.retry_policy.failures), 1)
+
+    def test_stream_skips_an_action_left_with_no_flaws(self):
+        api = RecordingAPI(self.console, "APPDESIGN", ("a", 0))
+        stream = MitigationStream(self.console, api, 1, 10)
+        stream.submit(self.create_mitigations("a", [0]))
+        stream.finish()
+
+        self.assertEqual(api.requests, [])
+
+    @patch("utils.retry.get_back_off_seconds", return_value=0.2)
+    def test_stream_applies_other_batches_while_one_waits_to_be_retried(self, _):
+        api = RecordingAPI(self.console, "APPDESIGN", ("a", 0), 10, 1)
+        stream = MitigationStream(self.console, api, 1, 10)
+        stream.submit(self.create_mitigations("a", [0]))
+        stream.submit(self.create_mitigations("b", [0]))
+        stream.finish()
+
+        self.assertEqual(
+            api.requests,
+            [
+                ("b", "APPDESIGN", (0,)),
+                ("b", "ACCEPTED", (0,)),
+                ("a", "APPDESIGN", (0,)),
+                ("a", "ACCEPTED", (0,)),
+            ],
+        )
+        self.assertEqual(api.retry_policy.failures, [])
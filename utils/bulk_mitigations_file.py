@@ -1,10 +1,14 @@
-from json import load
+from hashlib import sha256
+from json import load, dumps
 from sys import exit
 from typing import IO
 from collections import OrderedDict
 
 from rich.console import Console
 
+# The order in which mitigation actions must be applied to a flaw
+ACTION_ORDER = ["APPDESIGN", "FP", "ACCEPTRISK", "ACCEPTED", "REJECTED"]
+
 
 class BulkMitigation:
     def __init__(self, console: Console, data):
@@ -13,6 +17,9 @@ class BulkMitigation:
             exit(1)
 
         self.friendly_name = data["friendly_name"]
+
+        # Identifies this exact rule definition across runs
+        self.hash = sha256(dumps(data, sort_keys=True).encode("utf-8")).hexdigest()
         self.process_policy = bool(data["process_policy"])
         self.process_sandboxes = bool(data["process_sandboxes"])
 
@@ -92,6 +99,14 @@ class BulkMitigation:
             )
             exit(1)
 
+    def is_in_scope(self, sandbox_name: str) -> bool:
+        if sandbox_name is None:
+            return self.process_policy
+
+        return self.process_sandboxes and (
+            len(self.sandboxes) == 0 or sandbox_name in self.sandboxes
+        )
+
     # There is a specific order in which to apply multiple mitigations
     def get_actions(self) -> OrderedDict[str, str]:
         actions = OrderedDict()
@@ -114,6 +129,82 @@ class BulkMitigation:
         return actions
 
 
+def normalise_file_path(file_path: str) -> str:
+    return file_path.replace("\\", "/")
+
+
+class BulkMitigationIndex:
+    def __init__(self, items: list[BulkMitigation]):
+        # Rules keyed on (cwe, file path, line number, attack vector, module)
+        self._exact: dict[tuple, list[tuple[int, BulkMitigation]]] = {}
+
+        # Rules with a "*" prefixed module keyed on (cwe, file path, line number, attack vector)
+        self._suffix: dict[tuple, list[tuple[int, str, BulkMitigation]]] = {}
+
+        for position, item in enumerate(items):
+            key = (
+                item.cwe,
+                normalise_file_path(item.file_path),
+                item.line_number,
+                item.attack_vector,
+            )
+
+            if item.module.startswith("*"):
+                self._suffix.setdefault(key, []).append(
+                    (position, item.module.replace("*", ""), item)
+                )
+            else:
+                self._exact.setdefault(key + (item.module,), []).append(
+                    (position, item)
+                )
+
+    def get_candidates(self, finding: dict) -> list[BulkMitigation]:
+        details = finding["finding_details"]
+
+        try:
+            key = (
+                int(details["cwe"]["id"]),
+                normalise_file_path(details.get("file_path", "")),
+                int(details.get("file_line_number", -1)),
+                details.get("attack_vector"),
+            )
+        except (KeyError, TypeError, ValueError):
+            return []
+
+        module = details.get("module", "")
+        candidates = self._exact.get(key + (module,), [])
+        suffixed = self._suffix.get(key)
+
+        if suffixed is not None:
+            candidates = sorted(
+                candidates
+                + [
+                    (position, item)
+                    for position, suffix, item in suffixed
+                    if module.endswith(suffix)
+                ],
+                key=lambda candidate: candidate[0],
+            )
+
+        return [item for _, item in candidates]
+
+
+# Query parameters for the findings API which only return findings the given rules could match
+def build_findings_filters(
+    items: list[BulkMitigation], max_cwes_per_request: int
+) -> list[dict]:
+    cwes = sorted({item.cwe for item in items})
+    filters = []
+
+    for start in range(0, len(cwes), max_cwes_per_request):
+        end = start + max_cwes_per_request
+        cwe_group = cwes[start:end]
+        # The status of each finding is still checked by the processor
+        filters.append({"cwe": ",".join(str(cwe) for cwe in cwe_group)})
+
+    return filters
+
+
 class BulkMitigations:
     def __init__(self, console: Console, bulk_mitigations_file: IO[str]):
         self.items: list[BulkMitigation] = []
@@ -127,18 +218,20 @@ class BulkMitigations:
             )
             exit(0)
 
+        self.index = BulkMitigationIndex(self.items)
+
     def get_all_sandbox_names(self):
-        sandbox_names = []
+        # Keys keep the order the names are first seen in
+        sandbox_names = {}
 
         for item in self.items:
             if item.process_sandboxes and len(item.sandboxes) == 0:
                 return "ALL"
 
             for sandbox_name in item.sandboxes:
-                if sandbox_name not in sandbox_names:
-                    sandbox_names.append(sandbox_name)
+                sandbox_names[sandbox_name] = None
 
-        return sandbox_names
+        return list(sandbox_names)
 
     def is_policy_in_scope(self) -> bool:
         for item in self.items:
@@ -0,0 +1,68 @@
+from unittest import TestCase
+
+from rich.console import Console
+
+from benchmarks.synthetic import generate_bulk_mitigations, generate_findings
+from utils.bulk_mitigations_file import build_findings_filters
+from utils.processor import matches_signature
+
+RULE_COUNT = 200
+FINDING_COUNT = 2000
+
+# High enough that most rules, including the "*" module ones, are matched at least once
+MATCH_RATIO = 0.5
+
+
+class BulkMitigationIndexTest(TestCase):
+    def setUp(self):
+        self.bulk_mitigations = generate_bulk_mitigations(
+            Console(quiet=True), RULE_COUNT
+        )
+        self.findings = generate_findings(
+            FINDING_COUNT, RULE_COUNT, match_ratio=MATCH_RATIO
+        )
+
+    def test_same_candidates_as_nested_loop(self):
+        matched_count = 0
+
+        for finding in self.findings:
+            expected = [
+                item
+                for item in self.bulk_mitigations.items
+                if matches_signature(finding, item)
+            ]
+            matched_count += len(expected)
+
+            self.assertEqual(
+                self.bulk_mitigations.index.get_candidates(finding), expected
+            )
+
+        self.assertGreater(matched_count, FINDING_COUNT / 4)
+
+    def test_suffix_module_is_matched(self):
+        finding = generate_findings(1, RULE_COUNT, match_ratio=1)[0]
+        finding["finding_details"]["module"] = "prefix_module_0.dll"
+        rule = self.bulk_mitigations.items[0]
+        details = finding["finding_details"]
+        details["cwe"]["id"] = rule.cwe
+        details["file_path"] = rule.file_path
+        details["attack_vector"] = rule.attack_vector
+        details["file_line_number"] = str(rule.line_number)
+
+        self.assertIn(rule, self.bulk_mitigations.index.get_candidates(finding))
+
+    def test_malformed_finding_has_no_candidates(self):
+        finding = generate_findings(1, RULE_COUNT, match_ratio=1)[0]
+        finding["finding_details"]["file_line_number"] = "not a number"
+
+        self.assertEqual(self.bulk_mitigations.index.get_candidates(finding), [])
+
+
+class BuildFindingsFiltersTest(TestCase):
+    def test_cwes_are_grouped(self):
+        items = generate_bulk_mitigations(Console(quiet=True), 30).items
+        filters = build_findings_filters(items, 10)
+        cwes = [int(cwe) for f in filters for cwe in f["cwe"].split(",")]
+
+        self.assertEqual(len(filters), 3)
+        self.assertEqual(cwes, sorted({item.cwe for item in items}))
@@ -0,0 +1,94 @@
+from threading import Lock
+
+from aiohttp import TraceConfig
+from requests import Session
+from requests.adapters import HTTPAdapter
+from rich.console import Console
+from veracode_api_signing.plugin_requests import RequestsAuthPluginVeracodeHMAC
+
+
+# Requests made by the async engine are counted as they happen, sessions used by threads are read from their pools
+class ConnectionStats:
+    def __init__(self):
+        self._request_count = 0
+        self._connection_count = 0
+        self._sessions: list[Session] = []
+        self._lock = Lock()
+
+    def add(self, request_count: int, connection_count: int) -> None:
+        with self._lock:
+            self._request_count += request_count
+            self._connection_count += connection_count
+
+    def track_session(self, session: Session) -> None:
+        with self._lock:
+            self._sessions.append(session)
+
+    def get_counts(self) -> tuple[int, int]:
+        with self._lock:
+            request_count = self._request_count
+            connection_count = self._connection_count
+
+            for session in self._sessions:
+                session_request_count, session_connection_count = get_session_stats(
+                    session
+                )
+                request_count += session_request_count
+                connection_count += session_connection_count
+
+        return request_count, connection_count
+
+    def log(self, console: Console) -> None:
+        request_count, connection_count = self.get_counts()
+
+        if request_count < 1:
+            return
+
+        reused_count = max(0, request_count - connection_count)
+        request_count_pluralised = "" if request_count == 1 else "s"
+        connection_count_pluralised = "" if connection_count == 1 else "s"
+        console.log(
+            f"Made {request_count} API request{request_count_pluralised} using {connection_count} connection{connection_count_pluralised} ({reused_count / request_count:.0%} reused)"
+        )
+
+
+def create_session(pool_size: int) -> Session:
+    # One keep-alive session shared by all threads, large enough that no thread waits for a connection
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+    session = Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.auth = RequestsAuthPluginVeracodeHMAC()
+    session.headers["User-Agent"] = "veracode_bulk_mitigator"
+    return session
+
+
+def get_session_stats(session: Session) -> tuple[int, int]:
+    request_count = 0
+    connection_count = 0
+
+    # The same adapter is mounted for more than one prefix
+    for adapter in set(session.adapters.values()):
+        pools = adapter.poolmanager.pools
+
+        for key in pools.keys():
+            pool = pools.get(key)
+
+            if pool is not None:
+                request_count += pool.num_requests
+                connection_count += pool.num_connections
+
+    return request_count, connection_count
+
+
+def create_trace_config(stats: ConnectionStats) -> TraceConfig:
+    async def on_request_end(session, context, params):
+        stats.add(1, 0)
+
+    async def on_connection_create_end(session, context, params):
+        stats.add(0, 1)
+
+    trace_config = TraceConfig()
+    trace_config.on_request_end.append(on_request_end)
+    trace_config.on_connection_create_end.append(on_connection_create_end)
+    return trace_config
@@ -0,0 +1,99 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os import environ
+from threading import Thread
+from unittest import IsolatedAsyncioTestCase, TestCase
+from unittest.mock import patch
+
+from aiohttp import ClientSession, web
+from aiohttp.test_utils import TestServer
+from rich.console import Console
+
+from utils.connection_pool import ConnectionStats, create_session, create_trace_config
+
+REQUEST_COUNT = 3
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    def log_message(self, *args):
+        pass
+
+
+class ConnectionStatsTest(TestCase):
+    def test_counts_are_added(self):
+        stats = ConnectionStats()
+        stats.add(2, 0)
+        stats.add(1, 1)
+
+        self.assertEqual(stats.get_counts(), (3, 1))
+
+    def test_reuse_is_logged(self):
+        stats = ConnectionStats()
+        stats.add(4, 1)
+        console = Console(record=True, width=200)
+
+        stats.log(console)
+
+        self.assertIn(
+            "Made 4 API requests using 1 connection (75% reused)",
+            console.export_text(),
+        )
+
+    def test_nothing_is_logged_without_requests(self):
+        console = Console(record=True, width=200)
+
+        ConnectionStats().log(console)
+
+        self.assertEqual(console.export_text(), "")
+
+    # Any well formed credentials will do, the server does not check the signatures
+    @patch.dict(
+        environ,
+        {"VERACODE_API_KEY_ID": "0" * 32, "VERACODE_API_KEY_SECRET": "0" * 128},
+    )
+    def test_tracked_session_is_read_from_its_pool(self):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+        Thread(target=server.serve_forever, daemon=True).start()
+        stats = ConnectionStats()
+        session = create_session(1)
+        stats.track_session(session)
+
+        try:
+            for _ in range(REQUEST_COUNT):
+                session.get(
+                    f"http://127.0.0.1:{server.server_port}/"
+                ).raise_for_status()
+
+            # Closing the session empties its pools
+            self.assertEqual(stats.get_counts(), (REQUEST_COUNT, 1))
+        finally:
+            session.close()
+            server.shutdown()
+            server.server_close()
+
+
+class TraceConfigTest(IsolatedAsyncioTestCase):
+    async def test_requests_and_connections_are_counted(self):
+        async def handle(_):
+            return web.json_response({})
+
+        application = web.Application()
+        application.router.add_get("/", handle)
+        stats = ConnectionStats()
+
+        async with TestServer(application) as server:
+            async with ClientSession(
+                trace_configs=[create_trace_config(stats)]
+            ) as session:
+                for _ in range(REQUEST_COUNT):
+                    async with session.get(server.make_url("/")) as response:
+                        await response.read()
+
+        self.assertEqual(stats.get_counts(), (REQUEST_COUNT, 1))
@@ -0,0 +1,101 @@
+from json import load, dump
+from pathlib import Path
+from threading import Lock
+
+from rich.console import Console
+
+from utils.list_of_applications import AppSandboxInfo
+from utils.planner import ScanPlan
+
+
+class IncrementalState:
+    def __init__(self, console: Console, file_path: str):
+        self._console = console
+        self._path = Path(file_path)
+        self._entries: dict[str, dict] = {}
+        self._processed: dict[str, dict] = {}
+        self._lock = Lock()
+        self.load()
+
+    def load(self):
+        if not self._path.exists():
+            return
+
+        with self._path.open("r", encoding="utf-8") as state_file:
+            self._entries = load(state_file)
+
+    @staticmethod
+    def _key(app_info: AppSandboxInfo) -> str:
+        return f"{app_info.application_guid}:{app_info.sandbox_guid or ''}"
+
+    def is_unchanged(self, scan_plan: ScanPlan) -> bool:
+        app_info = scan_plan.app_info
+
+        # Without a scan date there is no way to know if there is a new scan
+        if app_info.last_scan_date is None:
+            return False
+
+        entry = self._entries.get(self._key(app_info))
+
+        # Rules added or changed for other scans do not matter
+        return (
+            entry is not None
+            and entry["last_scan_date"] == app_info.last_scan_date
+            and scan_plan.rule_set.rule_hashes.issubset(entry["rule_hashes"])
+        )
+
+    def filter_unchanged(self, scan_plans: list[ScanPlan]) -> list[ScanPlan]:
+        changed = [
+            scan_plan for scan_plan in scan_plans if not self.is_unchanged(scan_plan)
+        ]
+        skipped_count = len(scan_plans) - len(changed)
+
+        if skipped_count > 0:
+            scan_count_pluralised = "" if skipped_count == 1 else "s"
+            self._console.log(
+                f"Skipping {skipped_count} scan{scan_count_pluralised} with no new results since the last run"
+            )
+
+        return changed
+
+    def mark_processed(self, scan_plan: ScanPlan) -> None:
+        app_info = scan_plan.app_info
+
+        if app_info.last_scan_date is None:
+            return
+
+        key = self._key(app_info)
+
+        with self._lock:
+            rule_hashes = set(scan_plan.rule_set.rule_hashes)
+            entry = self._entries.get(key)
+
+            # Rules evaluated against the same scan previously still count
+            if entry is not None and entry["last_scan_date"] == app_info.last_scan_date:
+                rule_hashes.update(entry["rule_hashes"])
+
+            self._processed[key] = {
+                "last_scan_date": app_info.last_scan_date,
+                "rule_hashes": sorted(rule_hashes),
+            }
+
+    def discard(self, application_guid: str, sandbox_guid: str) -> None:
+        # The scan must be processed again if applying its mitigations failed
+        with self._lock:
+            self._processed.pop(f"{application_guid}:{sandbox_guid or ''}", None)
+
+    def save(self) -> None:
+        with self._lock:
+            if len(self._processed) < 1:
+                return
+
+            self._entries.update(self._processed)
+            self._processed = {}
+
+            # Write to a temporary file first so an interrupted save does not lose the state
+            temporary_path = self._path.with_name(self._path.name + ".tmp")
+
+            with temporary_path.open("w", encoding="utf-8") as state_file:
+                dump(self._entries, state_file)
+
+            temporary_path.replace(self._path)
@@ -0,0 +1,141 @@
+from io import StringIO
+from json import dumps
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from rich.console import Console
+
+from benchmarks.synthetic import generate_rule_data
+from utils.bulk_mitigations_file import BulkMitigations
+from utils.incremental import IncrementalState
+from utils.list_of_applications import AppSandboxInfo
+from utils.planner import ScanPlan, plan_scans
+
+SCAN_DATE = "2025-06-01T10:00:00.000Z"
+
+
+# A rule for policy scans only, one for every sandbox and one for a sandbox which is not processed
+def create_rule_data() -> list[dict]:
+    rules = [generate_rule_data(index) for index in range(3)]
+    rules[0]["process_sandboxes"] = False
+    rules[2]["process_policy"] = False
+    rules[2]["sandboxes"] = ["Other"]
+    return rules
+
+
+def create_scans(last_scan_date: str = SCAN_DATE) -> list[AppSandboxInfo]:
+    return [
+        AppSandboxInfo("Application", "a", None, None, last_scan_date),
+        AppSandboxInfo("Application", "a", "Sandbox", "s", last_scan_date),
+    ]
+
+
+class IncrementalStateTest(TestCase):
+    def setUp(self):
+        self.console = Console(quiet=True)
+        self.directory = TemporaryDirectory()
+        self.file_path = str(Path(self.directory.name) / "state.json")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def plan_scans(self, rule_data: list[dict], scans: list[AppSandboxInfo]):
+        rules = StringIO(dumps(rule_data))
+        rules.name = "rules"
+        return plan_scans(self.console, BulkMitigations(self.console, rules), scans, 10)
+
+    def process(self, scan_plans: list[ScanPlan]) -> None:
+        state = IncrementalState(self.console, self.file_path)
+
+        for scan_plan in scan_plans:
+            state.mark_processed(scan_plan)
+
+        state.save()
+
+    def get_changed_sandboxes(self, scan_plans: list[ScanPlan]) -> list[str]:
+        state = IncrementalState(self.console, self.file_path)
+
+        return [
+            scan_plan.app_info.sandbox_name
+            for scan_plan in state.filter_unchanged(scan_plans)
+        ]
+
+    def test_unchanged_scans_are_skipped(self):
+        self.process(self.plan_scans(create_rule_data(), create_scans()))
+
+        self.assertEqual(
+            self.get_changed_sandboxes(
+                self.plan_scans(create_rule_data(), create_scans())
+            ),
+            [],
+        )
+
+    def test_new_scans_are_processed(self):
+        self.process(self.plan_scans(create_rule_data(), create_scans()))
+
+        self.assertEqual(
+            self.get_changed_sandboxes(
+                self.plan_scans(
+                    create_rule_data(), create_scans("2025-06-02T10:00:00.000Z")
+                )
+            ),
+            [None, "Sandbox"],
+        )
+
+    def test_changed_rule_only_invalidates_the_scans_it_is_in_scope_for(self):
+        self.process(self.plan_scans(create_rule_data(), create_scans()))
+
+        rule_data = create_rule_data()
+        rule_data[0]["mitigate_by_design"] = "A changed comment"
+
+        self.assertEqual(
+            self.get_changed_sandboxes(self.plan_scans(rule_data, create_scans())),
+            [None],
+        )
+
+    def test_rules_for_other_sandboxes_are_ignored(self):
+        self.process(self.plan_scans(create_rule_data(), create_scans()))
+
+        rule_data = create_rule_data()
+        rule_data[2]["mitigate_by_design"] = "A changed comment"
+        rule_data.append(
+            {**generate_rule_data(3), "process_policy": False, "sandboxes": ["Other"]}
+        )
+
+        self.assertEqual(
+            self.get_changed_sandboxes(self.plan_scans(rule_data, create_scans())),
+            [],
+        )
+
+    def test_removed_rules_do_not_invalidate_scans(self):
+        self.process(self.plan_scans(create_rule_data(), create_scans()))
+
+        self.assertEqual(
+            self.get_changed_sandboxes(
+                self.plan_scans(create_rule_data()[1:], create_scans())
+            ),
+            [],
+        )
+
+    def test_scans_without_a_date_are_always_processed(self):
+        scan_plans = self.plan_scans(create_rule_data(), create_scans(None))
+        self.process(scan_plans)
+
+        self.assertFalse(Path(self.file_path).exists())
+        self.assertEqual(
+            self.get_changed_sandboxes(scan_plans),
+            [None, "Sandbox"],
+        )
+
+    def test_discarded_scans_are_processed_again(self):
+        scan_plans = self.plan_scans(create_rule_data(), create_scans())
+        state = IncrementalState(self.console, self.file_path)
+
+        for scan_plan in scan_plans:
+            state.mark_processed(scan_plan)
+
+        state.discard("a", "s")
+        state.save()
+
+        self.assertEqual(self.get_changed_sandboxes(scan_plans), ["Sandbox"])
@@ -0,0 +1,234 @@
+from json import JSONDecodeError, dumps, loads
+from os import fsync
+from pathlib import Path
+from sys import exit
+from threading import Lock
+from time import monotonic
+
+from rich.console import Console
+
+from utils.bulk_mitigations_file import BulkMitigations
+from utils.plan_file import mitigation_to_json, mitigations_from_json
+from utils.processor import MitigationToAdd, is_action_already_applied
+
+# Completed writes are flushed to disk after this many records or seconds, whichever comes first
+JOURNAL_SYNC_BATCH_SIZE = 50
+JOURNAL_SYNC_SECONDS = 1.0
+
+
+def format_record(record: dict) -> str:
+    return dumps(record, separators=(",", ":")) + "\n"
+
+
+# An append-only record of the mitigations being applied and the annotation requests which have succeeded.
+# The first line holds the mitigations to apply, every following line one completed request.
+class Journal:
+    def __init__(self, console: Console, file_path: str):
+        self._console = console
+        self._path = Path(file_path)
+        self._file = None
+        self._unsynced_count = 0
+        self._last_sync = monotonic()
+        self._lock = Lock()
+        self.mitigations: list[MitigationToAdd] = []
+        self._completed: set[tuple[str, str, int, str]] = set()
+        self._resumed_length = None
+
+    def exists(self) -> bool:
+        return self._path.exists()
+
+    def replay(self, bulk_mitigations: BulkMitigations) -> None:
+        content = self._path.read_bytes()
+        valid_length = 0
+        plan_items = None
+
+        for line in content.splitlines(keepends=True):
+            # A crash can leave the last line partly written
+            try:
+                record = loads(line)
+            except JSONDecodeError:
+                break
+
+            if not line.endswith(b"\n"):
+                break
+
+            valid_length += len(line)
+
+            if record["type"] == "plan":
+                plan_items = record["mitigations"]
+            elif record["type"] == "done":
+                for flaw_id in record["flaw_ids"]:
+                    self._completed.add(
+                        (
+                            record["application_guid"],
+                            record["sandbox_guid"],
+                            flaw_id,
+                            record["action"],
+                        )
+                    )
+
+        if plan_items is None:
+            self._console.log(
+                f'Error: "{self._path}" does not contain any mitigations to resume.'
+            )
+            exit(1)
+
+        self.mitigations = mitigations_from_json(
+            self._console, str(self._path), plan_items, bulk_mitigations
+        )
+
+        self._resumed_length = valid_length
+
+        completed_count = len(self._completed)
+        action_count_pluralised = "" if completed_count == 1 else "s"
+        self._console.log(
+            f'Resuming from "{self._path}", {completed_count} flaw action{action_count_pluralised} already applied'
+        )
+
+    def open(self, mitigations: list[MitigationToAdd]) -> None:
+        if self._resumed_length is not None:
+            # Drop a partly written line so new records start on a line of their own
+            self._file = self._path.open("r+", encoding="utf-8")
+            self._file.truncate(self._resumed_length)
+            self._file.seek(self._resumed_length)
+            return
+
+        self.mitigations = mitigations
+        self._file = self._path.open("w", encoding="utf-8")
+        self._write(
+            {
+                "type": "plan",
+                "mitigations": [
+                    mitigation_to_json(mitigation) for mitigation in mitigations
+                ],
+            }
+        )
+        self._sync()
+
+    def is_completed(self, mitigation: MitigationToAdd, action: str) -> bool:
+        return (
+            mitigation.app_info.application_guid,
+            mitigation.app_info.sandbox_guid,
+            mitigation.flaw_number,
+            action,
+        ) in self._completed
+
+    def record(
+        self,
+        application_guid: str,
+        sandbox_guid: str,
+        action: str,
+        flaw_ids: list[int],
+    ) -> None:
+        with self._lock:
+            # Requests still in flight when the journal is closed are applied again on resume
+            if self._file is None:
+                return
+
+            self._write(
+                {
+                    "type": "done",
+                    "application_guid": application_guid,
+                    "sandbox_guid": sandbox_guid,
+                    "action": action,
+                    "flaw_ids": flaw_ids,
+                }
+            )
+
+            for flaw_id in flaw_ids:
+                self._completed.add((application_guid, sandbox_guid, flaw_id, action))
+
+            self._unsynced_count += 1
+
+            if (
+                self._unsynced_count >= JOURNAL_SYNC_BATCH_SIZE
+                or monotonic() - self._last_sync >= JOURNAL_SYNC_SECONDS
+            ):
+                self._sync()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is None:
+                return
+
+            self._sync()
+            self._file.close()
+            self._file = None
+
+    def compact(self) -> None:
+        self.close()
+
+        # Actions skipped because the flaw already had the annotation count as done
+        remaining = [
+            mitigation
+            for mitigation in self.mitigations
+            if any(
+                not self.is_completed(mitigation, action)
+                and not is_action_already_applied(mitigation, action, comment)
+                for action, comment in mitigation.bulk_mitigation.get_actions().items()
+            )
+        ]
+
+        if len(remaining) < 1:
+            self._path.unlink(missing_ok=True)
+            return
+
+        # Actions already applied to a remaining mitigation, e.g. the first of two, are kept
+        completed_flaw_ids: dict[tuple[str, str, str], list[int]] = {}
+
+        for mitigation in remaining:
+            app_info = mitigation.app_info
+
+            for action in mitigation.bulk_mitigation.get_actions().keys():
+                if self.is_completed(mitigation, action):
+                    completed_flaw_ids.setdefault(
+                        (app_info.application_guid, app_info.sandbox_guid, action), []
+                    ).append(mitigation.flaw_number)
+
+        # Only the mitigations which still need an action are kept, replacing the file in one step
+        temporary_path = self._path.with_name(self._path.name + ".tmp")
+
+        with temporary_path.open("w", encoding="utf-8") as journal_file:
+            journal_file.write(
+                format_record(
+                    {
+                        "type": "plan",
+                        "mitigations": [
+                            mitigation_to_json(mitigation) for mitigation in remaining
+                        ],
+                    }
+                )
+            )
+
+            for key, flaw_ids in completed_flaw_ids.items():
+                application_guid, sandbox_guid, action = key
+                journal_file.write(
+                    format_record(
+                        {
+                            "type": "done",
+                            "application_guid": application_guid,
+                            "sandbox_guid": sandbox_guid,
+                            "action": action,
+                            "flaw_ids": flaw_ids,
+                        }
+                    )
+                )
+
+            journal_file.flush()
+            fsync(journal_file.fileno())
+
+        temporary_path.replace(self._path)
+
+        mitigation_count_pluralised = "" if len(remaining) == 1 else "s"
+        self._console.log(
+            f'{len(remaining)} mitigation{mitigation_count_pluralised} still to apply, resume with --resume and --journal-file-path "{self._path}"'
+        )
+
+    def _write(self, record: dict) -> None:
+        self._file.write(format_record(record))
+
+    def _sync(self) -> None:
+        self._file.flush()
+        fsync(self._file.fileno())
+        self._unsynced_count = 0
+        self._last_sync = monotonic()
@@ -0,0 +1,109 @@
+from datetime import datetime, timezone
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from rich.console import Console
+
+from benchmarks.synthetic import generate_bulk_mitigations
+from utils.journal import Journal
+from utils.list_of_applications import AppSandboxInfo
+from utils.processor import Annotation, MitigationToAdd
+
+
+class JournalTest(TestCase):
+    def setUp(self):
+        self.console = Console(quiet=True)
+        self.bulk_mitigations = generate_bulk_mitigations(self.console, 1)
+        self.rule = self.bulk_mitigations.items[0]
+        self.directory = TemporaryDirectory()
+        self.path = Path(self.directory.name) / "journal.jsonl"
+        self.mitigations = [
+            self.create_mitigation(flaw_number) for flaw_number in (1, 2, 3)
+        ]
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def create_mitigation(
+        self, flaw_number: int, latest_annotation: Annotation = None
+    ) -> MitigationToAdd:
+        return MitigationToAdd(
+            AppSandboxInfo("Application", "a"),
+            self.rule,
+            flaw_number,
+            datetime(2025, 6, 1, tzinfo=timezone.utc),
+            latest_annotation,
+        )
+
+    def replay(self) -> Journal:
+        journal = Journal(self.console, str(self.path))
+        journal.replay(self.bulk_mitigations)
+        return journal
+
+    def test_replay_after_crash(self):
+        journal = Journal(self.console, str(self.path))
+        journal.open(self.mitigations)
+        journal.record("a", None, "APPDESIGN", [1, 2])
+        journal.close()
+
+        # A record cut off part way through
+        with self.path.open("a", encoding="utf-8") as journal_file:
+            journal_file.write('{"type":"done","application_guid":"a"')
+
+        journal = self.replay()
+
+        self.assertEqual(
+            [mitigation.flaw_number for mitigation in journal.mitigations], [1, 2, 3]
+        )
+        self.assertTrue(journal.is_completed(journal.mitigations[0], "APPDESIGN"))
+        self.assertFalse(journal.is_completed(journal.mitigations[0], "ACCEPTED"))
+        self.assertFalse(journal.is_completed(journal.mitigations[2], "APPDESIGN"))
+
+        # New records start on a line of their own
+        journal.open(journal.mitigations)
+        journal.record("a", None, "ACCEPTED", [1])
+        journal.close()
+
+        journal = self.replay()
+
+        self.assertTrue(journal.is_completed(journal.mitigations[0], "ACCEPTED"))
+
+    def test_compact_keeps_unfinished_mitigations(self):
+        journal = Journal(self.console, str(self.path))
+        journal.open(self.mitigations)
+        journal.record("a", None, "APPDESIGN", [1, 2])
+        journal.record("a", None, "ACCEPTED", [1])
+        journal.compact()
+
+        journal = self.replay()
+
+        self.assertEqual(
+            [mitigation.flaw_number for mitigation in journal.mitigations], [2, 3]
+        )
+        self.assertTrue(journal.is_completed(journal.mitigations[0], "APPDESIGN"))
+        self.assertFalse(journal.is_completed(journal.mitigations[0], "ACCEPTED"))
+
+    def test_compact_deletes_finished_journal(self):
+        journal = Journal(self.console, str(self.path))
+        journal.open(self.mitigations)
+        journal.record("a", None, "APPDESIGN", [1, 2, 3])
+        journal.record("a", None, "ACCEPTED", [1, 2, 3])
+        journal.compact()
+
+        self.assertFalse(self.path.exists())
+
+    def test_already_applied_actions_count_as_done(self):
+        mitigations = [
+            self.create_mitigation(
+                1, Annotation("APPDESIGN", self.rule.mitigate_by_design)
+            ),
+            self.create_mitigation(2),
+        ]
+        journal = Journal(self.console, str(self.path))
+        journal.open(mitigations)
+        journal.record("a", None, "APPDESIGN", [2])
+        journal.record("a", None, "ACCEPTED", [1, 2])
+        journal.compact()
+
+        self.assertFalse(self.path.exists())
@@ -1,30 +1,61 @@
-from csv import reader as csv_reader, writer as csv_writer
+from csv import reader as csv_reader
+from hashlib import sha256
 from pathlib import Path
+from sqlite3 import Connection, connect
+from time import time
 from rich.console import Console
 from utils.api import API
+from utils.async_api import AsyncAPI
 from utils.bulk_mitigations_file import BulkMitigations
-from utils.parallel import parallel_execute_tasks_with_progress
+from utils.parallel import (
+    async_iterate_tasks_with_progress,
+    iterate_tasks_with_progress,
+)
 from threading import Lock
 
 
 class AppSandboxInfo:
+    __slots__ = (
+        "application_name",
+        "application_guid",
+        "sandbox_name",
+        "sandbox_guid",
+        "last_scan_date",
+    )
+
     def __init__(
         self,
         application_name: str,
         application_guid: str,
         sandbox_name: str = None,
         sandbox_guid: str = None,
+        last_scan_date: str = None,
     ):
         self.application_name: str = application_name
         self.application_guid: str = application_guid
         self.sandbox_name: str = sandbox_name
         self.sandbox_guid: str = sandbox_guid
 
+        # Only known when resolved from the API, never cached
+        self.last_scan_date: str = last_scan_date
+
+    def to_json(self) -> dict:
+        return {
+            "application_name": self.application_name,
+            "application_guid": self.application_guid,
+            "sandbox_name": self.sandbox_name,
+            "sandbox_guid": self.sandbox_guid,
+        }
+
 
 class ApplicationCache:
-    def __init__(self, file_path: str):
+    SQLITE_HEADER = b"SQLite format 3\x00"
+
+    def __init__(self, console: Console, file_path: str, ttl_hours: float = 0):
+        self._console = console
         self._path = None if file_path is None else Path(file_path)
-        self._entries: list[AppSandboxInfo] = []
+        self._ttl_seconds = ttl_hours * 3600
+        self._connection: Connection = None
         self._lock = Lock()
         self.load()
 
@@ -32,13 +63,70 @@ class ApplicationCache:
         if self._path is None:
             return
 
-        if not self._path.exists():
+        legacy_rows = None
+
+        # The cache used to be an append-only CSV file, migrate it
+        if self._path.exists() and not self._is_sqlite_file():
+            legacy_rows = self._read_legacy_csv()
+            backup_path = self._path.with_name(self._path.name + ".bak")
+            self._path.replace(backup_path)
+            self._console.log(
+                f'Migrating the application cache to SQLite, the original file has been moved to "{backup_path}"'
+            )
+
+        self._connection = connect(self._path, check_same_thread=False)
+
+        # The primary key also serves lookups by application name alone
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS application_cache (
+                application_name TEXT NOT NULL,
+                application_guid TEXT NOT NULL,
+                sandbox_name TEXT NOT NULL DEFAULT '',
+                sandbox_guid TEXT,
+                cached_at REAL NOT NULL,
+                PRIMARY KEY (application_name, sandbox_name)
+            ) WITHOUT ROWID
+            """)
+
+        # Used to estimate how long each scan will take to process
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS scan_finding_counts (
+                application_guid TEXT NOT NULL,
+                sandbox_guid TEXT NOT NULL DEFAULT '',
+                finding_count INTEGER NOT NULL,
+                PRIMARY KEY (application_guid, sandbox_guid)
+            ) WITHOUT ROWID
+            """)
+
+        if legacy_rows is not None:
+            self.add_many(legacy_rows)
+
+        self.compact(vacuum=legacy_rows is not None)
+
+    def close(self) -> None:
+        if self._connection is None:
             return
 
+        with self._lock:
+            self._connection.close()
+            self._connection = None
+
+    def _is_sqlite_file(self) -> bool:
+        with self._path.open("rb") as cache_file:
+            header = cache_file.read(len(self.SQLITE_HEADER))
+
+        # An empty file can be used as a new database
+        return len(header) < 1 or header == self.SQLITE_HEADER
+
+    def _read_legacy_csv(self) -> list[AppSandboxInfo]:
+        entries = []
+
         with self._path.open("r") as cache_file:
-            rows = csv_reader(cache_file)
-            for row in rows:
-                self._entries.append(
+            for row in csv_reader(cache_file):
+                if len(row) < 4:
+                    continue
+
+                entries.append(
                     AppSandboxInfo(
                         row[0],
                         row[1],
@@ -47,41 +135,107 @@ class ApplicationCache:
                     )
                 )
 
+        return entries
+
+    def _expiry_cutoff(self) -> float:
+        return 0 if self._ttl_seconds <= 0 else time() - self._ttl_seconds
+
+    def compact(self, vacuum: bool = False) -> None:
+        if self._connection is None:
+            return
+
+        with self._lock, self._connection:
+            self._connection.execute(
+                "DELETE FROM application_cache WHERE cached_at < ?",
+                (self._expiry_cutoff(),),
+            )
+
+        if vacuum:
+            with self._lock:
+                self._connection.execute("VACUUM")
+
     def add(self, info: AppSandboxInfo) -> None:
-        if self._path is None:
+        self.add_many([info])
+
+    def add_many(self, infos: list[AppSandboxInfo]) -> None:
+        if self._connection is None or len(infos) < 1:
             return
 
-        with self._lock:
-            with self._path.open("a") as cache_file:
-                writer = csv_writer(cache_file)
-                writer.writerow(
-                    [
+        cached_at = time()
+
+        # A single transaction, later entries replace earlier ones
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO application_cache VALUES (?, ?, ?, ?, ?)",
+                [
+                    (
                         info.application_name,
                         info.application_guid,
-                        info.sandbox_name,
+                        info.sandbox_name or "",
                         info.sandbox_guid,
-                    ]
-                )
-                self._entries.append(info)
+                        cached_at,
+                    )
+                    for info in infos
+                ],
+            )
 
-    def get_by_application_name(self, application_name: str) -> AppSandboxInfo:
-        for entry in self._entries:
-            if entry.application_name == application_name:
-                return entry
+    def _get(self, application_name: str, sandbox_name: str) -> AppSandboxInfo:
+        if self._connection is None:
+            return None
 
-        return None
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT application_name, application_guid, sandbox_name, sandbox_guid FROM application_cache WHERE application_name = ? AND sandbox_name = ? AND cached_at >= ?",
+                (application_name, sandbox_name, self._expiry_cutoff()),
+            ).fetchone()
+
+        if row is None:
+            return None
+
+        return AppSandboxInfo(row[0], row[1], row[2] or None, row[3])
+
+    def get_finding_counts(self) -> dict[tuple[str, str], int]:
+        if self._connection is None:
+            return {}
+
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT application_guid, sandbox_guid, finding_count FROM scan_finding_counts"
+            ).fetchall()
+
+        return {(row[0], row[1] or None): row[2] for row in rows}
+
+    def set_finding_counts(self, finding_counts: dict[tuple[str, str], int]) -> None:
+        if self._connection is None or len(finding_counts) < 1:
+            return
+
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO scan_finding_counts VALUES (?, ?, ?)",
+                [
+                    (application_guid, sandbox_guid or "", finding_count)
+                    for (
+                        application_guid,
+                        sandbox_guid,
+                    ), finding_count in finding_counts.items()
+                ],
+            )
+
+    def get_by_application_name(self, application_name: str) -> AppSandboxInfo:
+        return self._get(application_name, "")
 
     def get_by_sandbox_name(
         self, application_name: str, sandbox_name: str
     ) -> AppSandboxInfo:
-        for entry in self._entries:
-            if (
-                entry.application_name == application_name
-                and entry.sandbox_name == sandbox_name
-            ):
-                return entry
+        return self._get(application_name, sandbox_name)
 
-        return None
+
+def get_policy_scan_date(application: dict) -> str:
+    for scan in application.get("scans", []):
+        if scan.get("scan_type") == "STATIC":
+            return scan.get("modified_date")
+
+    return application.get("last_completed_scan_date")
 
 
 def load_applications_from_file(applications_file_path: str) -> list[str]:
@@ -101,147 +255,448 @@ def load_applications_from_file(applications_file_path: str) -> list[str]:
     return application_names
 
 
-def acquire_applications(
-    console: Console,
-    api: API,
-    bulk_mitigations: BulkMitigations,
-    application_names: list[str],
-    application_cache_file_path: str,
-    number_of_threads: int,
-) -> list[AppSandboxInfo]:
-    cache = ApplicationCache(application_cache_file_path)
+def find_cached_applications(
+    cache: ApplicationCache, application_names: list[str], require_scan_dates: bool
+) -> tuple[list[AppSandboxInfo], list[str]]:
     items: list[AppSandboxInfo] = []
-    mappings = {}
     applications_to_resolve = []
+    seen_application_names = set()
 
     for application_name in application_names:
         # Ignore any duplicate names which may have crept in via the file or API
-        if application_name in applications_to_resolve:
+        if application_name in seen_application_names:
             continue
 
-        cached = cache.get_by_application_name(application_name)
+        seen_application_names.add(application_name)
+
+        # Scan dates are not cached so the API must be asked
+        cached = (
+            None
+            if require_scan_dates
+            else cache.get_by_application_name(application_name)
+        )
 
         if cached is not None:
             items.append(cached)
             continue
 
-        if application_name in applications_to_resolve:
-            continue
-
         applications_to_resolve.append(application_name)
 
-    if len(applications_to_resolve) > 0:
+    return items, applications_to_resolve
 
-        def resolve_application_guid(application_name):
-            applications = []
 
-            # The API can return results for similar named applications
-            applications_to_consider = api.get_applications_by_name(application_name)
+def select_application(
+    console: Console, application_name: str, applications_to_consider: list[dict]
+) -> AppSandboxInfo:
+    applications = []
 
-            for application in applications_to_consider:
-                if application["profile"]["name"].lower() == application_name.lower():
-                    applications.append(application)
+    # The API can return results for similar named applications
+    for application in applications_to_consider:
+        if application["profile"]["name"].lower() == application_name.lower():
+            applications.append(application)
 
-            if len(applications) < 1:
-                console.log(
-                    f'Skipping not found app profile named: "{application_name}"'
-                )
-                return
+    if len(applications) < 1:
+        console.log(f'Skipping not found app profile named: "{application_name}"')
+        return None
 
-            if len(applications) > 1:
-                console.log(
-                    f'Skipping ambiguous app profile named: "{application_name}". Make sure this application name has been entered fully and correctly'
-                )
-                return
+    if len(applications) > 1:
+        console.log(
+            f'Skipping ambiguous app profile named: "{application_name}". Make sure this application name has been entered fully and correctly'
+        )
+        return None
 
-            # Use the name from the API rather than the file
-            application_name = applications[0]["profile"]["name"]
+    # Use the name from the API rather than the file
+    return AppSandboxInfo(
+        applications[0]["profile"]["name"],
+        applications[0]["guid"],
+        None,
+        None,
+        get_policy_scan_date(applications[0]),
+    )
 
-            app_info = AppSandboxInfo(
-                application_name, applications[0]["guid"], None, None
-            )
-            items.append(app_info)
-            cache.add(app_info)
 
-        application_count_pluralised = "" if len(applications_to_resolve) == 1 else "s"
+def build_application_name_index(
+    all_applications: list[dict],
+) -> dict[str, list[dict]]:
+    # Names are matched case-insensitively, the same as select_application
+    index: dict[str, list[dict]] = {}
 
-        parallel_execute_tasks_with_progress(
-            console,
-            f"Identifying {len(applications_to_resolve)} application{application_count_pluralised}...",
-            resolve_application_guid,
-            applications_to_resolve,
-            number_of_threads,
+    for application in all_applications:
+        index.setdefault(application["profile"]["name"].lower(), []).append(application)
+
+    return index
+
+
+def resolve_applications_from_listing(
+    console: Console, application_names: list[str], all_applications: list[dict]
+) -> list[AppSandboxInfo]:
+    index = build_application_name_index(all_applications)
+    items: list[AppSandboxInfo] = []
+
+    for application_name in application_names:
+        app_info = select_application(
+            console, application_name, index.get(application_name.lower(), [])
         )
 
-    application_sandboxes_to_resolve: list[AppSandboxInfo] = []
+        if app_info is not None:
+            items.append(app_info)
 
-    all_sandbox_names = bulk_mitigations.get_all_sandbox_names()
+    return items
 
-    if len(all_sandbox_names) < 1:
-        return mappings
+
+def is_listing_resolution(
+    applications_to_resolve: list[str],
+    all_applications: list[dict],
+    listing_threshold: int,
+) -> bool:
+    if len(applications_to_resolve) < 1:
+        return False
+
+    return all_applications is not None or len(applications_to_resolve) >= (
+        listing_threshold
+    )
+
+
+def log_listing_resolution(console: Console, applications_to_resolve: list[str]):
+    application_count_pluralised = "" if len(applications_to_resolve) == 1 else "s"
+    console.log(
+        f"Identifying {len(applications_to_resolve)} application{application_count_pluralised} from a listing of all application profiles..."
+    )
+
+
+def find_cached_sandboxes(
+    cache: ApplicationCache,
+    items: list[AppSandboxInfo],
+    all_sandbox_names,
+    require_scan_dates: bool,
+) -> tuple[list[AppSandboxInfo], list[AppSandboxInfo], set[tuple[str, str]]]:
+    cached_items: list[AppSandboxInfo] = []
+    application_sandboxes_to_resolve: list[AppSandboxInfo] = []
+    cached_sandboxes = set()
 
     # we need to enquire about sandboxes because there could be new sandboxes that were not cached
-    if all_sandbox_names == "ALL":
-        application_sandboxes_to_resolve = items
-    else:
-        # Filter out anything that has been cached
-        for app_info in items.copy():
-            for sandbox_name in all_sandbox_names:
-                cached = cache.get_by_sandbox_name(
-                    app_info.application_name, sandbox_name
-                )
+    if all_sandbox_names == "ALL" or require_scan_dates:
+        return cached_items, items.copy(), cached_sandboxes
 
-                if cached is not None:
-                    items.append(cached)
-                else:
-                    found = False
-                    for processed_sandbox in application_sandboxes_to_resolve:
-                        if (
-                            processed_sandbox.application_name
-                            == app_info.application_name
-                        ):
-                            found = True
-
-                    if not found:
-                        application_sandboxes_to_resolve.append(app_info)
-
-    if len(application_sandboxes_to_resolve) > 0:
-
-        def resolve_sandboxes(app_info: AppSandboxInfo):
-            for sandbox in api.get_sandboxes(app_info.application_guid):
-                # Skip if sandbox is not in scope
-                if (
-                    all_sandbox_names != "ALL"
-                    and sandbox["name"] not in all_sandbox_names
-                ):
-                    continue
+    # Filter out anything that has been cached
+    for app_info in items:
+        needs_resolving = False
 
-                app_info = AppSandboxInfo(
-                    app_info.application_name,
-                    app_info.application_guid,
-                    sandbox["name"],
-                    sandbox["guid"],
-                )
-                items.append(app_info)
+        for sandbox_name in all_sandbox_names:
+            cached = cache.get_by_sandbox_name(app_info.application_name, sandbox_name)
 
-                # Don't bother caching if all sandboxes are in scope
-                if all_sandbox_names != "ALL":
-                    cache.add(app_info)
+            if cached is not None:
+                cached_items.append(cached)
+                cached_sandboxes.add((cached.application_guid, sandbox_name))
+            else:
+                needs_resolving = True
 
-        application_sandboxes_to_resolve_count_pluralised = (
-            "" if len(application_sandboxes_to_resolve) == 1 else "es"
-        )
+        if needs_resolving:
+            application_sandboxes_to_resolve.append(app_info)
 
-        parallel_execute_tasks_with_progress(
-            console,
-            f"Identifying {len(application_sandboxes_to_resolve)} sandbox{application_sandboxes_to_resolve_count_pluralised}...",
-            resolve_sandboxes,
-            application_sandboxes_to_resolve,
-            number_of_threads,
+    return cached_items, application_sandboxes_to_resolve, cached_sandboxes
+
+
+def select_sandboxes(
+    app_info: AppSandboxInfo,
+    sandboxes: list[dict],
+    all_sandbox_names,
+    cached_sandboxes: set[tuple[str, str]],
+) -> list[AppSandboxInfo]:
+    sandbox_infos: list[AppSandboxInfo] = []
+
+    for sandbox in sandboxes:
+        # Skip if sandbox is not in scope
+        if all_sandbox_names != "ALL" and sandbox["name"] not in all_sandbox_names:
+            continue
+
+        # Skip if sandbox has already been found in the cache
+        if (app_info.application_guid, sandbox["name"]) in cached_sandboxes:
+            continue
+
+        sandbox_infos.append(
+            AppSandboxInfo(
+                app_info.application_name,
+                app_info.application_guid,
+                sandbox["name"],
+                sandbox["guid"],
+                sandbox.get("modified"),
+            )
         )
 
+    return sandbox_infos
+
+
+def filter_policy_scope(
+    bulk_mitigations: BulkMitigations, items: list[AppSandboxInfo]
+) -> list[AppSandboxInfo]:
     # Filter out policy level if out of scope for all mitigations
     if not bulk_mitigations.is_policy_in_scope():
-        items = list(filter(lambda item: item.sandbox_name is not None, items))
+        return list(filter(lambda item: item.sandbox_name is not None, items))
 
     return items
+
+
+def get_shard_index(application_guid: str, shard_count: int) -> int:
+    # A stable hash so every runner agrees on which shard an application belongs to
+    return (
+        int.from_bytes(sha256(application_guid.encode("utf-8")).digest()[:8])
+        % shard_count
+    )
+
+
+# Sharded by application before its sandboxes are looked up, so each runner only lists the sandboxes it will process
+def filter_shard(
+    console: Console,
+    items: list[AppSandboxInfo],
+    shard_index: int,
+    shard_count: int,
+) -> list[AppSandboxInfo]:
+    if shard_count < 2:
+        return items
+
+    shard = [
+        app_info
+        for app_info in items
+        if get_shard_index(app_info.application_guid, shard_count) == shard_index
+    ]
+    application_count_pluralised = "" if len(items) == 1 else "s"
+    console.log(
+        f"Shard {shard_index + 1} of {shard_count} has {len(shard)} of the {len(items)} application{application_count_pluralised}"
+    )
+
+    return shard
+
+
+# The applications and sandboxes in scope, the engines only differ in how the requests to resolve them are sent.
+# Responses are added from the caller's thread as each request finishes.
+class ApplicationResolution:
+    def __init__(
+        self,
+        console: Console,
+        bulk_mitigations: BulkMitigations,
+        application_names: list[str],
+        cache: ApplicationCache,
+        require_scan_dates: bool = False,
+        all_applications: list[dict] = None,
+        listing_threshold: int = 100,
+        shard_index: int = 0,
+        shard_count: int = 1,
+    ):
+        self.console = console
+        self.bulk_mitigations = bulk_mitigations
+        self.cache = cache
+        self.require_scan_dates = require_scan_dates
+        self.shard_index = shard_index
+        self.shard_count = shard_count
+        self.items, self.applications_to_resolve = find_cached_applications(
+            cache, application_names, require_scan_dates
+        )
+        self.all_sandbox_names = bulk_mitigations.get_all_sandbox_names()
+        self.application_sandboxes_to_resolve: list[AppSandboxInfo] = []
+        self.cached_sandboxes: set[tuple[str, str]] = set()
+        self.entries_to_cache: list[AppSandboxInfo] = []
+
+        # Above the threshold a few pages listing every application is cheaper than one search per name
+        self.is_listing = is_listing_resolution(
+            self.applications_to_resolve, all_applications, listing_threshold
+        )
+
+        if self.is_listing:
+            log_listing_resolution(console, self.applications_to_resolve)
+
+    def get_applications_description(self) -> str:
+        application_count_pluralised = (
+            "" if len(self.applications_to_resolve) == 1 else "s"
+        )
+        return f"Identifying {len(self.applications_to_resolve)} application{application_count_pluralised}..."
+
+    def add_listing(self, all_applications: list[dict]) -> None:
+        app_infos = resolve_applications_from_listing(
+            self.console, self.applications_to_resolve, all_applications
+        )
+        self.items.extend(app_infos)
+        self.entries_to_cache.extend(app_infos)
+
+    def add_application(self, application_name: str, applications: list[dict]):
+        app_info = select_application(self.console, application_name, applications)
+
+        if app_info is not None:
+            self.items.append(app_info)
+            self.entries_to_cache.append(app_info)
+
+    def finish_applications(self) -> None:
+        self.cache.add_many(self.entries_to_cache)
+        self.entries_to_cache = []
+        self.items = filter_shard(
+            self.console, self.items, self.shard_index, self.shard_count
+        )
+
+        if len(self.all_sandbox_names) < 1:
+            return
+
+        cached_items, self.application_sandboxes_to_resolve, self.cached_sandboxes = (
+            find_cached_sandboxes(
+                self.cache, self.items, self.all_sandbox_names, self.require_scan_dates
+            )
+        )
+        self.items.extend(cached_items)
+
+    def get_sandboxes_description(self) -> str:
+        application_sandboxes_to_resolve_count_pluralised = (
+            "" if len(self.application_sandboxes_to_resolve) == 1 else "es"
+        )
+        return f"Identifying {len(self.application_sandboxes_to_resolve)} sandbox{application_sandboxes_to_resolve_count_pluralised}..."
+
+    def add_sandboxes(self, app_info: AppSandboxInfo, sandboxes: list[dict]):
+        sandbox_infos = select_sandboxes(
+            app_info, sandboxes, self.all_sandbox_names, self.cached_sandboxes
+        )
+        self.items.extend(sandbox_infos)
+
+        # Don't bother caching if all sandboxes are in scope
+        if self.all_sandbox_names != "ALL":
+            self.entries_to_cache.extend(sandbox_infos)
+
+    def finish(self) -> list[AppSandboxInfo]:
+        self.cache.add_many(self.entries_to_cache)
+        self.entries_to_cache = []
+
+        return filter_policy_scope(self.bulk_mitigations, self.items)
+
+
+def acquire_applications(
+    console: Console,
+    api: API,
+    bulk_mitigations: BulkMitigations,
+    application_names: list[str],
+    cache: ApplicationCache,
+    number_of_threads: int,
+    require_scan_dates: bool = False,
+    all_applications: list[dict] = None,
+    listing_threshold: int = 100,
+    shard_index: int = 0,
+    shard_count: int = 1,
+) -> list[AppSandboxInfo]:
+    resolution = ApplicationResolution(
+        console,
+        bulk_mitigations,
+        application_names,
+        cache,
+        require_scan_dates,
+        all_applications,
+        listing_threshold,
+        shard_index,
+        shard_count,
+    )
+
+    if resolution.is_listing:
+        if all_applications is None:
+            all_applications = (
+                api.get_all_applications()
+                if api.retry_policy is None
+                else api.retry_policy.run(api.get_all_applications)
+            )
+
+        resolution.add_listing(all_applications)
+    elif len(resolution.applications_to_resolve) > 0:
+        for task_result in iterate_tasks_with_progress(
+            console,
+            resolution.get_applications_description(),
+            api.get_applications_by_name,
+            resolution.applications_to_resolve,
+            number_of_threads,
+            api.get_concurrency_status,
+            api.retry_policy,
+            api.get_phase_metrics("identifying_applications"),
+        ):
+            if task_result.error is None:
+                resolution.add_application(task_result.task, task_result.result)
+
+    resolution.finish_applications()
+
+    if len(resolution.application_sandboxes_to_resolve) > 0:
+
+        def get_sandboxes(app_info: AppSandboxInfo) -> list[dict]:
+            return api.get_sandboxes(app_info.application_guid)
+
+        for task_result in iterate_tasks_with_progress(
+            console,
+            resolution.get_sandboxes_description(),
+            get_sandboxes,
+            resolution.application_sandboxes_to_resolve,
+            number_of_threads,
+            api.get_concurrency_status,
+            api.retry_policy,
+            api.get_phase_metrics("identifying_sandboxes"),
+        ):
+            if task_result.error is None:
+                resolution.add_sandboxes(task_result.task, task_result.result)
+
+    return resolution.finish()
+
+
+async def async_acquire_applications(
+    console: Console,
+    api: AsyncAPI,
+    bulk_mitigations: BulkMitigations,
+    application_names: list[str],
+    cache: ApplicationCache,
+    require_scan_dates: bool = False,
+    all_applications: list[dict] = None,
+    listing_threshold: int = 100,
+    shard_index: int = 0,
+    shard_count: int = 1,
+) -> list[AppSandboxInfo]:
+    resolution = ApplicationResolution(
+        console,
+        bulk_mitigations,
+        application_names,
+        cache,
+        require_scan_dates,
+        all_applications,
+        listing_threshold,
+        shard_index,
+        shard_count,
+    )
+
+    if resolution.is_listing:
+        if all_applications is None:
+            all_applications = await api.get_all_applications()
+
+        resolution.add_listing(all_applications)
+    elif len(resolution.applications_to_resolve) > 0:
+        async for task_result in async_iterate_tasks_with_progress(
+            console,
+            resolution.get_applications_description(),
+            api.get_applications_by_name,
+            resolution.applications_to_resolve,
+            api.max_concurrent_requests,
+            api.get_concurrency_status,
+            api.retry_policy,
+            api.get_phase_metrics("identifying_applications"),
+        ):
+            if task_result.error is None:
+                resolution.add_application(task_result.task, task_result.result)
+
+    resolution.finish_applications()
+
+    if len(resolution.application_sandboxes_to_resolve) > 0:
+
+        async def get_sandboxes(app_info: AppSandboxInfo) -> list[dict]:
+            return await api.get_sandboxes(app_info.application_guid)
+
+        async for task_result in async_iterate_tasks_with_progress(
+            console,
+            resolution.get_sandboxes_description(),
+            get_sandboxes,
+            resolution.application_sandboxes_to_resolve,
+            api.max_concurrent_requests,
+            api.get_concurrency_status,
+            api.retry_policy,
+            api.get_phase_metrics("identifying_sandboxes"),
+        ):
+            if task_result.error is None:
+                resolution.add_sandboxes(task_result.task, task_result.result)
+
+    return resolution.finish()
@@ -0,0 +1,158 @@
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import patch
+
+from rich.console import Console
+
+from utils.list_of_applications import (
+    AppSandboxInfo,
+    ApplicationCache,
+    filter_shard,
+    get_shard_index,
+    resolve_applications_from_listing,
+)
+
+# The CSV cache file written by earlier versions, with a row for an application and one for a sandbox
+LEGACY_CSV = """Application,a,,
+Application,a,Sandbox,s
+Too short
+"""
+
+
+class ApplicationCacheTest(TestCase):
+    def setUp(self):
+        self.console = Console(quiet=True)
+        self.directory = TemporaryDirectory()
+        self.path = Path(self.directory.name) / "cache.db"
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_closed_cache_leaves_only_the_database(self):
+        cache = ApplicationCache(self.console, str(self.path))
+        cache.add(AppSandboxInfo("Application", "a"))
+        cache.close()
+        cache.close()
+
+        self.assertEqual(
+            [path.name for path in Path(self.directory.name).iterdir()], ["cache.db"]
+        )
+
+        cache = ApplicationCache(self.console, str(self.path))
+
+        self.assertEqual(
+            cache.get_by_application_name("Application").application_guid, "a"
+        )
+        cache.close()
+
+    def test_legacy_csv_is_migrated(self):
+        self.path.write_text(LEGACY_CSV)
+        cache = ApplicationCache(self.console, str(self.path))
+
+        self.assertEqual(
+            cache.get_by_application_name("Application").to_json(),
+            AppSandboxInfo("Application", "a").to_json(),
+        )
+        self.assertEqual(
+            cache.get_by_sandbox_name("Application", "Sandbox").to_json(),
+            AppSandboxInfo("Application", "a", "Sandbox", "s").to_json(),
+        )
+        self.assertEqual(self.path.with_name("cache.db.bak").read_text(), LEGACY_CSV)
+        cache.close()
+
+        # Opened as a database from then on
+        cache = ApplicationCache(self.console, str(self.path))
+
+        self.assertIsNotNone(cache.get_by_sandbox_name("Application", "Sandbox"))
+        cache.close()
+
+    def test_entries_expire_after_the_ttl(self):
+        with patch("utils.list_of_applications.time", return_value=1000):
+            cache = ApplicationCache(self.console, str(self.path), ttl_hours=1)
+            cache.add(AppSandboxInfo("Application", "a"))
+
+        with patch("utils.list_of_applications.time", return_value=1000 + 3599):
+            self.assertIsNotNone(cache.get_by_application_name("Application"))
+
+        with patch("utils.list_of_applications.time", return_value=1000 + 3601):
+            self.assertIsNone(cache.get_by_application_name("Application"))
+            cache.close()
+
+            # Expired entries are removed when the cache is opened again
+            cache = ApplicationCache(self.console, str(self.path), ttl_hours=1)
+            cache.close()
+
+        cache = ApplicationCache(self.console, str(self.path))
+
+        self.assertIsNone(cache.get_by_application_name("Application"))
+        cache.close()
+
+    def test_entries_never_expire_without_a_ttl(self):
+        with patch("utils.list_of_applications.time", return_value=1000):
+            cache = ApplicationCache(self.console, str(self.path))
+            cache.add(AppSandboxInfo("Application", "a"))
+
+        self.assertIsNotNone(cache.get_by_application_name("Application"))
+        cache.close()
+
+
+class FilterShardTest(TestCase):
+    def setUp(self):
+        self.console = Console(quiet=True)
+        self.items = [
+            AppSandboxInfo(f"Application {index}", f"guid-{index}")
+            for index in range(50)
+        ]
+
+    def test_shards_are_disjoint_and_complete(self):
+        shards = [
+            filter_shard(self.console, self.items, index, 3) for index in range(3)
+        ]
+        guids = [app_info.application_guid for shard in shards for app_info in shard]
+
+        self.assertEqual(
+            sorted(guids), sorted(item.application_guid for item in self.items)
+        )
+        self.assertTrue(all(len(shard) > 0 for shard in shards))
+
+    def test_shard_index_is_stable(self):
+        # Every runner must agree, so the index cannot depend on the process's hash seed
+        self.assertEqual(get_shard_index("guid-0", 3), 1)
+
+    def test_single_shard_keeps_everything(self):
+        self.assertIs(filter_shard(self.console, self.items, 0, 1), self.items)
+
+
+def create_application(name: str, guid: str) -> dict:
+    return {"guid": guid, "profile": {"name": name}, "scans": []}
+
+
+class ResolveApplicationsFromListingTest(TestCase):
+    def setUp(self):
+        self.console = Console(quiet=True)
+        self.all_applications = [
+            create_application("Payments Service", "a"),
+            create_application("Duplicate", "b"),
+            create_application("duplicate", "c"),
+            create_application("Payments", "d"),
+        ]
+
+    def resolve(self, application_names: list[str]) -> list[tuple[str, str]]:
+        return [
+            (app_info.application_name, app_info.application_guid)
+            for app_info in resolve_applications_from_listing(
+                self.console, application_names, self.all_applications
+            )
+        ]
+
+    def test_names_match_case_insensitively_with_the_api_name(self):
+        self.assertEqual(
+            self.resolve(["payments service", "PAYMENTS"]),
+            [("Payments Service", "a"), ("Payments", "d")],
+        )
+
+    def test_missing_and_ambiguous_names_are_skipped(self):
+        self.assertEqual(
+            self.resolve(["Missing", "Duplicate", "Payments"]), [("Payments", "d")]
+        )
@@ -0,0 +1,429 @@
+import re
+from bisect import bisect_left
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from json import dump
+from pathlib import Path
+from threading import Lock
+from time import monotonic
+
+from rich.console import Console
+
+# Fixed bucket bounds in seconds, so memory does not grow with the number of requests and Prometheus can read them as they are
+DURATION_BUCKETS_SECONDS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    120.0,
+)
+
+PERCENTILES = {"p50": 0.5, "p95": 0.95, "p99": 0.99}
+
+PROMETHEUS_PREFIX = "veracode_bulk_mitigator"
+
+GUID_PATTERN = re.compile(
+    r"[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}"
+)
+
+# The phase and attempt of the task a request is made for, set by the executors in utils/parallel.py.
+# Threads fetching pages are given a copy, async tasks copy them when they are created.
+current_phase: ContextVar[str] = ContextVar("current_phase", default="other")
+current_attempt: ContextVar[int] = ContextVar("current_attempt", default=1)
+
+
+def get_endpoint_name(method: str, path: str) -> str:
+    # Requests for every application and sandbox are the same endpoint
+    return f"{method} /{GUID_PATTERN.sub('{guid}', path.lstrip('/'))}"
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...] = DURATION_BUCKETS_SECONDS):
+        self.buckets = buckets
+        # The last count is for values above every bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def get_percentile(self, percentile: float) -> float:
+        rank = percentile * self.count
+        cumulative = 0
+
+        for index, bucket_count in enumerate(self.counts):
+            if bucket_count > 0 and cumulative + bucket_count >= rank:
+                lower = 0.0 if index == 0 else self.buckets[index - 1]
+                upper = (
+                    self.max
+                    if index >= len(self.buckets)
+                    else min(self.buckets[index], self.max)
+                )
+
+                # Interpolated within the bucket, the same as Prometheus' histogram_quantile
+                return lower + (upper - lower) * (rank - cumulative) / bucket_count
+
+            cumulative += bucket_count
+
+        return self.max
+
+    def to_json(self) -> dict:
+        return {
+            "count": self.count,
+            "mean": 0.0 if self.count < 1 else self.sum / self.count,
+            **{
+                name: self.get_percentile(percentile)
+                for name, percentile in PERCENTILES.items()
+            },
+            "max": self.max,
+        }
+
+
+class EndpointMetrics:
+    def __init__(self):
+        self.latency = Histogram()
+        self.requests = 0
+        self.retries = 0
+        self.errors = 0
+        self.throttled = 0
+        self.bytes_received = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def to_json(self) -> dict:
+        return {
+            "requests": self.requests,
+            "retries": self.retries,
+            "errors": self.errors,
+            "throttled": self.throttled,
+            "bytes_received": self.bytes_received,
+            "max_in_flight": self.max_in_flight,
+            "latency_seconds": self.latency.to_json(),
+        }
+
+
+class PhaseMetrics:
+    def __init__(self, name: str):
+        self.name = name
+        # From a task being queued to a worker starting it
+        self.queue_wait = Histogram()
+        # Waiting for the governor to allow a request, including throttling pauses
+        self.request_wait = Histogram()
+        self.task_duration = Histogram()
+        self.tasks = 0
+        self.failed_tasks = 0
+        self.retries = 0
+        self.backoff_seconds = 0.0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.started_at: float = None
+        self.finished_at: float = None
+        self._lock = Lock()
+
+    def start_task(self, queued_at: float) -> float:
+        started_at = monotonic()
+
+        with self._lock:
+            if self.started_at is None:
+                self.started_at = started_at
+
+            self.queue_wait.observe(started_at - queued_at)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+        return started_at
+
+    def finish_task(self, started_at: float) -> None:
+        finished_at = monotonic()
+
+        with self._lock:
+            self.task_duration.observe(finished_at - started_at)
+            self.in_flight -= 1
+            self.finished_at = finished_at
+
+    def record_result(self, failed: bool) -> None:
+        with self._lock:
+            self.tasks += 1
+
+            if failed:
+                self.failed_tasks += 1
+
+    def record_retry(self, backoff_seconds: float) -> None:
+        with self._lock:
+            self.retries += 1
+            self.backoff_seconds += backoff_seconds
+
+    def record_backoff(self, seconds: float) -> None:
+        with self._lock:
+            self.backoff_seconds += seconds
+
+    def record_request_wait(self, seconds: float) -> None:
+        with self._lock:
+            self.request_wait.observe(seconds)
+
+    def to_json(self) -> dict:
+        return {
+            "duration_seconds": (
+                0.0
+                if self.started_at is None or self.finished_at is None
+                else self.finished_at - self.started_at
+            ),
+            "tasks": self.tasks,
+            "failed_tasks": self.failed_tasks,
+            "retries": self.retries,
+            "backoff_seconds": self.backoff_seconds,
+            "max_in_flight": self.max_in_flight,
+            "queue_wait_seconds": self.queue_wait.to_json(),
+            "request_wait_seconds": self.request_wait.to_json(),
+            "task_duration_seconds": self.task_duration.to_json(),
+        }
+
+
+# Exported as (metric name, attribute, help)
+ENDPOINT_HISTOGRAMS = [
+    ("request_duration_seconds", "latency", "Time taken by API requests."),
+]
+ENDPOINT_GAUGES = [
+    ("requests", "requests", "API requests made, including retries."),
+    ("request_retries", "retries", "API requests which repeated earlier ones."),
+    ("request_errors", "errors", "API requests which failed."),
+    ("requests_throttled", "throttled", "API requests which were throttled."),
+    ("response_bytes", "bytes_received", "Bytes received in API responses."),
+    (
+        "requests_in_flight_max",
+        "max_in_flight",
+        "The most API requests in flight at once.",
+    ),
+]
+PHASE_HISTOGRAMS = [
+    ("task_queue_wait_seconds", "queue_wait", "Time tasks waited for a worker."),
+    (
+        "request_wait_seconds",
+        "request_wait",
+        "Time requests waited for the concurrency governor, including throttling pauses.",
+    ),
+    ("task_duration_seconds", "task_duration", "Time taken by tasks."),
+]
+PHASE_GAUGES = [
+    ("tasks", "tasks", "Tasks finished, including ones which failed."),
+    ("tasks_failed", "failed_tasks", "Tasks which failed after retrying."),
+    ("task_retries", "retries", "Task attempts which were retried."),
+    ("backoff_seconds", "backoff_seconds", "Time spent backing off before retrying."),
+    ("tasks_in_flight_max", "max_in_flight", "The most tasks running at once."),
+]
+
+
+def escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels: dict[str, str], le: str = None) -> str:
+    if le is not None:
+        labels = {**labels, "le": le}
+
+    return ",".join(
+        f'{name}="{escape_label_value(value)}"' for name, value in labels.items()
+    )
+
+
+# Requests per endpoint and tasks per phase, kept for the whole run and written out at the end of it
+class Metrics:
+    def __init__(self):
+        self.started_at = monotonic()
+        self.endpoints: dict[tuple[str, str], EndpointMetrics] = {}
+        self.phases: dict[str, PhaseMetrics] = {}
+        self._lock = Lock()
+
+    def get_phase(self, name: str) -> PhaseMetrics:
+        with self._lock:
+            if name not in self.phases:
+                self.phases[name] = PhaseMetrics(name)
+
+            return self.phases[name]
+
+    def get_current_phase(self) -> PhaseMetrics:
+        return self.get_phase(current_phase.get())
+
+    def _get_endpoint(self, endpoint: str) -> EndpointMetrics:
+        key = (current_phase.get(), endpoint)
+
+        if key not in self.endpoints:
+            self.endpoints[key] = EndpointMetrics()
+
+        return self.endpoints[key]
+
+    def start_request(self, endpoint: str, attempt: int = 1) -> float:
+        with self._lock:
+            endpoint_metrics = self._get_endpoint(endpoint)
+            endpoint_metrics.requests += 1
+            endpoint_metrics.in_flight += 1
+            endpoint_metrics.max_in_flight = max(
+                endpoint_metrics.max_in_flight, endpoint_metrics.in_flight
+            )
+
+            # Every request of a task which is being tried again repeats earlier work
+            if max(attempt, current_attempt.get()) > 1:
+                endpoint_metrics.retries += 1
+
+        return monotonic()
+
+    def finish_request(
+        self,
+        endpoint: str,
+        started_at: float,
+        bytes_received: int = 0,
+        succeeded: bool = True,
+        throttled: bool = False,
+    ) -> None:
+        seconds = monotonic() - started_at
+
+        with self._lock:
+            endpoint_metrics = self._get_endpoint(endpoint)
+            endpoint_metrics.latency.observe(seconds)
+            endpoint_metrics.bytes_received += bytes_received
+            endpoint_metrics.in_flight -= 1
+
+            if throttled:
+                endpoint_metrics.throttled += 1
+            elif not succeeded:
+                endpoint_metrics.errors += 1
+
+    def to_json(self) -> dict:
+        with self._lock:
+            return {
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "duration_seconds": monotonic() - self.started_at,
+                "endpoints": [
+                    {"phase": phase, "endpoint": endpoint, **metrics.to_json()}
+                    for (phase, endpoint), metrics in sorted(self.endpoints.items())
+                ],
+                "phases": [
+                    {"phase": name, **metrics.to_json()}
+                    for name, metrics in sorted(self.phases.items())
+                ],
+            }
+
+    def write_report(self, file_path: str) -> None:
+        with Path(file_path).open("w", encoding="utf-8") as report_file:
+            dump(self.to_json(), report_file, indent=2)
+
+    def format_prometheus(self) -> str:
+        lines = []
+
+        def add_metric(name: str, metric_type: str, help_text: str, samples) -> None:
+            lines.append(f"# HELP {PROMETHEUS_PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {PROMETHEUS_PREFIX}_{name} {metric_type}")
+
+            for suffix, labels, value in samples:
+                labels_text = "" if len(labels) < 1 else f"{{{labels}}}"
+                lines.append(f"{PROMETHEUS_PREFIX}_{name}{suffix}{labels_text} {value}")
+
+        def get_histogram_samples(labels: dict[str, str], histogram: Histogram):
+            cumulative = 0
+
+            # Buckets are cumulative in Prometheus
+            for bound, bucket_count in zip(
+                (*histogram.buckets, "+Inf"), histogram.counts
+            ):
+                cumulative += bucket_count
+                yield "_bucket", format_labels(labels, str(bound)), cumulative
+
+            yield "_sum", format_labels(labels), histogram.sum
+            yield "_count", format_labels(labels), histogram.count
+
+        with self._lock:
+            endpoints = [
+                ({"phase": phase, "endpoint": endpoint}, metrics)
+                for (phase, endpoint), metrics in sorted(self.endpoints.items())
+            ]
+            phases = [
+                ({"phase": name}, metrics)
+                for name, metrics in sorted(self.phases.items())
+            ]
+
+            for series, histograms, gauges in [
+                (endpoints, ENDPOINT_HISTOGRAMS, ENDPOINT_GAUGES),
+                (phases, PHASE_HISTOGRAMS, PHASE_GAUGES),
+            ]:
+                for name, attribute, help_text in histograms:
+                    add_metric(
+                        name,
+                        "histogram",
+                        help_text,
+                        [
+                            sample
+                            for labels, metrics in series
+                            for sample in get_histogram_samples(
+                                labels, getattr(metrics, attribute)
+                            )
+                        ],
+                    )
+
+                # Values describe the last run so they are gauges, the textfile is replaced by every run
+                for name, attribute, help_text in gauges:
+                    add_metric(
+                        name,
+                        "gauge",
+                        help_text,
+                        [
+                            ("", format_labels(labels), getattr(metrics, attribute))
+                            for labels, metrics in series
+                        ],
+                    )
+
+            add_metric(
+                "phase_duration_seconds",
+                "gauge",
+                "Time from the first task of a phase starting to the last finishing.",
+                [
+                    ("", format_labels(labels), metrics.to_json()["duration_seconds"])
+                    for labels, metrics in phases
+                ],
+            )
+
+        add_metric(
+            "run_duration_seconds",
+            "gauge",
+            "Time taken by the run.",
+            [("", "", monotonic() - self.started_at)],
+        )
+        add_metric(
+            "run_completed_timestamp_seconds",
+            "gauge",
+            "When the run finished.",
+            [("", "", datetime.now(timezone.utc).timestamp())],
+        )
+
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, file_path: str) -> None:
+        # The textfile collector may read at any time, so the file is replaced in one step
+        path = Path(file_path)
+        temporary_path = path.with_name(path.name + ".tmp")
+        temporary_path.write_text(self.format_prometheus(), encoding="utf-8")
+        temporary_path.replace(path)
+
+    def report(
+        self, console: Console, file_path: str = None, prometheus_file_path: str = None
+    ) -> None:
+        if file_path is not None:
+            self.write_report(file_path)
+            console.log(f'Wrote API metrics to "{file_path}"')
+
+        if prometheus_file_path is not None:
+            self.write_prometheus(prometheus_file_path)
+            console.log(f'Wrote API metrics for Prometheus to "{prometheus_file_path}"')
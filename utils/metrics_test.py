@@ -0,0 +1,123 @@
+from json import loads
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from utils.metrics import (
+    PROMETHEUS_PREFIX,
+    Histogram,
+    Metrics,
+    current_phase,
+    get_endpoint_name,
+)
+
+GUID = "0f8fad5b-d9cb-469f-a165-70867728950e"
+
+
+class HistogramTest(TestCase):
+    def test_percentiles_are_interpolated_within_buckets(self):
+        histogram = Histogram((1.0, 2.0))
+
+        for value in (0.5, 1.5, 1.5, 3.0):
+            histogram.observe(value)
+
+        self.assertEqual(histogram.counts, [1, 2, 1])
+        self.assertEqual(histogram.get_percentile(0.5), 1.5)
+        self.assertEqual(histogram.get_percentile(1.0), 3.0)
+        self.assertEqual(histogram.to_json()["mean"], 1.625)
+
+
+class MetricsTest(TestCase):
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.metrics = Metrics()
+        phase_token = current_phase.set("processing_scans")
+
+        try:
+            endpoint = get_endpoint_name(
+                "GET", f"appsec/v2/applications/{GUID}/findings"
+            )
+
+            for attempt, succeeded, throttled in [
+                (1, True, False),
+                (2, False, False),
+                (3, False, True),
+            ]:
+                started_at = self.metrics.start_request(endpoint, attempt)
+                self.metrics.finish_request(
+                    endpoint, started_at, 10, succeeded, throttled
+                )
+
+            phase_metrics = self.metrics.get_phase("processing_scans")
+            phase_metrics.finish_task(phase_metrics.start_task(0.0))
+            phase_metrics.record_result(True)
+            phase_metrics.record_retry(2.5)
+        finally:
+            current_phase.reset(phase_token)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_report_is_written_as_json(self):
+        file_path = Path(self.directory.name) / "metrics.json"
+
+        self.metrics.write_report(str(file_path))
+        report = loads(file_path.read_text(encoding="utf-8"))
+
+        self.assertEqual(len(report["endpoints"]), 1)
+        endpoint = report["endpoints"][0]
+        self.assertEqual(
+            (endpoint["phase"], endpoint["endpoint"]),
+            ("processing_scans", "GET /appsec/v2/applications/{guid}/findings"),
+        )
+        self.assertEqual(
+            (
+                endpoint["requests"],
+                endpoint["retries"],
+                endpoint["errors"],
+                endpoint["throttled"],
+                endpoint["bytes_received"],
+            ),
+            (3, 2, 1, 1, 30),
+        )
+        self.assertEqual(endpoint["latency_seconds"]["count"], 3)
+
+        phase = report["phases"][0]
+        self.assertEqual(phase["phase"], "processing_scans")
+        self.assertEqual(
+            (phase["tasks"], phase["failed_tasks"], phase["retries"]), (1, 1, 1)
+        )
+        self.assertEqual(phase["backoff_seconds"], 2.5)
+
+    def test_textfile_is_written_for_prometheus(self):
+        file_path = Path(self.directory.name) / "metrics.prom"
+
+        self.metrics.write_prometheus(str(file_path))
+        lines = file_path.read_text(encoding="utf-8").splitlines()
+        labels = 'phase="processing_scans",endpoint="GET /appsec/v2/applications/{guid}/findings"'
+        prefix = f"{PROMETHEUS_PREFIX}_request_duration_seconds"
+
+        self.assertEqual(
+            [path.name for path in Path(self.directory.name).iterdir()],
+            ["metrics.prom"],
+        )
+        self.assertIn(f"# TYPE {prefix} histogram", lines)
+        self.assertIn(f'{prefix}_bucket{{{labels},le="+Inf"}} 3', lines)
+        self.assertIn(f"{prefix}_count{{{labels}}} 3", lines)
+        self.assertIn(f"{PROMETHEUS_PREFIX}_request_errors{{{labels}}} 1", lines)
+        self.assertIn(
+            f'{PROMETHEUS_PREFIX}_tasks_failed{{phase="processing_scans"}} 1', lines
+        )
+
+        # Buckets are cumulative
+        bucket_counts = [
+            int(line.rsplit(" ", 1)[1])
+            for line in lines
+            if line.startswith(f"{prefix}_bucket")
+        ]
+        self.assertEqual(bucket_counts, sorted(bucket_counts))
+
+        # Every sample is a name, optional labels and a number
+        for line in lines:
+            if not line.startswith("#"):
+                float(line.rsplit(" ", 1)[1])
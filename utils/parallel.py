@@ -1,32 +1,405 @@
-from concurrent.futures import ThreadPoolExecutor
+from asyncio import Queue, create_task
+from collections.abc import AsyncIterator, Iterable, Iterator, Sized
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from heapq import heappop, heappush
+from itertools import count
+from time import monotonic, sleep
 
 from rich.console import Console
-from rich.progress import Progress
+from rich.progress import Progress, TextColumn
+from rich.traceback import Traceback
 
+from utils.api import APIRequestError
+from utils.metrics import PhaseMetrics, current_attempt, current_phase
+from utils.retry import RetryPolicy, is_waiting_for_circuit
 
-def parallel_execute_tasks_with_progress(
-    console: Console, name, function_to_execute, tasks, max_threads=10
-):
-    with Progress(console=console) as progress:
-        progress_task_id = progress.add_task(name, total=len(tasks))
-
-        def worker_process_progress_wrapper(function_to_execute, task):
-            try:
-                function_to_execute(task)
-            except Exception:
-                console.print_exception()
-
-            progress.advance(progress_task_id)
-
-        with ThreadPoolExecutor(max_workers=max_threads) as pool:
-            futures = []
-            for task in tasks:
-                futures.append(
-                    pool.submit(
-                        worker_process_progress_wrapper, function_to_execute, task
+# Enough queued tasks that no thread waits for the next one, without queueing every task up front
+MAX_IN_FLIGHT_PER_THREAD = 2
+
+
+def create_progress(console: Console, get_status) -> Progress:
+    if get_status is None:
+        return Progress(console=console)
+
+    return Progress(
+        *Progress.get_default_columns(),
+        TextColumn("{task.fields[status]}"),
+        console=console,
+    )
+
+
+def advance_progress(progress: Progress, progress_task_id, get_status):
+    if get_status is None:
+        progress.advance(progress_task_id)
+    else:
+        progress.update(progress_task_id, advance=1, status=get_status())
+
+
+def order_by_cost(tasks: list, get_cost) -> list:
+    if get_cost is None:
+        return tasks
+
+    # Longest first so the biggest tasks are not left running on their own at the end
+    return sorted(tasks, key=get_cost, reverse=True)
+
+
+class TaskTimings:
+    def __init__(self):
+        self.started_at = monotonic()
+        self.completed_at: list[float] = []
+
+    def record(self) -> None:
+        self.completed_at.append(monotonic())
+
+    def log(self, console: Console, name: str) -> None:
+        # Too few tasks for the tail to mean anything
+        if len(self.completed_at) < 10:
+            return
+
+        completed_at = sorted(self.completed_at)
+        tail_started_at = completed_at[int(len(completed_at) * 0.9) - 1]
+        console.log(
+            f"{name.rstrip('.')} took {completed_at[-1] - self.started_at:.1f}s, the last 10% of tasks took {completed_at[-1] - tail_started_at:.1f}s"
+        )
+
+
+def log_task_failure(console: Console, err: Exception):
+    # API errors are expected, only show a traceback for anything else
+    if isinstance(err, APIRequestError):
+        console.log(f"Error: {err}")
+    else:
+        console.print(Traceback.from_exception(type(err), err, err.__traceback__))
+
+
+class TaskResult:
+    def __init__(self, task, result=None, error: Exception = None):
+        self.task = task
+        self.result = result
+        self.error = error
+
+
+def iterate_task_results(
+    function_to_execute,
+    tasks: Iterable,
+    max_threads=10,
+    retry_policy: RetryPolicy = None,
+    max_in_flight: int = None,
+    phase_metrics: PhaseMetrics = None,
+) -> Iterator[TaskResult]:
+    # Tasks are only taken from the iterator as there is room, so memory does not grow with the number of tasks
+    if max_in_flight is None:
+        max_in_flight = max_threads * MAX_IN_FLIGHT_PER_THREAD
+
+    remaining_tasks = iter(tasks)
+    is_exhausted = False
+
+    def run_task(task, attempt: int, queued_at: float):
+        if phase_metrics is None:
+            return function_to_execute(task)
+
+        # Only this executor's threads run its tasks, so there is nothing to reset
+        current_phase.set(phase_metrics.name)
+        current_attempt.set(attempt)
+        started_at = phase_metrics.start_task(queued_at)
+
+        try:
+            return function_to_execute(task)
+        finally:
+            phase_metrics.finish_task(started_at)
+
+    with ThreadPoolExecutor(max_workers=max_threads) as pool:
+        running = {}
+        # Tasks waiting to be retried as (ready at, sequence, attempt, task, is parked)
+        delayed = []
+        sequence = count()
+        # Tasks waiting for an open circuit to close
+        parked_count = 0
+
+        while not is_exhausted or len(running) > 0 or len(delayed) > 0:
+            while len(delayed) > 0 and delayed[0][0] <= monotonic():
+                _, _, attempt, task, is_parked = heappop(delayed)
+
+                if is_parked:
+                    parked_count -= 1
+
+                running[pool.submit(run_task, task, attempt, monotonic())] = (
+                    task,
+                    attempt,
+                )
+
+            # The pool's queue hands the next task to whichever thread is free first. No new tasks are started
+            # while others wait for a circuit, as they would only be parked as well.
+            while (
+                not is_exhausted and parked_count < 1 and len(running) < max_in_flight
+            ):
+                try:
+                    task = next(remaining_tasks)
+                except StopIteration:
+                    is_exhausted = True
+                    break
+
+                running[pool.submit(run_task, task, 1, monotonic())] = (task, 1)
+
+            timeout = None if len(delayed) < 1 else max(0, delayed[0][0] - monotonic())
+
+            if len(running) < 1:
+                if timeout is not None:
+                    sleep(timeout)
+
+                continue
+
+            done, _ = wait(running, timeout, FIRST_COMPLETED)
+
+            for future in done:
+                task, attempt = running.pop(future)
+                err = future.exception()
+
+                if err is None:
+                    if phase_metrics is not None:
+                        phase_metrics.record_result(False)
+
+                    yield TaskResult(task, future.result())
+                    continue
+
+                # Parked without using an attempt or any of the retry budget
+                if is_waiting_for_circuit(err):
+                    if phase_metrics is not None:
+                        phase_metrics.record_backoff(err.retry_in)
+
+                    parked_count += 1
+                    heappush(
+                        delayed,
+                        (
+                            monotonic() + err.retry_in,
+                            next(sequence),
+                            attempt,
+                            task,
+                            True,
+                        ),
                     )
+                    continue
+
+                seconds_to_wait = (
+                    None
+                    if retry_policy is None
+                    else retry_policy.get_retry_delay(err, attempt)
+                )
+
+                # The worker is free to move on while the task waits
+                if seconds_to_wait is not None:
+                    if phase_metrics is not None:
+                        phase_metrics.record_retry(seconds_to_wait)
+
+                    heappush(
+                        delayed,
+                        (
+                            monotonic() + seconds_to_wait,
+                            next(sequence),
+                            attempt + 1,
+                            task,
+                            False,
+                        ),
+                    )
+                    continue
+
+                if phase_metrics is not None:
+                    phase_metrics.record_result(True)
+
+                yield TaskResult(task, error=err)
+
+
+# Lists know their length, other iterables are only counted if the caller says how many tasks there are
+def get_task_total(tasks: Iterable, total: int = None) -> int:
+    if total is None and isinstance(tasks, Sized):
+        return len(tasks)
+
+    return total
+
+
+def record_task_result(
+    console: Console, name, task_result: TaskResult, retry_policy: RetryPolicy = None
+):
+    if task_result.error is None:
+        return
+
+    log_task_failure(console, task_result.error)
+
+    if retry_policy is not None:
+        retry_policy.record_failure(name, task_result.task, task_result.error)
+
+
+# Results are yielded as tasks finish so the caller can aggregate them, failed tasks have already been logged and recorded
+def iterate_tasks_with_progress(
+    console: Console,
+    name,
+    function_to_execute,
+    tasks: Iterable,
+    max_threads=10,
+    get_status=None,
+    retry_policy: RetryPolicy = None,
+    phase_metrics: PhaseMetrics = None,
+    total: int = None,
+) -> Iterator[TaskResult]:
+    timings = TaskTimings()
+
+    with create_progress(console, get_status) as progress:
+        progress_task_id = progress.add_task(
+            name,
+            total=get_task_total(tasks, total),
+            status="" if get_status is None else get_status(),
+        )
+
+        for task_result in iterate_task_results(
+            function_to_execute,
+            tasks,
+            max_threads,
+            retry_policy,
+            phase_metrics=phase_metrics,
+        ):
+            record_task_result(console, name, task_result, retry_policy)
+            timings.record()
+            advance_progress(progress, progress_task_id, get_status)
+
+            yield task_result
+
+    timings.log(console, name)
+
+
+def parallel_execute_tasks_with_progress(
+    console: Console,
+    name,
+    function_to_execute,
+    tasks: Iterable,
+    max_threads=10,
+    get_status=None,
+    retry_policy: RetryPolicy = None,
+    phase_metrics: PhaseMetrics = None,
+    total: int = None,
+) -> list:
+    return [
+        task_result.task
+        for task_result in iterate_tasks_with_progress(
+            console,
+            name,
+            function_to_execute,
+            tasks,
+            max_threads,
+            get_status,
+            retry_policy,
+            phase_metrics,
+            total,
+        )
+        if task_result.error is not None
+    ]
+
+
+async def async_iterate_tasks_with_progress(
+    console: Console,
+    name,
+    coroutine_function,
+    tasks: Iterable,
+    max_concurrency=10,
+    get_status=None,
+    retry_policy: RetryPolicy = None,
+    phase_metrics: PhaseMetrics = None,
+    total: int = None,
+) -> AsyncIterator[TaskResult]:
+    timings = TaskTimings()
+    total = get_task_total(tasks, total)
+    remaining_tasks = iter(tasks)
+    worker_count = max(
+        1, max_concurrency if total is None else min(max_concurrency, total)
+    )
+    # Each worker ends with None, even when stopped by an error, so the caller knows when all have finished
+    results: Queue = Queue()
+
+    # Every task is queued when the phase starts
+    queued_at = monotonic()
+
+    # A fixed number of workers pull from the shared iterator, whichever is free takes the next task
+    async def worker():
+        # Each worker runs as a task of its own with its own copy of the context
+        if phase_metrics is not None:
+            current_phase.set(phase_metrics.name)
+
+        try:
+            for task in remaining_tasks:
+                started_at = (
+                    None
+                    if phase_metrics is None
+                    else phase_metrics.start_task(queued_at)
                 )
 
-            # Wait for the threads to complete
-            for future in futures:
-                future.result()
+                try:
+                    task_result = TaskResult(task, await coroutine_function(task))
+                except Exception as err:
+                    task_result = TaskResult(task, error=err)
+                finally:
+                    if phase_metrics is not None:
+                        phase_metrics.finish_task(started_at)
+
+                if phase_metrics is not None:
+                    phase_metrics.record_result(task_result.error is not None)
+
+                results.put_nowait(task_result)
+        finally:
+            results.put_nowait(None)
+
+    with create_progress(console, get_status) as progress:
+        progress_task_id = progress.add_task(
+            name, total=total, status="" if get_status is None else get_status()
+        )
+        workers = [create_task(worker()) for _ in range(worker_count)]
+        finished_worker_count = 0
+
+        try:
+            while finished_worker_count < len(workers):
+                task_result = await results.get()
+
+                if task_result is None:
+                    finished_worker_count += 1
+                    continue
+
+                record_task_result(console, name, task_result, retry_policy)
+                timings.record()
+                advance_progress(progress, progress_task_id, get_status)
+
+                yield task_result
+
+            # Raises any error which stopped a worker
+            for worker_task in workers:
+                await worker_task
+        finally:
+            # The caller stopped early
+            for worker_task in workers:
+                worker_task.cancel()
+
+    timings.log(console, name)
+
+
+async def async_execute_tasks_with_progress(
+    console: Console,
+    name,
+    coroutine_function,
+    tasks: Iterable,
+    max_concurrency=10,
+    get_status=None,
+    retry_policy: RetryPolicy = None,
+    phase_metrics: PhaseMetrics = None,
+    total: int = None,
+) -> list:
+    return [
+        task_result.task
+        async for task_result in async_iterate_tasks_with_progress(
+            console,
+            name,
+            coroutine_function,
+            tasks,
+            max_concurrency,
+            get_status,
+            retry_policy,
+            phase_metrics,
+            total,
+        )
+        if task_result.error is not None
+    ]
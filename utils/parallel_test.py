@@ -0,0 +1,163 @@
+from threading import Lock
+from unittest import IsolatedAsyncioTestCase, TestCase
+from unittest.mock import patch
+
+from rich.console import Console
+
+from utils.api import APIRequestError, CircuitOpenError
+from utils.parallel import (
+    MAX_IN_FLIGHT_PER_THREAD,
+    async_execute_tasks_with_progress,
+    iterate_task_results,
+    iterate_tasks_with_progress,
+    parallel_execute_tasks_with_progress,
+)
+from utils.retry import MAX_TASK_ATTEMPTS, RetryPolicy
+
+
+class FlakyTasks:
+    def __init__(self, failures: dict[int, list[Exception]]):
+        self.failures = failures
+        self.started: list[int] = []
+        self._lock = Lock()
+
+    def __call__(self, task: int) -> int:
+        with self._lock:
+            self.started.append(task)
+            errors = self.failures.get(task, [])
+            err = errors.pop(0) if len(errors) > 0 else None
+
+        if err is not None:
+            raise err
+
+        return task * 2
+
+
+def create_api_error() -> APIRequestError:
+    return APIRequestError("endpoint:", ConnectionError("Connection reset"))
+
+
+@patch("utils.retry.get_back_off_seconds", return_value=0)
+class IterateTaskResultsTest(TestCase):
+    def setUp(self):
+        self.retry_policy = RetryPolicy(Console(quiet=True), 100)
+
+    def run_tasks(self, function, tasks, max_threads=4, max_in_flight=None) -> dict:
+        return {
+            result.task: result
+            for result in iterate_task_results(
+                function, tasks, max_threads, self.retry_policy, max_in_flight
+            )
+        }
+
+    def test_failed_tasks_are_retried(self, _):
+        function = FlakyTasks({1: [create_api_error()], 2: [create_api_error()] * 2})
+        results = self.run_tasks(function, range(4))
+
+        self.assertEqual(
+            {task: result.result for task, result in results.items()},
+            {0: 0, 1: 2, 2: 4, 3: 6},
+        )
+        self.assertEqual(self.retry_policy.retry_budget, 97)
+
+    def test_tasks_fail_after_max_attempts(self, _):
+        function = FlakyTasks({0: [create_api_error()] * MAX_TASK_ATTEMPTS})
+        results = self.run_tasks(function, range(2))
+
+        self.assertIsInstance(results[0].error, APIRequestError)
+        self.assertEqual(function.started.count(0), MAX_TASK_ATTEMPTS)
+        self.assertEqual(results[1].result, 2)
+
+    def test_other_errors_are_not_retried(self, _):
+        function = FlakyTasks({0: [ValueError("Bad data")]})
+        results = self.run_tasks(function, range(1))
+
+        self.assertIsInstance(results[0].error, ValueError)
+        self.assertEqual(function.started, [0])
+
+    def test_retries_stop_when_the_budget_runs_out(self, _):
+        self.retry_policy.retry_budget = 1
+        function = FlakyTasks({task: [create_api_error()] * 2 for task in range(3)})
+        results = self.run_tasks(function, range(3))
+
+        self.assertEqual(
+            sum(1 for result in results.values() if result.error is not None), 3
+        )
+        self.assertEqual(len(function.started), 4)
+
+    def test_tasks_wait_for_an_open_circuit_without_using_attempts(self, _):
+        waiting = [CircuitOpenError("endpoint", 0.01)] * MAX_TASK_ATTEMPTS
+        function = FlakyTasks({0: waiting + [create_api_error()]})
+        results = self.run_tasks(function, range(3), max_threads=1, max_in_flight=1)
+
+        self.assertEqual(results[0].result, 0)
+        self.assertEqual(self.retry_policy.retry_budget, 99)
+
+        # No other task is started while one waits for the circuit
+        self.assertEqual(function.started, [0] * (MAX_TASK_ATTEMPTS + 2) + [1, 2])
+
+    def test_abandoned_endpoint_fails_at_once(self, _):
+        function = FlakyTasks({0: [CircuitOpenError("endpoint")]})
+        results = self.run_tasks(function, range(1))
+
+        self.assertIsInstance(results[0].error, CircuitOpenError)
+        self.assertEqual(function.started, [0])
+
+
+class ParallelExecuteTasksWithProgressTest(TestCase):
+    def test_failed_tasks_are_returned_and_recorded(self):
+        console = Console(quiet=True)
+        retry_policy = RetryPolicy(console, 0)
+        function = FlakyTasks({1: [create_api_error()], 3: [ValueError("Bad data")]})
+
+        failed_tasks = parallel_execute_tasks_with_progress(
+            console, "Testing", function, list(range(5)), 2, retry_policy=retry_policy
+        )
+
+        self.assertEqual(sorted(failed_tasks), [1, 3])
+        self.assertEqual(
+            sorted(failure.task for failure in retry_policy.failures), [1, 3]
+        )
+
+    def test_tasks_are_taken_as_there_is_room(self):
+        taken = []
+
+        def generate_tasks():
+            for task in range(1000):
+                taken.append(task)
+                yield task
+
+        results = iterate_tasks_with_progress(
+            Console(quiet=True), "Testing", FlakyTasks({}), generate_tasks(), 2
+        )
+        next(results)
+
+        # The generator is not listed up front to count or order it
+        self.assertLessEqual(len(taken), 2 * MAX_IN_FLIGHT_PER_THREAD + 1)
+        self.assertEqual(len(list(results)), 999)
+
+
+class AsyncExecuteTasksWithProgressTest(IsolatedAsyncioTestCase):
+    async def test_failed_tasks_are_returned_and_recorded(self):
+        console = Console(quiet=True)
+        retry_policy = RetryPolicy(console, 0)
+        function = FlakyTasks({1: [create_api_error()], 3: [ValueError("Bad data")]})
+
+        async def coroutine_function(task: int) -> int:
+            return function(task)
+
+        failed_tasks = await async_execute_tasks_with_progress(
+            console,
+            "Testing",
+            coroutine_function,
+            iter(range(5)),
+            2,
+            retry_policy=retry_policy,
+            total=5,
+        )
+
+        self.assertEqual(sorted(failed_tasks), [1, 3])
+        self.assertEqual(sorted(function.started), list(range(5)))
+        self.assertEqual(
+            sorted(failure.task for failure in retry_policy.failures), [1, 3]
+        )
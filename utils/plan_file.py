@@ -0,0 +1,163 @@
+from datetime import datetime, timedelta, timezone
+from json import dump, load
+from pathlib import Path
+from sys import exit
+
+from rich.console import Console
+
+from utils.bulk_mitigations_file import BulkMitigation, BulkMitigations
+from utils.list_of_applications import AppSandboxInfo
+from utils.processor import Annotation, MitigationToAdd
+
+PLAN_FILE_VERSION = 1
+
+
+class Plan:
+    def __init__(self, created_at: datetime, mitigations: list[MitigationToAdd]):
+        self.created_at = created_at
+        self.mitigations = mitigations
+
+
+def mitigation_to_json(mitigation: MitigationToAdd) -> dict:
+    app_info = mitigation.app_info
+
+    latest_annotation = mitigation.latest_annotation
+
+    return {
+        "application_name": app_info.application_name,
+        "application_guid": app_info.application_guid,
+        "sandbox_name": app_info.sandbox_name,
+        "sandbox_guid": app_info.sandbox_guid,
+        "flaw_id": mitigation.flaw_number,
+        "rule_hash": mitigation.bulk_mitigation.hash,
+        "last_seen": mitigation.last_seen.isoformat(),
+        "latest_annotation": (
+            None
+            if latest_annotation is None
+            else {
+                "action": latest_annotation.action,
+                "comment": latest_annotation.comment,
+            }
+        ),
+    }
+
+
+def mitigation_from_json(
+    data: dict, bulk_mitigation: BulkMitigation
+) -> MitigationToAdd:
+    return MitigationToAdd(
+        AppSandboxInfo(
+            data["application_name"],
+            data["application_guid"],
+            data["sandbox_name"],
+            data["sandbox_guid"],
+        ),
+        bulk_mitigation,
+        data["flaw_id"],
+        datetime.fromisoformat(data["last_seen"]),
+        (
+            None
+            if data["latest_annotation"] is None
+            else Annotation(
+                data["latest_annotation"]["action"],
+                data["latest_annotation"]["comment"],
+            )
+        ),
+    )
+
+
+def mitigations_from_json(
+    console: Console,
+    file_path: str,
+    items: list[dict],
+    bulk_mitigations: BulkMitigations,
+) -> list[MitigationToAdd]:
+    rules_by_hash = {item.hash: item for item in bulk_mitigations.items}
+    mitigations: list[MitigationToAdd] = []
+    unknown_rule_count = 0
+
+    for data in items:
+        bulk_mitigation = rules_by_hash.get(data["rule_hash"])
+
+        # The mitigation definition has been changed or removed since the plan was made
+        if bulk_mitigation is None:
+            unknown_rule_count += 1
+            continue
+
+        mitigations.append(mitigation_from_json(data, bulk_mitigation))
+
+    if unknown_rule_count > 0:
+        mitigation_count_pluralised = "" if unknown_rule_count == 1 else "s"
+        console.log(
+            f'Ignoring {unknown_rule_count} mitigation{mitigation_count_pluralised} in "{file_path}" which are no longer in the mitigations file'
+        )
+
+    return mitigations
+
+
+def save_plan(
+    console: Console,
+    file_path: str,
+    mitigations: list[MitigationToAdd],
+    created_at: datetime = None,
+) -> None:
+    plan_data = {
+        "version": PLAN_FILE_VERSION,
+        "created_at": (
+            datetime.now(timezone.utc) if created_at is None else created_at
+        ).isoformat(),
+        "mitigations": [mitigation_to_json(mitigation) for mitigation in mitigations],
+    }
+
+    # Write to a temporary file first so an interrupted save does not leave a partial plan
+    path = Path(file_path)
+    temporary_path = path.with_name(path.name + ".tmp")
+
+    with temporary_path.open("w", encoding="utf-8") as plan_file:
+        dump(plan_data, plan_file, separators=(",", ":"))
+
+    temporary_path.replace(path)
+
+    mitigation_count_pluralised = "" if len(mitigations) == 1 else "s"
+    console.log(
+        f'Wrote a plan of {len(mitigations)} mitigation{mitigation_count_pluralised} to "{file_path}"'
+    )
+
+
+def load_plan(
+    console: Console, file_path: str, bulk_mitigations: BulkMitigations
+) -> Plan:
+    with Path(file_path).open("r", encoding="utf-8") as plan_file:
+        plan_data = load(plan_file)
+
+    if plan_data.get("version") != PLAN_FILE_VERSION:
+        console.log(f'Error: "{file_path}" is not a plan file for this version.')
+        exit(1)
+
+    mitigations = mitigations_from_json(
+        console, file_path, plan_data["mitigations"], bulk_mitigations
+    )
+    created_at = datetime.fromisoformat(plan_data["created_at"])
+
+    # Times without a zone are written by hand, assume UTC
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)
+
+    return Plan(created_at, mitigations)
+
+
+def assert_plan_is_fresh(
+    console: Console, plan: Plan, file_path: str, max_age_hours: float
+) -> None:
+    # 0 means a plan never expires
+    if max_age_hours <= 0:
+        return
+
+    age = datetime.now(timezone.utc) - plan.created_at
+
+    # The findings may have changed since, e.g. flaws fixed or mitigated by hand
+    if age > timedelta(hours=max_age_hours):
+        console.log(
+            f'Error: The plan in "{file_path}" was created {age.total_seconds() / 3600:.1f} hours ago, which is older than --max-plan-age-hours. Create a new plan.'
+        )
+        exit(1)
@@ -0,0 +1,75 @@
+from datetime import datetime, timezone
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from rich.console import Console
+
+from benchmarks.synthetic import generate_bulk_mitigations
+from utils.list_of_applications import AppSandboxInfo
+from utils.plan_file import load_plan, save_plan
+from utils.processor import Annotation, MitigationToAdd
+
+
+class PlanFileTest(TestCase):
+    def setUp(self):
+        self.console = Console(quiet=True)
+        self.bulk_mitigations = generate_bulk_mitigations(self.console, 3)
+        self.directory = TemporaryDirectory()
+        self.file_path = str(Path(self.directory.name) / "plan.json")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_round_trip(self):
+        rules = self.bulk_mitigations.items
+        mitigations = [
+            MitigationToAdd(
+                AppSandboxInfo("Application", "a"),
+                rules[0],
+                1,
+                datetime(2025, 6, 1, 10, tzinfo=timezone.utc),
+            ),
+            MitigationToAdd(
+                AppSandboxInfo("Application", "a", "Sandbox", "s"),
+                rules[2],
+                2,
+                datetime(2025, 6, 2, 10, tzinfo=timezone.utc),
+                Annotation("APPDESIGN", "An earlier comment"),
+            ),
+        ]
+        created_at = datetime(2025, 6, 3, tzinfo=timezone.utc)
+
+        save_plan(self.console, self.file_path, mitigations, created_at)
+        plan = load_plan(self.console, self.file_path, self.bulk_mitigations)
+
+        self.assertEqual(plan.created_at, created_at)
+        self.assertEqual(len(plan.mitigations), len(mitigations))
+
+        for loaded, saved in zip(plan.mitigations, mitigations):
+            self.assertEqual(loaded.app_info.to_json(), saved.app_info.to_json())
+            self.assertIs(loaded.bulk_mitigation, saved.bulk_mitigation)
+            self.assertEqual(loaded.flaw_number, saved.flaw_number)
+            self.assertEqual(loaded.last_seen, saved.last_seen)
+
+        self.assertIsNone(plan.mitigations[0].latest_annotation)
+        self.assertEqual(plan.mitigations[1].latest_annotation.action, "APPDESIGN")
+        self.assertEqual(
+            plan.mitigations[1].latest_annotation.comment, "An earlier comment"
+        )
+
+    def test_changed_rules_are_left_out(self):
+        mitigation = MitigationToAdd(
+            AppSandboxInfo("Application", "a"),
+            self.bulk_mitigations.items[0],
+            1,
+            datetime(2025, 6, 1, tzinfo=timezone.utc),
+        )
+        save_plan(self.console, self.file_path, [mitigation])
+
+        other_rules = generate_bulk_mitigations(self.console, 4)
+        other_rules.items = other_rules.items[1:]
+
+        self.assertEqual(
+            load_plan(self.console, self.file_path, other_rules).mitigations, []
+        )
@@ -0,0 +1,121 @@
+from rich.console import Console
+from rich.table import Table
+
+from utils.bulk_mitigations_file import (
+    BulkMitigation,
+    BulkMitigationIndex,
+    BulkMitigations,
+    build_findings_filters,
+)
+from utils.list_of_applications import AppSandboxInfo
+
+
+# The mitigations in scope for one or more scans, shared so the index and filters are only built once
+class RuleSet:
+    def __init__(
+        self,
+        positions: tuple[int, ...],
+        items: list[BulkMitigation],
+        max_cwes_per_request: int,
+    ):
+        # Where the items are in the mitigations file, so other processes can rebuild the index
+        self.positions = positions
+        self.items = items
+        self.index = BulkMitigationIndex(items)
+        # Compared with the rules last run against a scan in incremental mode
+        self.rule_hashes = frozenset(item.hash for item in items)
+        self.findings_filters = build_findings_filters(items, max_cwes_per_request)
+
+
+class ScanPlan:
+    def __init__(self, app_info: AppSandboxInfo, rule_set: RuleSet):
+        self.app_info = app_info
+        self.rule_set = rule_set
+
+
+def plan_scans(
+    console: Console,
+    bulk_mitigations: BulkMitigations,
+    applications_to_process: list[AppSandboxInfo],
+    max_cwes_per_request: int,
+    filter_unchanged=None,
+) -> list[ScanPlan]:
+    rule_sets: dict[tuple[int, ...], RuleSet] = {}
+    scan_plans: list[ScanPlan] = []
+
+    for app_info in applications_to_process:
+        positions = tuple(
+            position
+            for position, item in enumerate(bulk_mitigations.items)
+            if item.is_in_scope(app_info.sandbox_name)
+        )
+
+        # No mitigation applies so there is no need to download the findings
+        if len(positions) < 1:
+            continue
+
+        if positions not in rule_sets:
+            rule_sets[positions] = RuleSet(
+                positions,
+                [bulk_mitigations.items[position] for position in positions],
+                max_cwes_per_request,
+            )
+
+        scan_plans.append(ScanPlan(app_info, rule_sets[positions]))
+
+    out_of_scope_count = len(applications_to_process) - len(scan_plans)
+
+    # Only the rules in scope for a scan decide whether it has to be processed again, see IncrementalState
+    if filter_unchanged is not None:
+        scan_plans = filter_unchanged(scan_plans)
+
+    log_scan_plan(console, out_of_scope_count, scan_plans)
+
+    return scan_plans
+
+
+def log_scan_plan(
+    console: Console,
+    out_of_scope_count: int,
+    scan_plans: list[ScanPlan],
+):
+    if out_of_scope_count > 0:
+        scan_count_pluralised = "" if out_of_scope_count == 1 else "s"
+        console.log(
+            f"Skipping {out_of_scope_count} scan{scan_count_pluralised} which no mitigation applies to"
+        )
+
+    if len(scan_plans) < 1:
+        return
+
+    request_count = sum(
+        len(scan_plan.rule_set.findings_filters) for scan_plan in scan_plans
+    )
+    scan_count_pluralised = "" if len(scan_plans) == 1 else "s"
+    request_count_pluralised = "" if request_count == 1 else "s"
+    console.log(
+        f"Planning to process {len(scan_plans)} scan{scan_count_pluralised} using at least {request_count} findings request{request_count_pluralised}:"
+    )
+
+    plans_by_rule_set: dict[int, list[ScanPlan]] = {}
+
+    for scan_plan in scan_plans:
+        plans_by_rule_set.setdefault(id(scan_plan.rule_set), []).append(scan_plan)
+
+    table = Table()
+    table.add_column("Scans")
+    table.add_column("Policy Scans")
+    table.add_column("Mitigations In Scope")
+    table.add_column("Requests Per Scan")
+
+    for plans in plans_by_rule_set.values():
+        rule_set = plans[0].rule_set
+        policy_count = sum(1 for plan in plans if plan.app_info.sandbox_name is None)
+        table.add_row(
+            str(len(plans)),
+            str(policy_count),
+            str(len(rule_set.items)),
+            str(len(rule_set.findings_filters)),
+        )
+
+    console.print(table)
@@ -1,33 +1,92 @@
+from asyncio import wrap_future
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
 from datetime import datetime
+from json import loads
+from threading import Lock
 
 from utils.api import API
-from utils.bulk_mitigations_file import BulkMitigations, BulkMitigation
-from utils.list_of_applications import AppSandboxInfo
-from utils.parallel import parallel_execute_tasks_with_progress
+from utils.async_api import AsyncAPI
+from utils.bulk_mitigations_file import (
+    BulkMitigation,
+    BulkMitigationIndex,
+    BulkMitigations,
+    normalise_file_path,
+)
+from utils.incremental import IncrementalState
+from utils.list_of_applications import AppSandboxInfo, ApplicationCache
+from utils.planner import RuleSet, ScanPlan
+from utils.parallel import (
+    TaskResult,
+    async_iterate_tasks_with_progress,
+    iterate_tasks_with_progress,
+    order_by_cost,
+)
 from rich.console import Console
 
 from utils.time import parse_from_veracode_date_time
 
 
+# Only the latest annotation of a finding is ever consulted
+class Annotation:
+    __slots__ = ("action", "comment")
+
+    def __init__(self, action: str, comment: str):
+        self.action = action
+        self.comment = comment
+
+
+# Kept for every matched flaw until the mitigations are applied, so only the fields used downstream are stored
 class MitigationToAdd:
+    __slots__ = (
+        "app_info",
+        "bulk_mitigation",
+        "flaw_number",
+        "last_seen",
+        "latest_annotation",
+    )
+
     def __init__(
         self,
         app_info: AppSandboxInfo,
         bulk_mitigation: BulkMitigation,
         flaw_number: int,
         last_seen: datetime,
-        annotations,
+        latest_annotation: Annotation = None,
     ):
         self.app_info: AppSandboxInfo = app_info
         self.bulk_mitigation: BulkMitigation = bulk_mitigation
         self.flaw_number = flaw_number
         self.last_seen: datetime = last_seen
-        self.annotations = annotations
+        self.latest_annotation: Annotation = latest_annotation
 
 
-def is_candidate_for_bulk_mitigation(
-    finding: dict, bulk_mitigation: BulkMitigation, annotations
+def is_action_already_applied(
+    mitigation: MitigationToAdd, action: str, comment: str
 ) -> bool:
+    last_annotation = mitigation.latest_annotation
+
+    if last_annotation is None:
+        return False
+
+    return (
+        action == last_annotation.action
+        and comment.strip() == last_annotation.comment.strip()
+    )
+
+
+def get_latest_annotation(finding: dict) -> Annotation:
+    annotations = finding.get("annotations")
+
+    if not annotations:
+        return None
+
+    latest = max(annotations, key=lambda x: parse_from_veracode_date_time(x["created"]))
+
+    return Annotation(latest["action"], latest["comment"])
+
+
+def is_status_eligible(finding: dict, bulk_mitigation: BulkMitigation) -> bool:
     status = finding["finding_status"]
 
     # Only check the status if we are not rejecting
@@ -54,6 +113,10 @@ def is_candidate_for_bulk_mitigation(
         if status["resolution_status"] == "REJECTED":
             return False
 
+    return True
+
+
+def matches_signature(finding: dict, bulk_mitigation: BulkMitigation) -> bool:
     details = finding["finding_details"]
 
     if bulk_mitigation.cwe != int(details["cwe"]["id"]):
@@ -65,8 +128,8 @@ def is_candidate_for_bulk_mitigation(
     elif bulk_mitigation.module != details["module"]:
         return False
 
-    if bulk_mitigation.file_path.replace("\\", "/") != details["file_path"].replace(
-        "\\", "/"
+    if normalise_file_path(bulk_mitigation.file_path) != normalise_file_path(
+        details["file_path"]
     ):
         return False
 
@@ -76,16 +139,20 @@ def is_candidate_for_bulk_mitigation(
     if bulk_mitigation.line_number != int(details["file_line_number"]):
         return False
 
+    return True
+
+
+def is_annotation_eligible(
+    bulk_mitigation: BulkMitigation, last_annotation: Annotation
+) -> bool:
     # All done, no annotations
-    if len(annotations) < 1:
+    if last_annotation is None:
         return True
 
     # Nothing further to do if we are approving or rejecting
     if bulk_mitigation.approve is not None or bulk_mitigation.reject is not None:
         return True
 
-    last_annotation = annotations[0]
-
     # If we are only proposing a mitigation by design and that mitigation is already the latest then there is nothing to do
     if (
         bulk_mitigation.mitigate_by_design is not None
@@ -93,9 +160,9 @@ def is_candidate_for_bulk_mitigation(
         and bulk_mitigation.accept_risk is None
     ):
         if (
-            last_annotation["action"] == "APPDESIGN"
+            last_annotation.action == "APPDESIGN"
             and bulk_mitigation.mitigate_by_design.strip()
-            == last_annotation["comment"].strip()
+            == last_annotation.comment.strip()
         ):
             return False
 
@@ -106,9 +173,9 @@ def is_candidate_for_bulk_mitigation(
         and bulk_mitigation.accept_risk is None
     ):
         if (
-            last_annotation["action"] == "APPDESIGN"
+            last_annotation.action == "APPDESIGN"
             and bulk_mitigation.mitigate_by_design.strip()
-            == last_annotation["comment"].strip()
+            == last_annotation.comment.strip()
         ):
             return False
 
@@ -119,69 +186,563 @@ def is_candidate_for_bulk_mitigation(
         and bulk_mitigation.false_positive is None
     ):
         if (
-            last_annotation["action"] == "ACCEPTRISK"
-            and bulk_mitigation.accept_risk.strip()
-            == last_annotation["comment"].strip()
+            last_annotation.action == "ACCEPTRISK"
+            and bulk_mitigation.accept_risk.strip() == last_annotation.comment.strip()
         ):
             return False
 
     return True
 
 
+def is_eligible_for_bulk_mitigation(
+    finding: dict, bulk_mitigation: BulkMitigation, latest_annotation: Annotation
+) -> bool:
+    # The signature is assumed to have been matched already, see BulkMitigationIndex
+    return is_status_eligible(finding, bulk_mitigation) and is_annotation_eligible(
+        bulk_mitigation, latest_annotation
+    )
+
+
+def is_candidate_for_bulk_mitigation(
+    finding: dict, bulk_mitigation: BulkMitigation, latest_annotation: Annotation
+) -> bool:
+    return matches_signature(
+        finding, bulk_mitigation
+    ) and is_eligible_for_bulk_mitigation(finding, bulk_mitigation, latest_annotation)
+
+
+def match_findings(
+    index: BulkMitigationIndex,
+    app_info: AppSandboxInfo,
+    findings: list[dict],
+) -> list[MitigationToAdd]:
+    matched: list[MitigationToAdd] = []
+
+    for finding in findings:
+        candidates = index.get_candidates(finding)
+
+        if len(candidates) < 1:
+            continue
+
+        # Shared by every mitigation matching the finding
+        latest_annotation = get_latest_annotation(finding)
+
+        for bulk_mitigation in candidates:
+            if is_eligible_for_bulk_mitigation(
+                finding, bulk_mitigation, latest_annotation
+            ):
+                last_seen = parse_from_veracode_date_time(
+                    finding["finding_status"]["last_seen_date"]
+                )
+
+                matched.append(
+                    MitigationToAdd(
+                        app_info,
+                        bulk_mitigation,
+                        finding["issue_id"],
+                        last_seen,
+                        latest_annotation,
+                    )
+                )
+
+    return matched
+
+
+# Set in each match process by init_match_process
+match_process_rules: list[BulkMitigation] = []
+match_process_indexes: dict[tuple[int, ...], tuple[BulkMitigationIndex, dict]] = {}
+
+
+def init_match_process(rules: list[BulkMitigation]):
+    global match_process_rules
+    match_process_rules = rules
+
+
+def match_page_in_process(
+    content: bytes, positions: tuple[int, ...]
+) -> tuple[int, int, list[tuple]]:
+    page_data = loads(content) if len(content) > 0 else {}
+    findings = page_data.get("_embedded", {}).get("findings", [])
+
+    # Each process builds the index for a set of rules once
+    if positions not in match_process_indexes:
+        items = [match_process_rules[position] for position in positions]
+        match_process_indexes[positions] = (
+            BulkMitigationIndex(items),
+            {id(item): position for item, position in zip(items, positions)},
+        )
+
+    index, positions_by_id = match_process_indexes[positions]
+
+    # Only the fields needed to rebuild each match are sent back
+    matched = [
+        (
+            mitigation.flaw_number,
+            positions_by_id[id(mitigation.bulk_mitigation)],
+            mitigation.last_seen,
+            mitigation.latest_annotation,
+        )
+        for mitigation in match_findings(index, None, findings)
+    ]
+
+    return len(findings), page_data.get("page", {}).get("total_pages", 0), matched
+
+
+# Decodes and matches pages of findings in other processes, leaving the threads or event loop free for requests
+class MatchPool:
+    def __init__(self, bulk_mitigations: BulkMitigations, process_count: int):
+        self.rules = bulk_mitigations.items
+        self._pool = ProcessPoolExecutor(
+            max_workers=process_count,
+            initializer=init_match_process,
+            initargs=(self.rules,),
+        )
+
+    def submit(self, content: bytes, rule_set: RuleSet) -> Future:
+        return self._pool.submit(match_page_in_process, content, rule_set.positions)
+
+    def to_mitigations(
+        self, app_info: AppSandboxInfo, matched: list[tuple]
+    ) -> list[MitigationToAdd]:
+        return [
+            MitigationToAdd(
+                app_info, self.rules[position], flaw_number, last_seen, annotation
+            )
+            for flaw_number, position, last_seen, annotation in matched
+        ]
+
+    def close(self):
+        self._pool.shutdown(cancel_futures=True)
+
+
+def sort_and_filter_mitigations(
+    console: Console,
+    mitigations_to_add: list[MitigationToAdd],
+) -> list[MitigationToAdd]:
+    # We only need to mitigate the latest unique flaw id
+    latest_mitigations: dict[tuple[str, int], MitigationToAdd] = {}
+    duplicates_dropped: dict[BulkMitigation, int] = {}
+
+    for mitigation in mitigations_to_add:
+        key = (mitigation.app_info.application_guid, mitigation.flaw_number)
+        latest = latest_mitigations.get(key)
+
+        if latest is None:
+            latest_mitigations[key] = mitigation
+            continue
+
+        # On a tie the mitigation seen first is kept
+        if mitigation.last_seen > latest.last_seen:
+            latest_mitigations[key] = mitigation
+            dropped = latest
+        else:
+            dropped = mitigation
+
+        duplicates_dropped[dropped.bulk_mitigation] = (
+            duplicates_dropped.get(dropped.bulk_mitigation, 0) + 1
+        )
+
+    for bulk_mitigation, count in duplicates_dropped.items():
+        duplicate_count_pluralised = "" if count == 1 else "s"
+        console.log(
+            f'Dropped {count} duplicate flaw{duplicate_count_pluralised} for "{bulk_mitigation.friendly_name}"'
+        )
+
+    # Latest first, as the mitigations were listed before they were deduplicated. Ties keep the order they were found in.
+    return sorted(
+        latest_mitigations.values(),
+        key=lambda mitigation: mitigation.last_seen,
+        reverse=True,
+    )
+
+
+def get_scan_key(app_info: AppSandboxInfo) -> tuple[str, str]:
+    return app_info.application_guid, app_info.sandbox_guid
+
+
+class FindingsQuery:
+    def __init__(self, scan_plan: ScanPlan, findings_filter: dict):
+        self.scan_plan = scan_plan
+        self.app_info = scan_plan.app_info
+        self.findings_filter = findings_filter
+
+    def to_json(self) -> dict:
+        return {**self.app_info.to_json(), "findings_filter": self.findings_filter}
+
+
+def build_findings_queries(scan_plans: list[ScanPlan]) -> list[FindingsQuery]:
+    return [
+        FindingsQuery(scan_plan, findings_filter)
+        for scan_plan in scan_plans
+        for findings_filter in scan_plan.rule_set.findings_filters
+    ]
+
+
+# Scans processed before are estimated by their finding count last time, others by the average
+def estimate_query_costs(
+    queries: list[FindingsQuery], application_cache: ApplicationCache
+):
+    finding_counts = application_cache.get_finding_counts()
+    known_counts = [
+        finding_counts[get_scan_key(query.app_info)]
+        for query in queries
+        if get_scan_key(query.app_info) in finding_counts
+    ]
+
+    if len(known_counts) < 1:
+        return None
+
+    average_count = sum(known_counts) / len(known_counts)
+
+    def get_cost(query: FindingsQuery) -> float:
+        finding_count = finding_counts.get(get_scan_key(query.app_info), average_count)
+
+        # The scan's findings are assumed to be spread evenly across its queries
+        return finding_count / len(query.scan_plan.rule_set.findings_filters)
+
+    return get_cost
+
+
+# A scan is only complete once every one of its filtered queries has finished
+class FindingsQueryResults:
+    def __init__(
+        self,
+        console: Console,
+        queries: list[FindingsQuery],
+        mitigations_to_add: list[MitigationToAdd],
+        incremental_state: IncrementalState = None,
+        on_application_complete=None,
+    ):
+        self.console = console
+        self.mitigations_to_add = mitigations_to_add
+        self.incremental_state = incremental_state
+        self.on_application_complete = on_application_complete
+        self._remaining: dict[int, int] = {}
+        self._finding_counts: dict[int, int] = {}
+        self._application_remaining: dict[str, int] = {}
+        self._application_matches: dict[str, list[MitigationToAdd]] = {}
+        self.completed_finding_counts: dict[tuple[str, str], int] = {}
+        self._lock = Lock()
+
+        for query in queries:
+            key = id(query.app_info)
+            self._remaining[key] = self._remaining.get(key, 0) + 1
+            self._finding_counts[key] = 0
+
+            application_guid = query.app_info.application_guid
+            self._application_remaining[application_guid] = (
+                self._application_remaining.get(application_guid, 0) + 1
+            )
+            self._application_matches[application_guid] = []
+
+    def add(
+        self, query: FindingsQuery, finding_count: int, matched: list[MitigationToAdd]
+    ):
+        key = id(query.app_info)
+        application_guid = query.app_info.application_guid
+        completed_application_matches = None
+
+        with self._lock:
+            self.mitigations_to_add.extend(matched)
+            self._finding_counts[key] += finding_count
+            self._remaining[key] -= 1
+            is_scan_complete = self._remaining[key] < 1
+
+            if is_scan_complete:
+                scan_finding_count = self._finding_counts[key]
+                self.completed_finding_counts[get_scan_key(query.app_info)] = (
+                    scan_finding_count
+                )
+
+            # A flaw can be found in the policy scan and any sandbox, so wait for all of them
+            self._application_matches[application_guid].extend(matched)
+            self._application_remaining[application_guid] -= 1
+
+            if self._application_remaining[application_guid] < 1:
+                completed_application_matches = self._application_matches.pop(
+                    application_guid
+                )
+
+        if is_scan_complete:
+            if scan_finding_count < 1:
+                self.console.log(
+                    f'No SAST findings with a CWE to mitigate in app profile: "{query.app_info.application_name}"'
+                )
+
+            if self.incremental_state is not None:
+                self.incremental_state.mark_processed(query.scan_plan)
+
+        if (
+            self.on_application_complete is not None
+            and completed_application_matches is not None
+        ):
+            self.on_application_complete(completed_application_matches)
+
+    def flush(self):
+        # Applications with a query which failed still have the matches from their other queries
+        with self._lock:
+            remaining_matches = list(self._application_matches.values())
+            self._application_matches = {}
+
+        if self.on_application_complete is not None:
+            for matches in remaining_matches:
+                self.on_application_complete(matches)
+
+
+# What a query has matched so far, the engines only differ in how its pages are requested and waited for
+class QueryMatches:
+    def __init__(
+        self, query: FindingsQuery, parallel_pages: int, match_pool: MatchPool = None
+    ):
+        self.query = query
+        self.parallel_pages = parallel_pages
+        self.match_pool = match_pool
+        self.finding_count = 0
+        self.matched: list[MitigationToAdd] = []
+        self.pending: deque[Future] = deque()
+
+    def add_findings(self, findings: list[dict]) -> None:
+        self.finding_count += len(findings)
+        self.matched.extend(
+            match_findings(
+                self.query.scan_plan.rule_set.index, self.query.app_info, findings
+            )
+        )
+
+    def submit_page(self, content: bytes) -> Future:
+        return self.match_pool.submit(content, self.query.scan_plan.rule_set)
+
+    def add_page_matches(self, page_matches: tuple[int, int, list[tuple]]) -> int:
+        self.finding_count += page_matches[0]
+        self.matched.extend(
+            self.match_pool.to_mitigations(self.query.app_info, page_matches[2])
+        )
+
+        # The first page says how many more there are once it has been decoded
+        return page_matches[1]
+
+    def queue_page(self, content: bytes) -> Future:
+        self.pending.append(self.submit_page(content))
+
+        # Hold no more undecoded pages than are being requested
+        return (
+            self.pending.popleft() if len(self.pending) > self.parallel_pages else None
+        )
+
+
+# The queries for the scans and where their matches go, shared by both engines
+class ScanProcessing:
+    def __init__(
+        self,
+        console: Console,
+        scan_plans: list[ScanPlan],
+        mitigations_to_add: list[MitigationToAdd],
+        incremental_state: IncrementalState = None,
+        application_cache: ApplicationCache = None,
+        on_application_complete=None,
+    ):
+        self.scan_plans = scan_plans
+        self.application_cache = application_cache
+        queries = build_findings_queries(scan_plans)
+        self.queries = order_by_cost(
+            queries,
+            (
+                None
+                if application_cache is None
+                else estimate_query_costs(queries, application_cache)
+            ),
+        )
+        self.results = FindingsQueryResults(
+            console,
+            self.queries,
+            mitigations_to_add,
+            incremental_state,
+            on_application_complete,
+        )
+
+    def get_description(self) -> str:
+        scan_count_pluralised = "" if len(self.scan_plans) == 1 else "s"
+        return f"Processing {len(self.scan_plans)} scan{scan_count_pluralised}..."
+
+    def add(self, task_result: TaskResult) -> None:
+        # The matches of a failed query are lost with it
+        if task_result.error is not None:
+            return
+
+        matches: QueryMatches = task_result.result
+        self.results.add(matches.query, matches.finding_count, matches.matched)
+
+    def finish(self) -> None:
+        self.results.flush()
+
+        if self.application_cache is not None:
+            self.application_cache.set_finding_counts(
+                self.results.completed_finding_counts
+            )
+
+
 def process(
     console: Console,
     api: API,
-    bulk_mitigations: BulkMitigations,
-    applications_to_process,
+    scan_plans: list[ScanPlan],
     mitigations_to_add: list[MitigationToAdd],
     number_of_threads: int,
+    incremental_state: IncrementalState = None,
+    findings_page_size: int = 500,
+    parallel_pages: int = 1,
+    application_cache: ApplicationCache = None,
+    on_application_complete=None,
+    match_pool: MatchPool = None,
 ):
-    def process_application(app_info: AppSandboxInfo):
-        findings = api.get_findings(
+    processing = ScanProcessing(
+        console,
+        scan_plans,
+        mitigations_to_add,
+        incremental_state,
+        application_cache,
+        on_application_complete,
+    )
+
+    def process_query(query: FindingsQuery) -> QueryMatches:
+        app_info = query.app_info
+        matches = QueryMatches(query, parallel_pages)
+
+        # Each page is matched and then discarded, only the matches are kept
+        for findings in api.get_findings_pages(
             app_info.application_guid,
             app_info.sandbox_guid,
-        )
+            findings_page_size,
+            query.findings_filter,
+            parallel_pages,
+        ):
+            matches.add_findings(findings)
+
+        return matches
 
-        if findings is None:
-            console.log(
-                f'No SAST findings in app profile: "{app_info.application_name}"'
+    def process_query_in_match_pool(query: FindingsQuery) -> QueryMatches:
+        app_info = query.app_info
+        matches = QueryMatches(query, parallel_pages, match_pool)
+
+        def get_page(page: int) -> bytes:
+            return api.get_findings_page(
+                app_info.application_guid,
+                app_info.sandbox_guid,
+                page,
+                findings_page_size,
+                query.findings_filter,
+                decode=False,
             )
-            return
 
-        for finding in findings:
-            if "annotations" in finding:
-                sorted_annotations = sorted(
-                    finding["annotations"],
-                    key=lambda x: parse_from_veracode_date_time(x["created"]),
-                    reverse=True,
-                )
-            else:
-                sorted_annotations = []
-
-            for bulk_mitigation in bulk_mitigations.items:
-                if is_candidate_for_bulk_mitigation(
-                    finding, bulk_mitigation, sorted_annotations
-                ):
-                    last_seen = parse_from_veracode_date_time(
-                        finding["finding_status"]["last_seen_date"]
-                    )
+        total_pages = matches.add_page_matches(
+            matches.submit_page(get_page(0)).result()
+        )
 
-                    mitigations_to_add.append(
-                        MitigationToAdd(
-                            app_info,
-                            bulk_mitigation,
-                            finding["issue_id"],
-                            last_seen,
-                            sorted_annotations,
-                        )
-                    )
+        for content in api.get_pages_in_order(
+            get_page, range(1, total_pages), parallel_pages
+        ):
+            future = matches.queue_page(content)
+
+            if future is not None:
+                matches.add_page_matches(future.result())
+
+        while len(matches.pending) > 0:
+            matches.add_page_matches(matches.pending.popleft().result())
 
-    application_count_pluralised = "" if len(applications_to_process) == 1 else "s"
+        return matches
 
-    parallel_execute_tasks_with_progress(
+    # Matches are added as each query finishes, from this thread alone
+    for task_result in iterate_tasks_with_progress(
         console,
-        f"Processing {len(applications_to_process)} scan{application_count_pluralised}...",
-        process_application,
-        applications_to_process,
+        processing.get_description(),
+        process_query if match_pool is None else process_query_in_match_pool,
+        processing.queries,
         number_of_threads,
+        api.get_concurrency_status,
+        api.retry_policy,
+        api.get_phase_metrics("processing_scans"),
+    ):
+        processing.add(task_result)
+
+    processing.finish()
+
+
+async def async_process(
+    console: Console,
+    api: AsyncAPI,
+    scan_plans: list[ScanPlan],
+    mitigations_to_add: list[MitigationToAdd],
+    incremental_state: IncrementalState = None,
+    findings_page_size: int = 500,
+    parallel_pages: int = 1,
+    application_cache: ApplicationCache = None,
+    on_application_complete=None,
+    match_pool: MatchPool = None,
+):
+    processing = ScanProcessing(
+        console,
+        scan_plans,
+        mitigations_to_add,
+        incremental_state,
+        application_cache,
+        on_application_complete,
     )
+
+    async def process_query(query: FindingsQuery) -> QueryMatches:
+        app_info = query.app_info
+        matches = QueryMatches(query, parallel_pages)
+
+        # Each page is matched and then discarded, only the matches are kept
+        async for findings in api.get_findings_pages(
+            app_info.application_guid,
+            app_info.sandbox_guid,
+            findings_page_size,
+            query.findings_filter,
+            parallel_pages,
+        ):
+            matches.add_findings(findings)
+
+        return matches
+
+    async def process_query_in_match_pool(query: FindingsQuery) -> QueryMatches:
+        app_info = query.app_info
+        matches = QueryMatches(query, parallel_pages, match_pool)
+
+        def get_page(page: int):
+            return api.get_findings_page_content(
+                app_info.application_guid,
+                app_info.sandbox_guid,
+                page,
+                findings_page_size,
+                query.findings_filter,
+            )
+
+        total_pages = matches.add_page_matches(
+            await wrap_future(matches.submit_page(await get_page(0)))
+        )
+
+        async for content in api.get_pages_in_order(
+            get_page, iter(range(1, total_pages)), parallel_pages
+        ):
+            future = matches.queue_page(content)
+
+            if future is not None:
+                matches.add_page_matches(await wrap_future(future))
+
+        while len(matches.pending) > 0:
+            matches.add_page_matches(await wrap_future(matches.pending.popleft()))
+
+        return matches
+
+    async for task_result in async_iterate_tasks_with_progress(
+        console,
+        processing.get_description(),
+        process_query if match_pool is None else process_query_in_match_pool,
+        processing.queries,
+        api.max_concurrent_requests,
+        api.get_concurrency_status,
+        api.retry_policy,
+        api.get_phase_metrics("processing_scans"),
+    ):
+        processing.add(task_result)
+
+    processing.finish()
@@ -0,0 +1,193 @@
+from datetime import datetime, timedelta
+from json import dumps
+from unittest import TestCase
+
+from rich.console import Console
+
+from benchmarks.synthetic import generate_bulk_mitigations, generate_findings
+from utils.list_of_applications import AppSandboxInfo
+from utils.planner import RuleSet
+from utils.processor import (
+    Annotation,
+    MatchPool,
+    MitigationToAdd,
+    get_latest_annotation,
+    init_match_process,
+    is_action_already_applied,
+    is_candidate_for_bulk_mitigation,
+    match_findings,
+    match_page_in_process,
+    sort_and_filter_mitigations,
+)
+
+RULE_COUNT = 100
+FINDING_COUNT = 2000
+
+
+class MatchFindingsTest(TestCase):
+    def test_same_matches_as_nested_loop(self):
+        bulk_mitigations = generate_bulk_mitigations(Console(quiet=True), RULE_COUNT)
+        findings = generate_findings(FINDING_COUNT, RULE_COUNT, match_ratio=0.5)
+        app_info = AppSandboxInfo("Application", "application-guid")
+
+        expected = [
+            (finding["issue_id"], item)
+            for finding in findings
+            for item in bulk_mitigations.items
+            if is_candidate_for_bulk_mitigation(
+                finding, item, get_latest_annotation(finding)
+            )
+        ]
+        matched = match_findings(bulk_mitigations.index, app_info, findings)
+
+        self.assertGreater(len(expected), 0)
+        self.assertEqual(
+            [
+                (mitigation.flaw_number, mitigation.bulk_mitigation)
+                for mitigation in matched
+            ],
+            expected,
+        )
+        self.assertTrue(all(mitigation.app_info is app_info for mitigation in matched))
+
+
+def get_match_keys(mitigations: list[MitigationToAdd]) -> list[tuple]:
+    return [
+        (
+            mitigation.flaw_number,
+            id(mitigation.bulk_mitigation),
+            mitigation.last_seen,
+            (
+                None
+                if mitigation.latest_annotation is None
+                else mitigation.latest_annotation.action
+            ),
+        )
+        for mitigation in mitigations
+    ]
+
+
+class MatchPoolTest(TestCase):
+    def setUp(self):
+        self.bulk_mitigations = generate_bulk_mitigations(
+            Console(quiet=True), RULE_COUNT
+        )
+        self.findings = generate_findings(500, RULE_COUNT, match_ratio=0.5)
+        self.app_info = AppSandboxInfo("Application", "application-guid")
+
+        # Only some of the rules are in scope, so positions must map back to the right rules
+        positions = tuple(range(0, RULE_COUNT, 2))
+        self.rule_set = RuleSet(
+            positions,
+            [self.bulk_mitigations.items[position] for position in positions],
+            10,
+        )
+        self.content = dumps(
+            {"_embedded": {"findings": self.findings}, "page": {"total_pages": 3}}
+        ).encode("utf-8")
+
+    def test_same_matches_as_matching_in_this_process(self):
+        expected = match_findings(self.rule_set.index, self.app_info, self.findings)
+        match_pool = MatchPool(self.bulk_mitigations, 1)
+
+        try:
+            finding_count, total_pages, matched = match_pool.submit(
+                self.content, self.rule_set
+            ).result()
+            mitigations = match_pool.to_mitigations(self.app_info, matched)
+        finally:
+            match_pool.close()
+
+        self.assertGreater(len(expected), 0)
+        self.assertEqual((finding_count, total_pages), (len(self.findings), 3))
+        self.assertEqual(get_match_keys(mitigations), get_match_keys(expected))
+        self.assertTrue(
+            all(mitigation.app_info is self.app_info for mitigation in mitigations)
+        )
+
+    def test_empty_page_has_no_matches(self):
+        init_match_process(self.bulk_mitigations.items)
+
+        self.assertEqual(
+            match_page_in_process(b"", self.rule_set.positions), (0, 0, [])
+        )
+        self.assertEqual(
+            match_page_in_process(b"{}", self.rule_set.positions), (0, 0, [])
+        )
+
+
+class SortAndFilterMitigationsTest(TestCase):
+    def setUp(self):
+        self.console = Console(quiet=True)
+        self.rules = generate_bulk_mitigations(self.console, 2).items
+        self.last_seen = datetime(2025, 6, 1)
+
+    def create_mitigation(
+        self,
+        application_guid: str,
+        sandbox_guid: str,
+        flaw_number: int,
+        rule_index: int,
+        days: int = 0,
+    ) -> MitigationToAdd:
+        return MitigationToAdd(
+            AppSandboxInfo("Application", application_guid, sandbox_guid, sandbox_guid),
+            self.rules[rule_index],
+            flaw_number,
+            self.last_seen + timedelta(days=days),
+        )
+
+    def test_latest_flaw_is_kept(self):
+        policy = self.create_mitigation("a", None, 1, 0)
+        sandbox = self.create_mitigation("a", "s", 1, 1, days=1)
+
+        self.assertEqual(
+            sort_and_filter_mitigations(self.console, [policy, sandbox]), [sandbox]
+        )
+        self.assertEqual(
+            sort_and_filter_mitigations(self.console, [sandbox, policy]), [sandbox]
+        )
+
+    def test_first_is_kept_on_a_tie(self):
+        first = self.create_mitigation("a", None, 1, 0)
+        second = self.create_mitigation("a", "s", 1, 1)
+
+        self.assertEqual(
+            sort_and_filter_mitigations(self.console, [first, second]), [first]
+        )
+
+    def test_different_flaws_are_kept(self):
+        mitigations = [
+            self.create_mitigation("a", None, 1, 0),
+            self.create_mitigation("a", None, 2, 0),
+            self.create_mitigation("b", None, 1, 0),
+        ]
+
+        self.assertEqual(
+            sort_and_filter_mitigations(self.console, mitigations), mitigations
+        )
+
+    def test_latest_flaws_come_first(self):
+        older = self.create_mitigation("a", None, 1, 0)
+        newer = self.create_mitigation("b", None, 1, 0, days=1)
+
+        self.assertEqual(
+            sort_and_filter_mitigations(self.console, [older, newer]), [newer, older]
+        )
+
+
+class IsActionAlreadyAppliedTest(TestCase):
+    def test_compares_action_and_trimmed_comment(self):
+        rule = generate_bulk_mitigations(Console(quiet=True), 1).items[0]
+        mitigation = MitigationToAdd(
+            AppSandboxInfo("Application", "a"),
+            rule,
+            1,
+            datetime(2025, 6, 1),
+            Annotation("APPDESIGN", rule.mitigate_by_design + "\n"),
+        )
+
+        self.assertTrue(
+            is_action_already_applied(mitigation, "APPDESIGN", rule.mitigate_by_design)
+        )
+        self.assertFalse(is_action_already_applied(mitigation, "ACCEPTED", "Approved"))
@@ -0,0 +1,134 @@
+from json import dump
+from pathlib import Path
+from threading import Lock
+from time import sleep
+
+from rich.console import Console
+
+from utils.api import APIRequestError, CircuitOpenError, get_back_off_seconds
+from utils.metrics import current_attempt
+
+# Max attempts per task before it is written to the failure report
+MAX_TASK_ATTEMPTS = 5
+
+
+def is_waiting_for_circuit(err: Exception) -> bool:
+    return isinstance(err, CircuitOpenError) and err.retry_in is not None
+
+
+class TaskFailure:
+    def __init__(self, phase: str, task, error: Exception):
+        self.phase = phase
+        self.task = task
+        self.error = error
+
+    def to_json(self) -> dict:
+        return {
+            "phase": self.phase,
+            # Tasks which are not plain values say which of their fields identify them
+            "task": self.task.to_json() if hasattr(self.task, "to_json") else self.task,
+            "error": str(self.error),
+        }
+
+
+# Decides when failed tasks are retried. The budget is shared by the whole run so a broken API fails fast.
+class RetryPolicy:
+    def __init__(
+        self, console: Console, retry_budget: int, max_attempts: int = MAX_TASK_ATTEMPTS
+    ):
+        self.console = console
+        self.retry_budget = retry_budget
+        self.max_attempts = max_attempts
+        self.failures: list[TaskFailure] = []
+        self._lock = Lock()
+
+    def try_consume_retry(self) -> bool:
+        with self._lock:
+            if self.retry_budget < 1:
+                return False
+
+            self.retry_budget -= 1
+            return True
+
+    def get_retry_delay(self, err: Exception, attempt: int) -> float:
+        # Only API errors are worth retrying, anything else is a bug or bad data
+        if not isinstance(err, APIRequestError):
+            return None
+
+        if not err.is_retryable():
+            return None
+
+        # A request which has already been retried on its own is not retried again as part of its task
+        if max(attempt, err.attempts) >= self.max_attempts:
+            return None
+
+        # Tasks waiting for a circuit are not retried here, and an endpoint which has been given up on is not retried at all
+        if isinstance(err, CircuitOpenError):
+            return None
+
+        if not self.try_consume_retry():
+            return None
+
+        return get_back_off_seconds(attempt)
+
+    def run(self, function, *args, wait_for_circuit: bool = True):
+        first_attempt = current_attempt.get()
+        attempt = 1
+
+        while True:
+            # Attempts made within a task which is itself being retried count on from the task's attempt
+            attempt_token = current_attempt.set(first_attempt + attempt - 1)
+
+            try:
+                return function(*args)
+            except Exception as err:
+                # Waiting for a circuit to close is not a failed attempt and uses none of the budget
+                if wait_for_circuit and is_waiting_for_circuit(err):
+                    self.console.log(f"Waiting to retry: {err}")
+                    sleep(err.retry_in)
+                    continue
+
+                seconds_to_wait = self.get_retry_delay(err, attempt)
+
+                if seconds_to_wait is None:
+                    if isinstance(err, APIRequestError):
+                        err.attempts = attempt
+
+                    raise
+
+                self.console.log(
+                    f"Retrying in {seconds_to_wait:.1f}s due to an API error: {err}"
+                )
+                sleep(seconds_to_wait)
+                attempt += 1
+            finally:
+                current_attempt.reset(attempt_token)
+
+    def record_failure(self, phase: str, task, err: Exception) -> None:
+        with self._lock:
+            self.failures.append(TaskFailure(phase, task, err))
+
+    def report(self, file_path: str = None) -> None:
+        if len(self.failures) < 1:
+            return
+
+        failure_count_pluralised = "" if len(self.failures) == 1 else "s"
+        self.console.log(
+            f"Error: {len(self.failures)} task{failure_count_pluralised} failed after retrying"
+        )
+
+        if file_path is None:
+            for failure in self.failures:
+                self.console.log(f"{failure.phase} {failure.error}")
+
+            return
+
+        with Path(file_path).open("w", encoding="utf-8") as report_file:
+            dump(
+                [failure.to_json() for failure in self.failures],
+                report_file,
+                indent=2,
+                default=str,
+            )
+
+        self.console.log(f"Failed tasks written to {file_path}")
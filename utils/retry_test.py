@@ -0,0 +1,118 @@
+from json import loads
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import patch
+
+from rich.console import Console
+
+from utils.api import APIRequestError, CircuitOpenError
+from utils.bulk_mitigate import MitigationBatch
+from utils.list_of_applications import AppSandboxInfo
+from utils.planner import ScanPlan
+from utils.processor import FindingsQuery
+from utils.retry import MAX_TASK_ATTEMPTS, RetryPolicy
+
+
+def create_api_error() -> APIRequestError:
+    return APIRequestError("endpoint:", ConnectionError("Connection reset"))
+
+
+class FailureReportTest(TestCase):
+    def test_every_task_type_is_written(self):
+        console = Console(quiet=True)
+        retry_policy = RetryPolicy(console, 0)
+        app_info = AppSandboxInfo("Application", "a", "Sandbox", "s")
+        batch = MitigationBatch("Application", "a", None, "FP", "Not a flaw")
+        batch.flaw_ids = [1, 2]
+
+        for task in (
+            "Application",
+            app_info,
+            FindingsQuery(ScanPlan(app_info, None), {"cwe": "79"}),
+            batch,
+        ):
+            retry_policy.record_failure("Testing", task, create_api_error())
+
+        with TemporaryDirectory() as directory:
+            file_path = Path(directory) / "failures.json"
+            retry_policy.report(str(file_path))
+            tasks = [failure["task"] for failure in loads(file_path.read_text())]
+
+        app_info_json = {
+            "application_name": "Application",
+            "application_guid": "a",
+            "sandbox_name": "Sandbox",
+            "sandbox_guid": "s",
+        }
+        self.assertEqual(
+            tasks,
+            [
+                "Application",
+                app_info_json,
+                {**app_info_json, "findings_filter": {"cwe": "79"}},
+                {
+                    "application_name": "Application",
+                    "application_guid": "a",
+                    "sandbox_guid": None,
+                    "action": "FP",
+                    "comment": "Not a flaw",
+                    "flaw_ids": [1, 2],
+                },
+            ],
+        )
+
+
+@patch("utils.retry.sleep")
+class RetryPolicyRunTest(TestCase):
+    def setUp(self):
+        self.retry_policy = RetryPolicy(Console(quiet=True), 100)
+        self.errors = []
+
+    def function(self) -> str:
+        if len(self.errors) > 0:
+            raise self.errors.pop(0)
+
+        return "done"
+
+    def test_retries_until_success(self, _):
+        self.errors = [create_api_error(), create_api_error()]
+
+        self.assertEqual(self.retry_policy.run(self.function), "done")
+        self.assertEqual(self.retry_policy.retry_budget, 98)
+
+    def test_waits_for_an_open_circuit_without_using_the_budget(self, sleep):
+        self.errors = [CircuitOpenError("endpoint", 5)] * (MAX_TASK_ATTEMPTS + 1)
+
+        self.assertEqual(self.retry_policy.run(self.function), "done")
+        self.assertEqual(self.retry_policy.retry_budget, 100)
+        sleep.assert_called_with(5)
+
+    def test_open_circuit_can_be_left_to_the_caller(self, _):
+        self.errors = [CircuitOpenError("endpoint", 5)]
+
+        with self.assertRaises(CircuitOpenError):
+            self.retry_policy.run(self.function, wait_for_circuit=False)
+
+    def test_exhausted_error_is_not_retried_again(self, _):
+        self.errors = [create_api_error() for _ in range(MAX_TASK_ATTEMPTS)]
+
+        with self.assertRaises(APIRequestError) as context:
+            self.retry_policy.run(self.function)
+
+        self.assertEqual(context.exception.attempts, MAX_TASK_ATTEMPTS)
+        self.assertIsNone(self.retry_policy.get_retry_delay(context.exception, 1))
+        self.assertIsNotNone(self.retry_policy.get_retry_delay(create_api_error(), 1))
+
+    def test_client_error_is_not_retried(self, _):
+        self.errors = [APIRequestError("endpoint:", ValueError("Not found"), 404)]
+
+        with self.assertRaises(APIRequestError):
+            self.retry_policy.run(self.function)
+
+        self.assertEqual(self.retry_policy.retry_budget, 100)
+        self.assertIsNotNone(
+            self.retry_policy.get_retry_delay(
+                APIRequestError("endpoint:", ValueError("Unavailable"), 503), 1
+            )
+        )